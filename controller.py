@@ -1,10 +1,16 @@
-import datetime, json, logging, os, pprint, shutil, smtplib, sys
+import asyncio, collections, datetime, hashlib, json, logging, os, pprint, shutil, smtplib, socket, sys, threading, time
 # from email.Header import Header
 from email.mime.text import MIMEText
 
 sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
 from parse_alma_annex_requests_code.lib.archiver import Archiver
-from parse_alma_annex_requests_code.lib.parser import Parser
+from parse_alma_annex_requests_code.lib.engines import make_parser
+from parse_alma_annex_requests_code.lib.preflight import Preflight
+from parse_alma_annex_requests_code.lib.profiling import CpuProfiler, MemoryProfiler
+from parse_alma_annex_requests_code.lib.rollup import RollupStore, make_rollup_key
+from parse_alma_annex_requests_code.lib.spooler import Spooler
+from parse_alma_annex_requests_code.lib.status import RunStatus, StatusServer
+from parse_alma_annex_requests_code.lib.storage import LocalStorage, make_storage
 # from process_email_pageslips.lib.utility_code import Mailer
 
 
@@ -20,104 +26,588 @@ log = logging.getLogger(__name__)
 log.info( '\n\nstarting log\n============' )
 
 
+class StampMaker(object):
+    """ Makes datetime-stamps, each unlike the last; the stamp names every output-file, and in resident-mode, or under the scheduler, two files can start within one second.
+        The scheduler shares one among all its Controllers. """
+
+    def __init__( self ):
+        self.lock = threading.Lock()
+        self.last_datetime_stamp = ''
+
+    def make_unique_datetime_stamp( self, arcvr ):
+        with self.lock:
+            datetime_stamp = arcvr.make_datetime_stamp( datetime.datetime.now() )
+            while datetime_stamp == self.last_datetime_stamp:
+                time.sleep( 0.05 )  # until the next second
+                datetime_stamp = arcvr.make_datetime_stamp( datetime.datetime.now() )
+            self.last_datetime_stamp = datetime_stamp
+        return datetime_stamp
+
+    ## end class StampMaker()
+
+
 class Controller(object):
     """ Manages steps. """
 
-    def __init__( self ):
-        self.PATH_TO_SOURCE_DIRECTORY = os.environ['ANX_ALMA__PATH_TO_SOURCE_DIRECTORY']  # to check for new files
-        self.PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY = os.environ['ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY']
-        self.PATH_TO_ARCHIVES_PARSED_DIRECTORY = os.environ['ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY']
-        self.PATH_TO_GFA_COUNT_DIRECTORY = os.environ['ANX_ALMA__PATH_TO_GFA_COUNT_DIR']
-        self.PATH_TO_GFA_DATA_DIRECTORY = os.environ['ANX_ALMA__PATH_TO_GFA_DATA_DIR']
-        self.DEV_MODE = json.loads( os.environ['ANX_ALMA__DEV_MODE'] )  # in dev-mode, new-original will not be deleted
+    def __init__( self, memprofile=False, cprofile=False, settings=None, mapping_config=None, stamp_maker=None ):
+        """ `settings` defaults to the env-settings; the scheduler (lib/scheduler.py) passes each source-profile's own, with a shared mapping_config & stamp_maker.
+            `mapping_config` defaults to the one from `ANX_ALMA__MAPPING_CONFIG_PATH`. """
+        settings = os.environ if settings == None else settings
+        self.mapping_config = mapping_config
+        self.stamp_maker = StampMaker() if stamp_maker == None else stamp_maker  # kept across runs, so no two files get the same stamp
+        self.PATH_TO_SOURCE_DIRECTORY = settings['ANX_ALMA__PATH_TO_SOURCE_DIRECTORY']  # to check for new files
+        self.PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY = settings['ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY']
+        self.PATH_TO_ARCHIVES_PARSED_DIRECTORY = settings['ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY']
+        self.PATH_TO_GFA_COUNT_DIRECTORY = settings['ANX_ALMA__PATH_TO_GFA_COUNT_DIR']
+        self.PATH_TO_GFA_DATA_DIRECTORY = settings['ANX_ALMA__PATH_TO_GFA_DATA_DIR']
+        self.DEV_MODE = json.loads( settings['ANX_ALMA__DEV_MODE'] )  # in dev-mode, new-original will not be deleted
+        self.QUARANTINE_MODE = json.loads( settings.get('ANX_ALMA__QUARANTINE_MODE', 'false') )  # in quarantine-mode, bad records are set aside instead of stopping the whole file
+        self.NEW_FILE_QUIET_SECONDS = int( settings.get('ANX_ALMA__NEW_FILE_QUIET_SECONDS', '60') )  # a new file is only picked up once unchanged this long, or once its `.done` marker-file appears
+        self.PATH_TO_QUARANTINE_DIRECTORY = settings.get( 'ANX_ALMA__PATH_TO_QUARANTINE_DIRECTORY', self.PATH_TO_ARCHIVES_PARSED_DIRECTORY )
+        self.GFA_MAX_BATCH_SIZE = int( settings.get('ANX_ALMA__GFA_MAX_BATCH_SIZE', '0') )  # larger files are sent to GFA as several count/data pairs; 0 means no limit
+        self.PATH_TO_SPOOL_DIRECTORY = settings.get( 'ANX_ALMA__PATH_TO_SPOOL_DIRECTORY', '' )  # if set, gfa files are spooled here, then delivered with retries
+        self.CLAIM_FILES = json.loads( settings.get('ANX_ALMA__CLAIM_FILES', 'false') )  # in claim-mode, a new file is renamed into `processing/{worker_id}/` so overlapping runs never share it
+        self.CLAIM_LEASE_SECONDS = int( settings.get('ANX_ALMA__CLAIM_LEASE_SECONDS', '600') )  # a claim whose lease hasn't been renewed this long is returned to the source-directory
+        self.WORKER_ID = settings.get( 'ANX_ALMA__WORKER_ID', f'{socket.gethostname()}-{os.getpid()}' )
+        self.PREFLIGHT = json.loads( settings.get('ANX_ALMA__PREFLIGHT', 'false') )  # if true, a new file is checked (see lib/preflight.py) before it's archived or parsed
+        self.PARSER_ENGINE = settings.get( 'ANX_ALMA__PARSER_ENGINE', 'bs4' )  # see lib/engines.py
+        self.WRITE_JSONL_SIDECAR = json.loads( settings.get('ANX_ALMA__WRITE_JSONL_SIDECAR', 'false') )  # if true, a json-lines file of fully-parsed requests is saved beside the parsed archive
+        self.PIPELINE_MODE = json.loads( settings.get('ANX_ALMA__PIPELINE_MODE', 'false') )  # in pipeline-mode, archiving overlaps parsing, and the output-writes run concurrently
+        self.PATH_TO_PROFILE_DIRECTORY = settings.get( 'ANX_ALMA__PATH_TO_PROFILE_DIRECTORY', self.PATH_TO_ARCHIVES_PARSED_DIRECTORY )
+        self.memprofiler = MemoryProfiler( enabled=memprofile )  # a no-op unless enabled
+        self.CPROFILE = cprofile or json.loads( settings.get('ANX_ALMA__CPROFILE', 'false') )  # if true, file-processing is run under cProfile
+        self.CPROFILE_EVERY_N_RUNS = int( settings.get('ANX_ALMA__CPROFILE_EVERY_N_RUNS', '1') )  # counting only runs that find a file
+        self.cpu_profiler = CpuProfiler( enabled=self.CPROFILE, every_n_runs=self.CPROFILE_EVERY_N_RUNS, counter_filepath=f'{self.PATH_TO_PROFILE_DIRECTORY}/cprofile_run_count.txt' )
+        self.datetime_stamp = ''  # the processed file's stamp, once made; names the profile files
+        self.record_count = 0  # the processed file's request-count, once known
+        self.STATUS_PORT = int( settings.get('ANX_ALMA__STATUS_PORT', '0') )  # in resident-mode, serves status-json on localhost at this port; 0 means no server
+        self.STATUS_SOCKET_PATH = settings.get( 'ANX_ALMA__STATUS_SOCKET_PATH', '' )  # ...or on this unix-socket
+        self.RESIDENT_POLL_SECONDS = float( settings.get('ANX_ALMA__RESIDENT_POLL_SECONDS', '30') )  # in resident-mode, the wait after finding no file
+        self.stop_event = threading.Event()  # set to end resident-mode after the current run
+        self.status = RunStatus()
+        self.ROLLUP_DB_PATH = settings.get( 'ANX_ALMA__ROLLUP_DB_PATH', '' )  # if set, each file's requests are added to this sqlite daily-rollup (see lib/rollup.py)
+        self.rollup_counts = collections.Counter()  # the processed file's rollup counts
+        self.PATH_TO_MANIFEST_DIRECTORY = settings.get( 'ANX_ALMA__PATH_TO_MANIFEST_DIRECTORY', '' )  # if set, each gfa delivery's checksummed manifest is saved here
+        self.source_sha256 = ''  # the processed file's hash, taken as it's loaded; only when manifests are on
+        self.storage = make_storage( settings )  # for the source, archive, quarantine, gfa & manifest directories; see lib/storage.py
+        self.spooler = Spooler( self.PATH_TO_SPOOL_DIRECTORY, storage=self.storage ) if self.PATH_TO_SPOOL_DIRECTORY else None  # the spool is local; deliveries go out through the storage
+        if self.CLAIM_FILES == True and not isinstance( self.storage, LocalStorage ):
+            raise ValueError( 'claim-mode renames files in the local source-directory, so needs ANX_ALMA__STORAGE_BACKEND `local`' )
 
     def process_requests( self ):
         """ Steps caller.
             Called by ```if __name__ == '__main__':``` """
         log.debug( 'starting process_requests()' )
-        arcvr = Archiver()
-        prsr = Parser()
+        arcvr = Archiver( storage=self.storage )
+        prsr = make_parser( self.PARSER_ENGINE, self.mapping_config )
+        ( self.datetime_stamp, self.record_count ) = ( '', 0 )
+
+        ## -- retry spooled deliveries ----------
+        self.deliver_spooled()
+
+        ## -- recover stale claims --------------
+        if self.CLAIM_FILES == True:
+            ( recovered_names, err ) = arcvr.recover_stale_claims( self.PATH_TO_SOURCE_DIRECTORY, self.CLAIM_LEASE_SECONDS )
+            if err:
+                raise Exception( f'Problem recovering stale claims, ``{err}``' )
 
         ## -- check for new file ----------------
-        (new_file_name, err) = arcvr.check_for_new_file( self.PATH_TO_SOURCE_DIRECTORY )
-        if err:
-            raise Exception( f'Problem checking for new file, ``{err}``' )
-        if new_file_name == '':
+        source_file_path = self.find_new_file( arcvr )
+        self.status.set_pending_file_count( arcvr.pending_file_count )
+        if source_file_path == '':
             message = 'no annex requests found; quitting\n\n'
             log.info( message )
+            self.status.finish_run( '', 'no file' )
             sys.exit( message )
 
+        ## -- process file ----------------------
+        self.status.start_run( source_file_path, prsr.mapping_tables.version )
+        start_time = time.perf_counter()
+        self.memprofiler.start()
+        self.mark_stage( 'start' )
+        self.cpu_profiler.start()
+        try:
+            self.process_claimed_or_unclaimed( arcvr, prsr, source_file_path )
+        except BaseException as e:
+            self.status.finish_run( self.datetime_stamp, f'error: {repr(e)}' )
+            raise
+        finally:
+            self.cpu_profiler.stop()
+            self.finish_profiles( arcvr )
+        self.status.finish_run( self.datetime_stamp, 'ok', self.record_count, time.perf_counter() - start_time )
+        log.debug( '-- processing complete --' )
+
+    def run_resident( self, max_iterations=None ):
+        """ Keeps processing files as they arrive -- serving status-json, if configured -- until interrupted, or until stop_event is set.
+            A failed run is logged, and retried after the poll-interval, as the next cron-run would.
+            Called by ```if __name__ == '__main__':``` with `--resident` """
+        status_server = None
+        if self.STATUS_PORT or self.STATUS_SOCKET_PATH:
+            status_server = StatusServer( self.status, port=self.STATUS_PORT, unix_socket_path=self.STATUS_SOCKET_PATH )
+            status_server.start()
+        iteration = 0
+        try:
+            while ( max_iterations == None or iteration < max_iterations ) and not self.stop_event.is_set():
+                iteration += 1
+                try:
+                    self.process_requests()
+                    continue  # more files may be waiting; check again right away
+                except SystemExit:
+                    pass  # no file ready
+                except Exception:
+                    log.exception( 'run failed; retrying after the poll-interval' )
+                self.stop_event.wait( self.RESIDENT_POLL_SECONDS )
+        finally:
+            if status_server:
+                status_server.stop()
+        return
+
+    def mark_stage( self, stage_name ):
+        """ Marks the end of a processing-stage, for the status-server and the memory-profiler.
+            Called by process_requests(), process_file() and process_file_pipelined() """
+        self.status.set_stage( stage_name )
+        self.memprofiler.stage( stage_name )
+        return
+
+    def make_unique_datetime_stamp( self, arcvr ):
+        """ Returns a datetime-stamp unlike the previous file's; see StampMaker.
+            Called by process_file() and process_file_pipelined() """
+        return self.stamp_maker.make_unique_datetime_stamp( arcvr )
+
+    def process_claimed_or_unclaimed( self, arcvr, prsr, source_file_path ):
+        """ In claim-mode, keeps the claim alive while the file is processed, and releases it if processing fails.
+            Called by process_requests() """
+        if self.CLAIM_FILES == True:
+            with arcvr.keep_claim_alive( source_file_path, self.CLAIM_LEASE_SECONDS / 3 ):
+                try:
+                    self.run_process_file( arcvr, prsr, source_file_path )
+                except BaseException:
+                    arcvr.release_claim( source_file_path, self.PATH_TO_SOURCE_DIRECTORY )  # as without claims, the file is retried next run
+                    raise
+        else:
+            self.run_process_file( arcvr, prsr, source_file_path )
+        return
+
+    def finish_profiles( self, arcvr ):
+        """ Writes the memory-profile report and the cpu-profile stats, for whichever profiling ran; both are named after the run's datetime-stamp.
+            Profiling never fails a run.
+            Called by process_requests() """
+        profile_stamp = self.datetime_stamp or arcvr.make_datetime_stamp( datetime.datetime.now() )  # processing may have failed before making its stamp
+        if self.memprofiler.enabled == True:
+            self.memprofiler.stop()
+            err = self.memprofiler.write_report( f'{self.PATH_TO_PROFILE_DIRECTORY}/REQ-ALMA-MEMPROFILE_{profile_stamp}.txt' )
+            if err:
+                log.warning( f'memory-profile not written, ``{err}``' )
+        err = self.cpu_profiler.write_stats( f'{self.PATH_TO_PROFILE_DIRECTORY}/REQ-ALMA-CPROFILE_{profile_stamp}.pstats' )
+        if err:
+            log.warning( f'cpu-profile not written, ``{err}``' )
+        return
+
+    def deliver_spooled( self, after_send=False ):
+        """ Delivers whatever the spool holds that's due; a delivery that fails stays spooled for a later run.
+            With `after_send`, the file's own deliveries are already spooled, so a problem with the pass is logged rather than raised -- raising would leave the original to be re-sent next run.
+            Called by process_requests() and send_gfa_batches() """
+        if self.spooler == None:
+            return
+        ( delivered_names, err ) = self.spooler.deliver_pending()
+        self.status.set_spool_depth( self.spooler.depth() )
+        if err:
+            if after_send == True:
+                log.error( f'Problem delivering spooled gfa files, ``{err}``; the deliveries stay spooled, for a later pass' )
+                return
+            raise Exception( f'Problem delivering spooled gfa files, ``{err}``' )
+        return
+
+    def find_new_file( self, arcvr ):
+        """ Returns the path of the file to process, or '' if none is ready.
+            In claim-mode, a file another worker renames away first is skipped, and the next ready file is tried.
+            Called by process_requests() """
+        while True:
+            ( new_file_name, err ) = arcvr.check_for_new_file( self.PATH_TO_SOURCE_DIRECTORY, quiet_seconds=self.NEW_FILE_QUIET_SECONDS )
+            if err:
+                raise Exception( f'Problem checking for new file, ``{err}``' )
+            if new_file_name == '':
+                return ''
+            if self.CLAIM_FILES == False:
+                return f'{self.PATH_TO_SOURCE_DIRECTORY}/{new_file_name}'
+            ( claimed_filepath, err ) = arcvr.claim_file( self.PATH_TO_SOURCE_DIRECTORY, new_file_name, self.WORKER_ID )
+            if err:
+                raise Exception( f'Problem claiming new file, ``{err}``' )
+            if claimed_filepath:
+                return claimed_filepath
+
+    def run_process_file( self, arcvr, prsr, source_file_path ):
+        """ Processes the file sequentially, or, in pipeline-mode, with process_file_pipelined().
+            Called by process_claimed_or_unclaimed() """
+        if self.PIPELINE_MODE == True:
+            asyncio.run( self.process_file_pipelined(arcvr, prsr, source_file_path) )
+        else:
+            self.process_file( arcvr, prsr, source_file_path )
+        return
+
+    def process_file( self, arcvr, prsr, source_file_path ):
+        """ Archives, parses & sends one file's requests, then deletes the original.
+            Called by run_process_file() """
+        datetime_stamp = self.make_unique_datetime_stamp( arcvr ); assert type(datetime_stamp) == str
+        self.datetime_stamp = datetime_stamp
+
+        ## -- preflight check -------------------
+        if self.preflight_rejects( arcvr, source_file_path, datetime_stamp ):
+            return
+
         ## -- archive original ------------------
-        source_file_path = f'{self.PATH_TO_SOURCE_DIRECTORY}/{new_file_name}'
-        datetime_stamp = arcvr.make_datetime_stamp( datetime.datetime.now() ); assert type(datetime_stamp) == str
         destination_dir_path = self.PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY
         ( archived_original_filepath, err ) = arcvr.copy_original_to_archives( source_file_path, datetime_stamp, destination_dir_path )
         if err:
             raise Exception( f'Problem archiving original, ``{err}``' )
+        self.mark_stage( 'archived' )
 
         ## -- load file -------------------------
-        ( source_file_contents, err ) = prsr.load_file( archived_original_filepath )
+        ( source_file_bytes, err ) = prsr.load_file_bytes( archived_original_filepath, arcvr.storage )  # memory-mapped (if local), & left for the xml-engine to decode
         if err:
             raise Exception( f'Problem loading source-file, ``{err}``' )
+        self.hash_source( source_file_bytes )
+        self.mark_stage( 'loaded' )
 
         ## -- get list of requests from file ----
-        ( items, err ) = prsr.make_item_list( source_file_contents )
+        ( items, err ) = prsr.make_item_list( source_file_bytes )
+        prsr.close_file_bytes( source_file_bytes )
         if err:
             raise Exception( f'Problem creating items_list, ``{err}``' )
+        self.record_count = len( items )
+        self.mark_stage( 'item_list' )
+
+        if self.QUARANTINE_MODE == True and 0 < self.GFA_MAX_BATCH_SIZE < len( items ):
+            ## -- parse & send items, batch by batch
+            ## In quarantine-mode no record can abort the file, so each batch goes to GFA as soon as it's prepared, and archived; see stream_batches().
+            self.stream_batches( arcvr, prsr, items, datetime_stamp )
+            self.mark_stage( 'prepared' )
+        else:
+            ## -- parse items, batch by batch -------
+            ## Batches are held until the whole file has been prepared, so a bad record still stops everything before GFA sees any of it.
+            ( pending_batches, parsed_text, jsonl_text, quarantined_items ) = self.prepare_batches( arcvr, prsr, items )
+            self.mark_stage( 'prepared' )
 
-        ## -- process items ---------------------
-        gfa_items = []
-        for item in items:
-            ( item_id, err01 ) = prsr.parse_item_id( item )
-            ( item_title, err02 ) = prsr.parse_item_title( item )
-            ( item_barcode, err03 ) = prsr.parse_item_barcode( item )
-            ( patron_name, err04 ) = prsr.parse_patron_name( item )
-            ( patron_barcode, err05 ) = prsr.parse_patron_barcode( item )
-            ( patron_note, err06 ) = prsr.parse_patron_note( item )
-            ( parsed_alma_pickup_library, err07 ) = prsr.parse_alma_pickup_library( item )
-            ( parsed_alma_library_code, err08 ) = prsr.parse_alma_library_code( item )
-            ( gfa_entry, err09 ) = prsr.prepare_gfa_entry(
-                item_id, item_title, item_barcode, patron_name, patron_barcode, patron_note, parsed_alma_pickup_library, parsed_alma_library_code )
-            # if err:
-            for err in [ err01, err02, err03, err04, err05, err06, err07, err08, err09 ]:
-                if err:
-                    message = f'Problem preparing data; see logs for more info; quitting'
-                    log.error( message )
-                    ## TODO: email admin, or set cron to do this.
-                    raise Exception( message )
-            gfa_items.append( gfa_entry )
+            ## -- save quarantined items ------------
+            self.save_quarantined( arcvr, quarantined_items, len(items), datetime_stamp )
 
-        ## -- stringify gfa data ----------------
-        ( stringified_data, err ) = arcvr.stringify_gfa_data( gfa_items )
+            ## -- archive parsed-data ---------------
+            ## Before anything goes to GFA: a failed archive-write leaves the original for the next run, which is only safe while GFA hasn't been sent the file.
+            self.save_parsed( arcvr, parsed_text, datetime_stamp )
+            self.save_jsonl( arcvr, jsonl_text, datetime_stamp )
+
+            ## -- send gfa count & data files -------
+            self.send_gfa_batches( arcvr, pending_batches, datetime_stamp )
+        self.save_rollup( datetime_stamp )
+        self.mark_stage( 'written' )
 
-        ## -- archive parsed-data ---------------
-        destination_dir_path = self.PATH_TO_ARCHIVES_PARSED_DIRECTORY
-        ( success, err ) = arcvr.save_parsed_to_archives( stringified_data, datetime_stamp, destination_dir_path )
+        ## -- delete original -------------------
+        self.finish_original( arcvr, source_file_path )
+        return
+
+    async def process_file_pipelined( self, arcvr, prsr, source_file_path ):
+        """ Pipeline-mode version of process_file(); blocking file-work runs in threads via to_thread().
+            - the original is archived while it's read & parsed (from the source, so parsing doesn't wait on the copy)
+            - nothing is written until the archive-copy has succeeded
+            - the quarantine file & the parsed archive (& sidecar) are then written concurrently
+            - the gfa files are sent only once all of those succeed, so a failed archive-write leaves nothing at GFA; the original is deleted last
+            So a file takes about as long as its slowest stage, rather than the sum of them. All batches are held until the whole file is prepared.
+            Called by run_process_file() """
+        datetime_stamp = self.make_unique_datetime_stamp( arcvr ); assert type(datetime_stamp) == str
+        self.datetime_stamp = datetime_stamp
+
+        ## -- preflight check -------------------
+        if self.preflight_rejects( arcvr, source_file_path, datetime_stamp ):
+            return
+
+        ## -- archive original, while parsing ---
+        archive_task = asyncio.create_task( self.to_thread( arcvr.copy_original_to_archives, source_file_path, datetime_stamp, self.PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY ) )
+        try:
+            ( items, prepared ) = await self.to_thread( self.load_and_prepare, arcvr, prsr, source_file_path )
+        finally:
+            ( archived_original_filepath, err ) = await archive_task   # never left running, even if parsing failed
+        if err:
+            raise Exception( f'Problem archiving original, ``{err}``' )
+        ( pending_batches, parsed_text, jsonl_text, quarantined_items ) = prepared
+        self.record_count = len( items )
+        self.mark_stage( 'prepared' )
+
+        ## -- write archives, concurrently ------
+        ## These are safe to redo, so a failure here leaves the original for the next run; GFA is only sent the file once they've all succeeded.
+        results = await asyncio.gather(
+            self.to_thread( self.save_quarantined, arcvr, quarantined_items, len(items), datetime_stamp ),
+            self.to_thread( self.save_parsed, arcvr, parsed_text, datetime_stamp ),
+            self.to_thread( self.save_jsonl, arcvr, jsonl_text, datetime_stamp ),
+            return_exceptions=True )   # every write finishes before any failure is raised
+        for result in results:
+            if isinstance( result, BaseException ):
+                raise result
+
+        ## -- send gfa count & data files -------
+        await self.to_thread( self.send_gfa_batches, arcvr, pending_batches, datetime_stamp )
+        await self.to_thread( self.save_rollup, datetime_stamp )
+        self.mark_stage( 'written' )
+
+        ## -- delete original -------------------
+        await self.to_thread( self.finish_original, arcvr, source_file_path )
+        return
+
+    def to_thread( self, func, *args ):
+        """ Returns asyncio.to_thread() for `func`, profiled on its thread when the run is being profiled.
+            Called by process_file_pipelined() """
+        return asyncio.to_thread( self.cpu_profiler.profiled(func), *args )
+
+    def preflight_rejects( self, arcvr, source_file_path, datetime_stamp ):
+        """ Runs the preflight check, if enabled; returns True if the file was rejected and set aside.
+            In quarantine-mode a rejected file is saved, with its reject-report, to the quarantine-directory, and counts as done;
+              otherwise processing stops, with the report, and the file stays for the next run.
+            Called by process_file() and process_file_pipelined() """
+        if self.PREFLIGHT == False:
+            return False
+        preflight = Preflight( self.mapping_config )
+        ( report, err ) = preflight.check_file( source_file_path, arcvr.storage )
+        if err:
+            raise Exception( f'Problem running preflight check, ``{err}``' )
+        if report['passed'] == True:
+            return False
+        report_text = preflight.format_report( report )
+        log.error( f'preflight rejected file; report, ``{report_text}``' )
+        if self.QUARANTINE_MODE == False:
+            raise Exception( f'Preflight rejected file; ``{report_text}``' )
+        ( rejected_filepath, err ) = arcvr.save_rejected_to_archives( source_file_path, report_text, datetime_stamp, self.PATH_TO_QUARANTINE_DIRECTORY )
+        if err:
+            raise Exception( f'Problem saving rejected file, ``{err}``' )
+        log.warning( f'rejected file saved to ``{rejected_filepath}``' )
+        self.finish_original( arcvr, source_file_path )
+        return True
+
+    def load_and_prepare( self, arcvr, prsr, source_file_path ):
+        """ Loads & prepares a file without sending anything; returns ( items, (pending_batches, parsed_text, jsonl_text, quarantined_items) ).
+            Called by process_file_pipelined() """
+        ( source_file_bytes, err ) = prsr.load_file_bytes( source_file_path, arcvr.storage )
+        if err:
+            raise Exception( f'Problem loading source-file, ``{err}``' )
+        self.hash_source( source_file_bytes )
+        ( items, err ) = prsr.make_item_list( source_file_bytes )
+        prsr.close_file_bytes( source_file_bytes )
+        if err:
+            raise Exception( f'Problem creating items_list, ``{err}``' )
+        return ( items, self.prepare_batches(arcvr, prsr, items) )
+
+    def hash_source( self, source_file_bytes ):
+        """ Hashes the loaded original for the gfa manifests, from the mapping the parser reads; the file isn't read again.
+            Called by process_file() and load_and_prepare() """
+        self.source_sha256 = hashlib.sha256( source_file_bytes ).hexdigest() if self.PATH_TO_MANIFEST_DIRECTORY else ''
+        return
+
+    def prepare_batches( self, arcvr, prsr, items ):
+        """ Prepares the file's items, batch by batch, sending nothing; returns ( pending_batches, parsed_text, jsonl_text, quarantined_items ).
+            Called by process_file() and load_and_prepare() """
+        gfa_date_str = prsr.prepare_gfa_datetime()
+        batches = self.make_batches( items )
+        self.rollup_counts = collections.Counter()
+        quarantined_items = []
+        parsed_texts = []
+        jsonl_texts = []
+        pending_batches = []
+        for ( batch_index, batch_items ) in enumerate( batches ):
+            ( gfa_items, stringified_data, jsonl_text ) = self.prepare_batch( arcvr, prsr, batch_items, gfa_date_str, quarantined_items )
+            parsed_texts.append( stringified_data )
+            jsonl_texts.append( jsonl_text )
+            batch_number = batch_index + 1 if len(batches) > 1 else None
+            pending_batches.append( (len(batch_items), len(gfa_items), stringified_data, batch_number, [gfa_item.item_barcode for gfa_item in gfa_items]) )
+        if prsr.sanitizer.counts:
+            log.info( f'sanitized gfa fields, ``{dict(prsr.sanitizer.counts)}``' )
+        return ( pending_batches, ''.join(parsed_texts), ''.join(jsonl_texts), quarantined_items )
+
+    def stream_batches( self, arcvr, prsr, items, datetime_stamp ):
+        """ Quarantine-mode version of prepare_batches() & the writes after it: each batch is sent as soon as it's prepared, so GFA can take the first before the last is parsed.
+            - no record can abort the file in quarantine-mode; before each batch is sent, the quarantine file & parsed archive (& sidecar) are rewritten to hold every batch so far
+            - until a batch has gone out, a failed write raises, leaving the original for the next run
+            - after that, a retry would re-send what GFA already has; so a failed write is logged, the remaining batches still go, and the original is finished -- its archived copy holds every record
+            Called by process_file() """
+        gfa_date_str = prsr.prepare_gfa_datetime()
+        batches = self.make_batches( items )
+        self.rollup_counts = collections.Counter()
+        ( quarantined_items, parsed_texts, jsonl_texts ) = ( [], [], [] )
+        ( prepared_item_count, sent_any ) = ( 0, False )
+        for ( batch_index, batch_items ) in enumerate( batches ):
+            ( gfa_items, stringified_data, jsonl_text ) = self.prepare_batch( arcvr, prsr, batch_items, gfa_date_str, quarantined_items )
+            parsed_texts.append( stringified_data )
+            jsonl_texts.append( jsonl_text )
+            prepared_item_count += len( batch_items )
+            try:
+                self.save_quarantined( arcvr, quarantined_items, prepared_item_count, datetime_stamp )
+                self.save_parsed( arcvr, ''.join(parsed_texts), datetime_stamp )
+                self.save_jsonl( arcvr, ''.join(jsonl_texts), datetime_stamp )
+            except Exception as e:
+                if sent_any == False:
+                    raise
+                log.error( f'Problem archiving through batch ``{batch_index + 1}``, ``{repr(e)}``; earlier batches already went to GFA, so carrying on -- the archived original holds every record' )
+            self.send_gfa_batches( arcvr, [(len(batch_items), len(gfa_items), stringified_data, batch_index + 1, [gfa_item.item_barcode for gfa_item in gfa_items])], datetime_stamp )
+            sent_any = sent_any or len( gfa_items ) > 0
+        if prsr.sanitizer.counts:
+            log.info( f'sanitized gfa fields, ``{dict(prsr.sanitizer.counts)}``' )
+        return
+
+    def save_quarantined( self, arcvr, quarantined_items, item_count, datetime_stamp ):
+        """ Saves any quarantined items.
+            Called by process_file(), stream_batches() and process_file_pipelined() """
+        if not quarantined_items:
+            return
+        ( quarantine_filepath, err ) = arcvr.save_quarantined_to_archives( quarantined_items, datetime_stamp, self.PATH_TO_QUARANTINE_DIRECTORY )
+        if err:
+            raise Exception( f'Problem saving quarantined items, ``{err}``' )
+        log.warning( f'``{len(quarantined_items)}`` item(s) quarantined to ``{quarantine_filepath}``; ``{item_count - len(quarantined_items)}`` item(s) sent to GFA' )
+        return
+
+    def save_parsed( self, arcvr, parsed_text, datetime_stamp ):
+        """ Archives the parsed-data.
+            Called by process_file(), stream_batches() and process_file_pipelined() """
+        ( success, err ) = arcvr.save_parsed_to_archives( parsed_text, datetime_stamp, self.PATH_TO_ARCHIVES_PARSED_DIRECTORY )
         if err:
             raise Exception( f'Problem archiving parsed-data, ``{err}``' )
         if success == False:
             raise Exception( f'Problem archiving parsed_data; see logs' )
-
-        ## -- determine count -------------------
-        count = len( gfa_items )
-
-        ## -- send gfa count & data files -------
-        err = arcvr.send_gfa_count_file( count, datetime_stamp, self.PATH_TO_GFA_COUNT_DIRECTORY )
+        return
+
+    def save_jsonl( self, arcvr, jsonl_text, datetime_stamp ):
+        """ Saves the json-lines sidecar, if enabled.
+            Called by process_file(), stream_batches() and process_file_pipelined() """
+        if self.WRITE_JSONL_SIDECAR == False:
+            return
+        ( jsonl_filepath, err ) = arcvr.save_jsonl_to_archives( jsonl_text, datetime_stamp, self.PATH_TO_ARCHIVES_PARSED_DIRECTORY )
         if err:
-            raise Exception( f'Problem sending gfa count-file, ``{err}``' )
-        err = arcvr.send_gfa_data_file( stringified_data, datetime_stamp, self.PATH_TO_GFA_DATA_DIRECTORY )
+            raise Exception( f'Problem saving json-lines sidecar, ``{err}``' )
+        return
+
+    def save_rollup( self, datetime_stamp ):
+        """ Adds the file's counts to the daily-rollup, if enabled.
+            The gfa files are already sent by now, so a failure here is logged rather than raised; `python3 ./lib/rollup.py backfill` fills the gap later.
+            Called by process_file() and process_file_pipelined() """
+        if self.ROLLUP_DB_PATH == '':
+            return
+        store = RollupStore( self.ROLLUP_DB_PATH )
+        ( added, err ) = store.add_file_counts( datetime_stamp, self.rollup_counts )
+        store.close()
         if err:
-            raise Exception( f'Problem sending gfa data-file, ``{err}``' )
+            log.error( f'Problem updating rollup; run the rollup backfill later, ``{err}``' )
+        return
 
-        ## -- delete original -------------------
+    def finish_original( self, arcvr, source_file_path ):
+        """ Deletes the original -- or, in dev-mode, leaves it (returning a claimed original to the source-directory).
+            Called by process_file() and process_file_pipelined() """
         log.debug( f'self.DEV_MODE, ``{self.DEV_MODE}``' )
         if self.DEV_MODE == True:
-            pass
+            if self.CLAIM_FILES == True:
+                arcvr.release_claim( source_file_path, self.PATH_TO_SOURCE_DIRECTORY )
         else:
             err = arcvr.delete_original( source_file_path )
             if err:
                 raise Exception( f'Problem deleting original file, ``{err}``' )
-        log.debug( '-- processing complete --' )
+        return
+
+    def make_batches( self, items ):
+        """ Splits items into batches of at most GFA_MAX_BATCH_SIZE; a file with no items still makes one (empty) batch.
+            Called by prepare_batches() and stream_batches() """
+        batch_size = self.GFA_MAX_BATCH_SIZE if self.GFA_MAX_BATCH_SIZE > 0 else max( len(items), 1 )
+        batches = [ items[start:start + batch_size] for start in range(0, max(len(items), 1), batch_size) ]
+        log.debug( f'``{len(items)}`` items in ``{len(batches)}`` batch(es)' )
+        return batches
+
+    def prepare_batch( self, arcvr, prsr, batch_items, gfa_date_str, quarantined_items ):
+        """ Parses & prepares one batch; returns ( gfa_items, stringified_data, jsonl_text ) -- jsonl_text is '' unless the sidecar is enabled.
+            Called by prepare_batches() and stream_batches() """
+        ## -- parse items -----------------------
+        alma_requests = []
+        request_items = []  # the item behind each alma_request, for quarantining
+        sidecar_fields_list = []
+        request_types = []  # for the rollup
+        for item in batch_items:
+            ( alma_request, err ) = prsr.parse_alma_request( item )
+            if err == None and self.WRITE_JSONL_SIDECAR == True:
+                ( sidecar_fields, err ) = prsr.parse_sidecar_fields( item )
+            if err:
+                self.handle_bad_item( prsr.item_to_xml(item), [err], quarantined_items )
+                continue
+            alma_requests.append( alma_request )
+            request_items.append( item )
+            if self.WRITE_JSONL_SIDECAR == True:
+                sidecar_fields_list.append( sidecar_fields )
+            if self.ROLLUP_DB_PATH:
+                request_types.append( sidecar_fields['request_type'] if self.WRITE_JSONL_SIDECAR == True else prsr.parse_element(item, 'requestType')[0] )
+        ## -- prepare gfa entries ---------------
+        ( gfa_items, row_errs, err ) = prsr.prepare_gfa_entries( alma_requests, gfa_date_str )
+        if err:
+            raise Exception( f'Problem preparing gfa entries, ``{err}``' )
+        for ( row_index, row_err ) in row_errs.items():
+            self.handle_bad_item( prsr.item_to_xml(request_items[row_index]), [row_err], quarantined_items )
+        kept_indexes = [ row_index for row_index in range(len(alma_requests)) if row_index not in row_errs ]  # gfa_items has one entry per kept index
+        if self.ROLLUP_DB_PATH:
+            self.rollup_counts.update( make_rollup_key(gfa_item.gfa_delivery, gfa_item.gfa_location, request_types[row_index]) for ( row_index, gfa_item ) in zip(kept_indexes, gfa_items) )
+        ## -- stringify gfa data ----------------
+        ( stringified_data, err ) = arcvr.stringify_gfa_data( gfa_items )
+        if err:
+            raise Exception( f'Problem stringifying gfa data, ``{err}``' )
+        ## -- stringify sidecar records ---------
+        jsonl_text = ''
+        if self.WRITE_JSONL_SIDECAR == True:
+            records = [ prsr.prepare_sidecar_record(sidecar_fields_list[row_index], alma_requests[row_index], gfa_item) for ( row_index, gfa_item ) in zip(kept_indexes, gfa_items) ]
+            ( jsonl_text, err ) = arcvr.stringify_jsonl_records( records )
+            if err:
+                raise Exception( f'Problem stringifying json-lines records, ``{err}``' )
+        return ( gfa_items, stringified_data, jsonl_text )
+
+    def send_gfa_batches( self, arcvr, pending_batches, datetime_stamp ):
+        """ Sends -- or, with a spool, spools -- a count-file & data-file per batch; a batch whose items were all quarantined is skipped.
+            pending_batches: [ (item_count, gfa_count, stringified_data, batch_number, item_barcodes), ... ]
+            Called by process_file(), stream_batches() and process_file_pipelined() """
+        for ( item_count, count, stringified_data, batch_number, item_barcodes ) in pending_batches:
+            if count == 0 and item_count > 0:
+                log.warning( f'all items of batch ``{batch_number}`` quarantined; skipping its gfa count & data files' )
+                continue
+            data_bytes = stringified_data.encode( 'utf-8' )  # encoded once; the manifest hashes exactly what's sent
+            if self.spooler:
+                file_stem = arcvr.make_gfa_file_stem( datetime_stamp, batch_number )
+                err = self.spooler.spool_delivery( file_stem, [
+                    ( f'{file_stem}.cnt', f'{count}\n', self.PATH_TO_GFA_COUNT_DIRECTORY ),
+                    ( f'{file_stem}.dat', data_bytes, self.PATH_TO_GFA_DATA_DIRECTORY ) ] )
+                if err:
+                    raise Exception( f'Problem spooling gfa files, ``{err}``' )
+            else:
+                err = arcvr.send_gfa_count_file( count, datetime_stamp, self.PATH_TO_GFA_COUNT_DIRECTORY, batch_number )
+                if err:
+                    raise Exception( f'Problem sending gfa count-file, ``{err}``' )
+                err = arcvr.send_gfa_data_file( data_bytes, datetime_stamp, self.PATH_TO_GFA_DATA_DIRECTORY, batch_number )
+                if err:
+                    raise Exception( f'Problem sending gfa data-file, ``{err}``' )
+            self.publish_gfa_manifest( arcvr, datetime_stamp, batch_number, data_bytes, count, item_barcodes )
+        self.deliver_spooled( after_send=True )
+        return
+
+    def publish_gfa_manifest( self, arcvr, datetime_stamp, batch_number, data_bytes, count, item_barcodes ):
+        """ Saves the delivery's manifest, if manifests are on.
+            The gfa files are already out, so a failure is logged rather than raised -- raising would leave the original to be re-sent next run.
+            Called by send_gfa_batches() """
+        if not self.PATH_TO_MANIFEST_DIRECTORY:
+            return
+        manifest = arcvr.make_gfa_manifest( datetime_stamp, batch_number, data_bytes, count, item_barcodes, self.source_sha256 )
+        ( manifest_filepath, err ) = arcvr.save_gfa_manifest( manifest, self.PATH_TO_MANIFEST_DIRECTORY )
+        if err:
+            log.error( f'Problem saving gfa manifest, ``{err}``; the delivery itself went out' )
+        return
+
+    def handle_bad_item( self, item_xml, errs, quarantined_items ):
+        """ Sets a record aside in quarantine-mode; otherwise stops processing.
+            Called by prepare_batch() """
+        if self.QUARANTINE_MODE == True:
+            log.warning( f'quarantining item, errs, ``{errs}``' )
+            quarantined_items.append( (item_xml, errs) )
+            return
+        message = f'Problem preparing data; see logs for more info; quitting'
+        log.error( message )
+        ## TODO: email admin, or set cron to do this.
+        raise Exception( message )
 
     ## end class Controller()
 
@@ -339,6 +829,9 @@ class Controller(object):
 
 
 if __name__ == '__main__':
-    c = Controller()
-    c.process_requests()
+    c = Controller( memprofile=('--memprofile' in sys.argv), cprofile=('--cprofile' in sys.argv) )
+    if '--resident' in sys.argv:
+        c.run_resident()
+    else:
+        c.process_requests()
     log.debug( '__main__ complete' )
@@ -1,4 +1,6 @@
-import logging, os, pathlib, shutil, sys
+import contextlib, hashlib, json, logging, os, socket, sys, threading, time
+
+from parse_alma_annex_requests_code.lib.storage import LocalStorage
 
 
 ## settings from env/activate
@@ -18,25 +20,35 @@ log.debug( 'log setup' )
 
 
 class Archiver():
+    """ File-handling for a run. Reads, writes, copies & deletes go through `storage` (see lib/storage.py); the claim-methods rename
+          within the local source-directory, and so always use the local filesystem. """
 
-    def __init__(self):
-        pass
+    def __init__( self, storage=None ):
+        self.storage = LocalStorage() if storage == None else storage
+        self.pending_file_count = 0  # candidates seen by the last check_for_new_file(), ready or not
 
-    def check_for_new_file(self, dir_path):
-        """ Checks if there is a file waiting; if so, returns new_file_name. """
+    def check_for_new_file( self, dir_path, quiet_seconds=0, marker_suffix='.done', now=None ):
+        """ Checks if there is a file ready; if so, returns new_file_name, the oldest ready file.
+            Candidates are names like `BUL_ANNEX*.xml`; their mtimes come with the one directory-listing (see storage.list_stats()), with no separate stat per file.
+            A candidate is ready once its mtime is `quiet_seconds` old -- an upload still being written keeps its mtime current, so mtime alone
+              is the check; size isn't compared between scans, since a cron-run's Archiver has no earlier scan to compare with --
+              or as soon as a `{name}{marker_suffix}` marker-file is present. """
         ( new_file_name, err ) = ( '', None )
         try:
             assert type(dir_path) == str
-            log.debug( f'new-file dir_path, ``{dir_path}``' )
-            contents = os.listdir( dir_path )
-            assert type(contents) == list
-            for item in contents:
-                log.debug( f'item, ``{item}``' )
-                if item.startswith( 'BUL_ANNEX' ):
-                    exists = True
-                    new_file_name = item
-                    log.debug( f'new_file_name, ``{new_file_name}``' )
-                    break
+            log.debug( f'new-file dir_path, ``{dir_path}``; quiet_seconds, ``{quiet_seconds}``' )
+            now = time.time() if now == None else now
+            file_stats = self.storage.list_stats( dir_path, name_filter=lambda name: name.startswith('BUL_ANNEX') )  # one listing, for candidates & marker-files
+            marker_names = set( name for name in file_stats if marker_suffix and name.endswith(marker_suffix) )
+            candidates = [ name for name in file_stats if name.endswith('.xml') and name not in marker_names ]
+            ready = []
+            for name in candidates:
+                if now - file_stats[name].mtime >= quiet_seconds or f'{name}{marker_suffix}' in marker_names:
+                    ready.append( (file_stats[name].mtime, name) )
+            self.pending_file_count = len( candidates )
+            log.debug( f'files listed, ``{len(file_stats)}``; candidates, ``{len(candidates)}``; ready, ``{len(ready)}``' )
+            if ready:
+                new_file_name = min( ready )[1]
         except Exception as e:
             err = repr(e)
             log.exception( f'Problem checking for new file, ``{err}``' )
@@ -58,16 +70,11 @@ class Archiver():
             assert type(source_file_path) == str
             assert type(destination_dir_path) == str
             assert type(datetime_stamp) == str
-            source_path_obj = pathlib.Path( source_file_path )
-            source_filename = source_path_obj.name
             destination_filepath = f'{destination_dir_path}/REQ-ALMA-ORIG_{datetime_stamp}.xml'
             log.debug( f'destination_filepath, ``{destination_filepath}``' )
-            shutil.copy2( source_file_path, destination_filepath )
+            self.storage.copy( source_file_path, destination_filepath )  # the original is in the same storage, listed by check_for_new_file()
             ## check that it's there
-            destination_path_obj = pathlib.Path( destination_filepath )
-            log.debug( f'destination_path_obj, ``{destination_path_obj}``' )
-            assert destination_path_obj.exists() == True
-            success = True
+            assert self.storage.stat( destination_filepath ) != None
         except Exception as e:
             destination_filepath = ''
             err = repr(e)
@@ -76,23 +83,39 @@ class Archiver():
         return ( destination_filepath, err )
 
     def stringify_gfa_data( self, gfa_items ):
-        """ line elements: [ item_id, item_barcode, gfa_delivery, gfa_location, patron_name, patron_barcode, item_title, gfa_date_str, patron_note ] """
+        """ gfa_items: list of GfaEntry records.
+            line elements: [ item_id, item_barcode, gfa_delivery, gfa_location, patron_name, patron_barcode, item_title, gfa_date_str, patron_note ] """
         ( text, err ) = ( '', None )
         try:
             assert type(gfa_items) == list
-            text = ''
+            lines = []
             for item in gfa_items:
-                ( item_id, item_barcode, gfa_delivery, gfa_location, patron_name, patron_barcode, item_title, gfa_date_str, patron_note ) = ( item[0], item[1], item[2], item[3], item[4], item[5], item[6], item[7], item[8] )
                 line = '''"%s","%s","%s","%s","%s","%s","%s","%s","%s"''' % (
-                    item_id, item_barcode, gfa_delivery, gfa_location, patron_name, patron_barcode, item_title, gfa_date_str, patron_note
+                    item.item_id, item.item_barcode, item.gfa_delivery, item.gfa_location, item.patron_name, item.patron_barcode, item.item_title, item.gfa_date_str, item.patron_note
                     )
-                text = text + line + '\n'
+                lines.append( line + '\n' )
+            text = ''.join( lines )
         except Exception as e:
             err = repr(e)
             log.exception( f'Problem transforming list of lists into text, ``{err}``' )
         log.debug( f'text, ``{text}``; err, ``{err}``' )
         return ( text, err )
 
+    def stringify_gfa_columns( self, gfa_columns ):
+        """ Columnar version of stringify_gfa_data().
+            gfa_columns: [ item_ids, item_barcodes, gfa_deliveries, gfa_locations, patron_names, patron_barcodes, item_titles, gfa_date_strs, patron_notes ] """
+        ( text, err ) = ( '', None )
+        try:
+            assert type(gfa_columns) == list
+            assert len(gfa_columns) == 9
+            line_template = '''"%s","%s","%s","%s","%s","%s","%s","%s","%s"\n'''
+            text = ''.join( [line_template % row for row in zip(*gfa_columns)] )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem transforming columns into text, ``{err}``' )
+        log.debug( f'text[0:100], ``{text[0:100]}``; err, ``{err}``' )
+        return ( text, err )
+
     def save_parsed_to_archives( self, text, datetime_stamp, destination_dir_path ):
         log.debug( f'text[0:100], ``{text[0:100]}``' )
         log.debug( f'destination_dir_path, ``{destination_dir_path}``' )
@@ -104,11 +127,9 @@ class Archiver():
             assert type(destination_dir_path) == str
             destination_filepath = f'{destination_dir_path}/REQ-ALMA-PARSED_{datetime_stamp}.dat'
             log.debug( f'destination_filepath, ``{destination_filepath}``' )
-            with open( destination_filepath, 'w' ) as file_handler:
-                file_handler.write( text )
+            self.storage.put( destination_filepath, text.encode('utf-8') )
             ## check that it's there
-            destination_path_obj = pathlib.Path( destination_filepath )
-            assert destination_path_obj.exists() == True
+            assert self.storage.stat( destination_filepath ) != None
             success = True
         except Exception as e:
             err = repr(e)
@@ -116,57 +137,316 @@ class Archiver():
         log.debug( f'success, ``{success}``; err, ``{err}``' )
         return ( success, err )
 
-    def send_gfa_count_file( self, count, datetime_stamp, gfa_count_dir ):
+    def stringify_jsonl_records( self, records ):
+        """ Returns json-lines text, one compact object per record dict; non-ascii text is kept as utf-8. """
+        ( text, err ) = ( '', None )
+        try:
+            assert type(records) == list
+            text = ''.join( [json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records] )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem transforming records into json-lines, ``{err}``' )
+        log.debug( f'text[0:100], ``{text[0:100]}``; err, ``{err}``' )
+        return ( text, err )
+
+    def save_jsonl_to_archives( self, text, datetime_stamp, destination_dir_path ):
+        """ Saves the json-lines sidecar beside the parsed archive, as `REQ-ALMA-PARSED_{stamp}.jsonl`. """
+        ( destination_filepath, err ) = ( '', None )
+        try:
+            assert type(text) == str
+            assert type(datetime_stamp) == str
+            assert type(destination_dir_path) == str
+            destination_filepath = f'{destination_dir_path}/REQ-ALMA-PARSED_{datetime_stamp}.jsonl'
+            log.debug( f'destination_filepath, ``{destination_filepath}``' )
+            self.storage.put( destination_filepath, text.encode('utf-8') )
+            ## check that it's there
+            assert self.storage.stat( destination_filepath ) != None
+        except Exception as e:
+            destination_filepath = ''
+            err = repr(e)
+            log.exception( f'Problem saving json-lines sidecar, ``{err}``' )
+        log.debug( f'destination_filepath, ``{destination_filepath}``; err, ``{err}``' )
+        return ( destination_filepath, err )
+
+    def save_quarantined_to_archives( self, quarantined_items, datetime_stamp, destination_dir_path ):
+        """ Saves records that could not be prepared, with their reasons, as an rsExportList file.
+            Once the mapper is fixed, the file can be renamed to `BUL_ANNEX-...xml` and dropped back in the source-directory.
+            quarantined_items: [ (record_xml, [err, ...]), ... ] """
+        log.debug( f'destination_dir_path, ``{destination_dir_path}``' )
+        ( destination_filepath, err ) = ( '', None )
+        try:
+            assert type(quarantined_items) == list
+            assert type(datetime_stamp) == str
+            assert type(destination_dir_path) == str
+            lines = [
+                '<?xml version="1.0" encoding="utf-8"?>',
+                '<xb:rsExportList xmlns:xb="http://com/exlibris/urm/rep/externalsysremotestorage/xmlbeans">',
+                ]
+            for ( record_xml, reasons ) in quarantined_items:
+                reasons_text = '; '.join( reasons ).replace( '--', '- -' )  # `--` is not allowed inside an xml comment
+                lines.append( f'  <!-- quarantine-reason: {reasons_text} -->' )
+                lines.append( f'  {record_xml}' )
+            lines.append( '</xb:rsExportList>' )
+            destination_filepath = f'{destination_dir_path}/REQ-ALMA-QUARANTINE_{datetime_stamp}.xml'
+            log.debug( f'destination_filepath, ``{destination_filepath}``' )
+            self.storage.put( destination_filepath, ('\n'.join(lines) + '\n').encode('utf-8') )
+            ## check that it's there
+            assert self.storage.stat( destination_filepath ) != None
+        except Exception as e:
+            destination_filepath = ''
+            err = repr(e)
+            log.exception( f'Problem saving quarantined items, ``{err}``' )
+        log.debug( f'destination_filepath, ``{destination_filepath}``; err, ``{err}``' )
+        return ( destination_filepath, err )
+
+    def save_rejected_to_archives( self, source_file_path, report_text, datetime_stamp, destination_dir_path ):
+        """ Saves a file the preflight check rejected, as `REQ-ALMA-REJECTED_{stamp}.xml`, with its reject-report beside it as `.txt`. """
+        log.debug( f'destination_dir_path, ``{destination_dir_path}``' )
+        ( destination_filepath, err ) = ( '', None )
+        try:
+            assert type(source_file_path) == str
+            assert type(report_text) == str
+            assert type(datetime_stamp) == str
+            assert type(destination_dir_path) == str
+            destination_filepath = f'{destination_dir_path}/REQ-ALMA-REJECTED_{datetime_stamp}.xml'
+            self.storage.copy( source_file_path, destination_filepath )  # the original is in the same storage, listed by check_for_new_file()
+            self.storage.put( f'{destination_dir_path}/REQ-ALMA-REJECTED_{datetime_stamp}.txt', report_text.encode('utf-8') )
+            ## check that it's there
+            assert self.storage.stat( destination_filepath ) != None
+        except Exception as e:
+            destination_filepath = ''
+            err = repr(e)
+            log.exception( f'Problem saving rejected file, ``{err}``' )
+        log.debug( f'destination_filepath, ``{destination_filepath}``; err, ``{err}``' )
+        return ( destination_filepath, err )
+
+    def make_gfa_file_stem( self, datetime_stamp, batch_number=None ):
+        """ Returns 'REQ-PARSED_{stamp}', or -- for one batch of a split file -- 'REQ-PARSED_{stamp}_{batch_number:03}'. """
+        if batch_number == None:
+            return f'REQ-PARSED_{datetime_stamp}'
+        return f'REQ-PARSED_{datetime_stamp}_{batch_number:03}'
+
+    def send_gfa_count_file( self, count, datetime_stamp, gfa_count_dir, batch_number=None ):
         err = None
-        count_file_name = f'REQ-PARSED_{datetime_stamp}.cnt'
+        count_file_name = f'{self.make_gfa_file_stem(datetime_stamp, batch_number)}.cnt'
         count_file_gfa_destination_path = f'{gfa_count_dir}/{count_file_name}'
         count_str = f'{count}\n'
         try:
-            with open( count_file_gfa_destination_path, 'w' ) as file_handler:
-                file_handler.write( count_str )
+            self.storage.put( count_file_gfa_destination_path, count_str.encode('utf-8'), mode=0o666 )   # `rw-/rw-/rw-`; a chmod failure is only logged
             log.info( f'count file saved to, ``{count_file_gfa_destination_path}``' )
         except Exception as e:
             err = repr(e)
             log.exception( f'problem on save of count file, ``{err}``' )
-        try:
-            os.chmod( count_file_gfa_destination_path, 0o666 )   # `rw-/rw-/rw-`
-        except Exception as e:
-            log.exception( 'could not set file-permissions on count destination-path' )
-            ## not returning error that would quit processing
         return err
 
-    def send_gfa_data_file( self, text, datetime_stamp, gfa_data_dir ):
+    def send_gfa_data_file( self, text, datetime_stamp, gfa_data_dir, batch_number=None ):
+        """ Sends the data-file; `text` may be a str, or bytes already encoded as utf-8. """
         err = None
-        data_file_name = f'REQ-PARSED_{datetime_stamp}.dat'
+        data_file_name = f'{self.make_gfa_file_stem(datetime_stamp, batch_number)}.dat'
         data_file_gfa_destination_path = f'{gfa_data_dir}/{data_file_name}'
         try:
-            with open( data_file_gfa_destination_path, 'w' ) as file_handler:
-                file_handler.write( text )
+            data = text if type(text) == bytes else text.encode( 'utf-8' )
+            self.storage.put( data_file_gfa_destination_path, data, mode=0o666 )   # `rw-/rw-/rw-`; a chmod failure is only logged
             log.info( f'data file saved to, ``{data_file_gfa_destination_path}``' )
         except Exception as e:
             err = repr(e)
             log.exception( f'problem on save of data file, ``{err}``' )
+        return err
+
+    ## -- manifests -----------------------------
+    ## Each GFA delivery gets a `{delivery-stem}.manifest.json`, so a delivery can be verified, or a missing request traced, without reparsing anything.
+    ## The data-file's hash is taken over the same bytes that are sent, and the original's over the bytes the parser loaded; no file is read twice.
+
+    def make_gfa_manifest( self, datetime_stamp, batch_number, data_bytes, record_count, item_barcodes, source_sha256 ):
+        """ Returns the delivery's manifest, as a dict.
+            Called by controller.publish_gfa_manifest() """
+        assert type(data_bytes) == bytes
+        file_stem = self.make_gfa_file_stem( datetime_stamp, batch_number )
+        return {
+            'delivery': file_stem,
+            'batch_number': batch_number,
+            'data_file': { 'name': f'{file_stem}.dat', 'sha256': hashlib.sha256(data_bytes).hexdigest(), 'byte_length': len(data_bytes) },
+            'count_file': { 'name': f'{file_stem}.cnt' },
+            'record_count': record_count,
+            'source': { 'archived_original': f'REQ-ALMA-ORIG_{datetime_stamp}.xml', 'archive_stamp': datetime_stamp, 'sha256': source_sha256 },
+            'item_barcodes': list( item_barcodes ) }
+
+    def save_gfa_manifest( self, manifest, manifest_dir_path ):
+        """ Saves the manifest as `{delivery-stem}.manifest.json`; returns ( manifest_filepath, err ). """
+        ( manifest_filepath, err ) = ( '', None )
         try:
-            os.chmod( data_file_gfa_destination_path, 0o666 )   # `rw-/rw-/rw-`
+            assert type(manifest) == dict
+            assert type(manifest_dir_path) == str
+            manifest_filepath = f'{manifest_dir_path}/{manifest["delivery"]}.manifest.json'
+            self.storage.put( manifest_filepath, (json.dumps(manifest, indent=2) + '\n').encode('utf-8') )
+            log.info( f'manifest saved to, ``{manifest_filepath}``' )
         except Exception as e:
-            log.exception( 'could not set file-permissions on data destination-path' )
-            ## not returning error that would quit processing
-        return err
+            manifest_filepath = ''
+            err = repr(e)
+            log.exception( f'Problem saving gfa manifest, ``{err}``' )
+        return ( manifest_filepath, err )
 
-    def delete_original( self, source_file_path ):
+    def verify_gfa_delivery( self, manifest_filepath, gfa_data_dir ):
+        """ Checks a delivered data-file against its manifest; returns ( problems, err ) -- problems is a list of strings, empty if the delivery matches.
+            The data-file is hashed as it streams in, in chunks. """
+        ( problems, err ) = ( [], None )
+        try:
+            with self.storage.open_stream( manifest_filepath ) as stream:
+                manifest = json.loads( stream.read().decode('utf-8') )
+            data_file = manifest['data_file']
+            data_filepath = f'{gfa_data_dir}/{data_file["name"]}'
+            if self.storage.stat( data_filepath ) == None:
+                problems.append( f'data-file missing, `{data_filepath}`' )
+                return ( problems, err )
+            ( hasher, byte_length ) = ( hashlib.sha256(), 0 )
+            with self.storage.open_stream( data_filepath ) as stream:
+                for chunk in iter( lambda: stream.read(1024 * 1024), b'' ):
+                    hasher.update( chunk )
+                    byte_length += len( chunk )
+            if byte_length != data_file['byte_length']:
+                problems.append( f'byte-length is `{byte_length}`; manifest says `{data_file["byte_length"]}`' )
+            if hasher.hexdigest() != data_file['sha256']:
+                problems.append( f'sha256 is `{hasher.hexdigest()}`; manifest says `{data_file["sha256"]}`' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem verifying gfa delivery, ``{err}``' )
+        log.debug( f'problems, ``{problems}``; err, ``{err}``' )
+        return ( problems, err )
+
+    def delete_original( self, source_file_path, marker_suffix='.done' ):
+        """ Deletes the original, and its marker-file, if any; for a claimed original, also its lease & empty claim-directory. """
         err = None
         try:
             log.debug( f'source_file_path, ``{source_file_path}``' )
             assert type(source_file_path) == str
-            os.remove( source_file_path )
+            assert self.storage.stat( source_file_path ) != None
+            paths = [ source_file_path, f'{source_file_path}{marker_suffix}' ] if marker_suffix else [ source_file_path ]
+            self.storage.delete_many( paths )
+            self.remove_claim_lease( source_file_path )
             ## check that it's not there
-            source_path_obj = pathlib.Path( source_file_path )
-            log.debug( f'source_path_obj, ``{source_path_obj}``' )
-            assert source_path_obj.exists() == False
+            assert self.storage.stat( source_file_path ) == None
         except Exception as e:
             err = repr(e)
             log.exception( f'Problem deleting original file, ``{err}``' )
         log.debug( f'err, ``{err}``' )
         return err
 
+    ## -- claims --------------------------------
+    ## A worker claims a new file by renaming it into `{source-dir}/processing/{worker_id}/`.
+    ## The rename is atomic, so when several workers (or hosts sharing the source-directory) race for a file, exactly one wins.
+    ## A `{file}.lease` file beside the claimed file is touched while the worker is busy; a claim whose lease goes stale is returned to the source-directory.
+
+    def claim_file( self, source_dir_path, file_name, worker_id, marker_suffix='.done' ):
+        """ Returns ( claimed_filepath, err ); claimed_filepath is '' if another worker claimed the file first. """
+        ( claimed_filepath, err ) = ( '', None )
+        try:
+            assert type(source_dir_path) == str
+            assert type(file_name) == str
+            claim_dir_path = f'{source_dir_path}/processing/{worker_id}'
+            os.makedirs( claim_dir_path, exist_ok=True )
+            try:
+                os.rename( f'{source_dir_path}/{file_name}', f'{claim_dir_path}/{file_name}' )
+            except FileNotFoundError:
+                log.info( f'``{file_name}`` already claimed by another worker' )
+                try:
+                    os.rmdir( claim_dir_path )  # only if empty; the winner's claim (& lease) may be in it, if it shares the worker-id
+                except OSError:
+                    pass
+                return ( claimed_filepath, err )
+            claimed_filepath = f'{claim_dir_path}/{file_name}'
+            lease = { 'worker_id': worker_id, 'host': socket.gethostname(), 'pid': os.getpid(), 'claimed_at': time.time() }
+            with open( f'{claimed_filepath}.lease', 'w' ) as file_handler:
+                file_handler.write( json.dumps(lease) )
+            if marker_suffix and os.path.exists( f'{source_dir_path}/{file_name}{marker_suffix}' ):
+                os.remove( f'{source_dir_path}/{file_name}{marker_suffix}' )
+            log.info( f'claimed ``{claimed_filepath}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem claiming file, ``{err}``' )
+        return ( claimed_filepath, err )
+
+    def heartbeat_claim( self, claimed_filepath ):
+        """ Renews a claim's lease. """
+        err = None
+        try:
+            os.utime( f'{claimed_filepath}.lease' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem renewing lease, ``{err}``' )
+        return err
+
+    @contextlib.contextmanager
+    def keep_claim_alive( self, claimed_filepath, interval_seconds ):
+        """ Renews the claim's lease every `interval_seconds` from a background thread, for the duration of the with-block. """
+        stop_event = threading.Event()
+        def renew():
+            while not stop_event.wait( interval_seconds ):
+                self.heartbeat_claim( claimed_filepath )
+        heartbeat_thread = threading.Thread( target=renew, name='claim-heartbeat', daemon=True )
+        heartbeat_thread.start()
+        try:
+            yield
+        finally:
+            stop_event.set()
+            heartbeat_thread.join()
+
+    def release_claim( self, claimed_filepath, source_dir_path ):
+        """ Returns a claimed file to the source-directory, so a later run picks it up again. """
+        err = None
+        try:
+            if os.path.exists( claimed_filepath ):
+                os.rename( claimed_filepath, f'{source_dir_path}/{os.path.basename(claimed_filepath)}' )
+                log.info( f'released claim on ``{claimed_filepath}``' )
+            self.remove_claim_lease( claimed_filepath )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem releasing claim, ``{err}``' )
+        return err
+
+    def recover_stale_claims( self, source_dir_path, lease_seconds, now=None ):
+        """ Returns claimed files whose lease hasn't been renewed for `lease_seconds` to the source-directory.
+            A claimed file with no lease (its worker died right after the rename) is judged by its own ctime, which the rename set. """
+        ( recovered_names, err ) = ( [], None )
+        try:
+            now = time.time() if now == None else now
+            processing_dir_path = f'{source_dir_path}/processing'
+            if not os.path.isdir( processing_dir_path ):
+                return ( recovered_names, err )
+            with os.scandir( processing_dir_path ) as claim_dirs:
+                claim_dir_paths = [ claim_dir.path for claim_dir in claim_dirs if claim_dir.is_dir() ]
+            for claim_dir_path in claim_dir_paths:
+                with os.scandir( claim_dir_path ) as entries:
+                    claimed_entries = [ entry for entry in entries if not entry.name.endswith('.lease') ]
+                for entry in claimed_entries:
+                    try:
+                        last_renewed = os.stat( f'{entry.path}.lease' ).st_mtime
+                    except FileNotFoundError:
+                        last_renewed = entry.stat().st_ctime
+                    if now - last_renewed < lease_seconds:
+                        continue
+                    try:
+                        os.rename( entry.path, f'{source_dir_path}/{entry.name}' )
+                    except FileNotFoundError:
+                        continue  # another worker recovered it first
+                    self.remove_claim_lease( entry.path )
+                    recovered_names.append( entry.name )
+                    log.warning( f'recovered stale claim, ``{entry.path}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem recovering stale claims, ``{err}``' )
+        return ( recovered_names, err )
+
+    def remove_claim_lease( self, claimed_filepath ):
+        """ Removes a claim's lease, and its claim-directory once empty; does nothing for an unclaimed path. """
+        lease_filepath = f'{claimed_filepath}.lease'
+        if os.path.exists( lease_filepath ):
+            os.remove( lease_filepath )
+        claim_dir_path = os.path.dirname( claimed_filepath )
+        if os.path.basename( os.path.dirname(claim_dir_path) ) == 'processing':
+            try:
+                os.rmdir( claim_dir_path )
+            except OSError:
+                pass  # not empty, or already removed
+        return
+
 ## end class Archiver
@@ -0,0 +1,181 @@
+"""
+Differential harness for the parsing engines in `lib/engines.py`.
+Runs every engine over a corpus, checks that each engine's results match the reference engine's field by field, and reports each engine's speedup.
+Per item, the compared result is: whether parsing failed, the GfaEntry (every field), and any mapping row-err.
+The corpus is...
+- the `*.xml` files holding `rsExport` records under the given directories (eg `test_dirs`, and the archived-originals directory)
+- synthetic files, built to exercise edge cases: note-part deduplication in parse_patron_note(), the digitization/HAY branching in
+    parse_alma_pickup_library(), unmapped codes, missing & nil elements, entities, CDATA, comments, and non-ascii text
+Usage...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/engine_harness.py [dir-path ...]
+  (exits non-zero on any mismatch)
+"""
+
+import glob, logging, os, random, sys, time
+from xml.sax.saxutils import escape
+
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.lib.engines import PARSER_ENGINES, REFERENCE_ENGINE, make_parser
+from parse_alma_annex_requests_code.lib.records import GfaEntry
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+GFA_DATE_STR = 'Tue Feb 02 1960'  # fixed, so results don't depend on when the harness runs
+
+PICKUP_LIBRARIES = [ 'Rockefeller Library', 'John Hay Library', 'Sciences Library', 'Orwig Music Library', 'Library Coll Annex', 'Hay at Rock Reading Room', 'PERSONAL_DELIVERY', 'Unknown Pickup Library' ]
+LIBRARY_CODES = [ 'ROCK', 'HAY', 'SCI', 'ORWIG', 'ANNEX', 'ANNEX_HAY', 'UNKNOWN_CODE' ]
+REQUEST_TYPES = [ 'PATRON_PHYSICAL', 'PATRON_PHYSICAL', 'PATRON_PHYSICAL', 'PHYSICAL_TO_DIGITIZATION', 'STAFF_PHYSICAL_DIGITIZATION', 'GENERAL_DIGITIZATION' ]
+LOCATION_CODES = [ 'STORAGE', 'HAYSTOR', 'hay-annex', 'SCISTOR' ]
+TITLES = [ 'Education.', 'Southern medical journal.', 'Les Misérables', 'Café society', 'Tom & Jerry <annotated>', '"Quoted" title', 'Ångström units', '東京' ]
+NOTE_PARTS = [ '', 'test note A', 'scan pp. 1-20', 'test note A; scan pp. 1-20', 'multi\nline note', 'R&D notes' ]
+
+
+def make_element( tag_name, text, style ):
+    """ Returns one `xb:` element, written in the given style. """
+    if style == 'missing':
+        return ''
+    if style == 'nil' or text == '':
+        return f'<xb:{tag_name} xsi:nil="true" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" />'
+    if style == 'cdata':
+        return f'<xb:{tag_name}><![CDATA[{text}]]></xb:{tag_name}>'
+    if style == 'comment':
+        return f'<xb:{tag_name}>{escape(text)}<!-- a comment --> (c)</xb:{tag_name}>'
+    return f'<xb:{tag_name}>{escape(text)}</xb:{tag_name}>'
+
+
+def make_synthetic_text( record_count, seed=0 ):
+    """ Returns an rsExportList document of `record_count` randomized records. """
+    rng = random.Random( seed )
+    records = []
+    for i in range( record_count ):
+        note_style = rng.choice( ['plain', 'plain', 'nil', 'missing', 'cdata'] )
+        records.append( '\n'.join( [
+            '  <xb:rsExport>',
+            f'    {make_element("requestType", rng.choice(REQUEST_TYPES), "plain")}',
+            f'    {make_element("requestId", str(2404662150006966 + i), "plain")}',
+            f'    <xb:pickup>{make_element("library", rng.choice(PICKUP_LIBRARIES), rng.choice(["plain", "plain", "plain", "missing"]))}</xb:pickup>',
+            f'    <xb:operationalRecordinformation>{make_element("permanent_physical_location_code", rng.choice(LOCATION_CODES), "plain")}</xb:operationalRecordinformation>',
+            f'    {make_element("barcode", str(31236011508853 + i), "plain")}',
+            f'    {make_element("itemId", str(2332679300006966 + i), "plain")}',
+            f'    {make_element("title", rng.choice(TITLES), rng.choice(["plain", "plain", "cdata", "comment"]))}',
+            f'    <xb:patronInfo>{make_element("patronName", rng.choice(["Last, First", "Ó Briain, Dara", ""]), "plain")}{make_element("patronIdentifier", str(12345678901234 + i), "plain")}</xb:patronInfo>',
+            f'    {make_element("libraryCode", rng.choice(LIBRARY_CODES), "plain")}',
+            f'    {make_element("requestNote", rng.choice(NOTE_PARTS), note_style)}',
+            f'    <xb:bibliographicInformation>{make_element("description", rng.choice(NOTE_PARTS), rng.choice(["plain", "nil", "missing"]))}{make_element("partToDigitize", rng.choice(NOTE_PARTS), rng.choice(["plain", "nil", "missing"]))}</xb:bibliographicInformation>',
+            '  </xb:rsExport>' ] ) )
+    return '\n'.join( [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<xb:rsExportList xmlns:xb="http://com/exlibris/urm/rep/externalsysremotestorage/xmlbeans">',
+        *records,
+        '</xb:rsExportList>', '' ] )
+
+
+def collect_corpus( dir_paths, synthetic_record_counts=(50, 500) ):
+    """ Returns [ (label, text), ... ]: every `*.xml` file holding rsExport records under dir_paths, then the synthetic files. """
+    corpus = []
+    for dir_path in dir_paths:
+        for filepath in sorted( glob.glob(f'{dir_path}/**/*.xml', recursive=True) ):
+            with open( filepath, encoding='utf-8' ) as f:
+                text = f.read()
+            if 'rsExport>' in text:
+                corpus.append( (filepath, text) )
+    for ( seed, record_count ) in enumerate( synthetic_record_counts ):
+        corpus.append( (f'synthetic-{record_count}-records', make_synthetic_text(record_count, seed)) )
+    return corpus
+
+
+def run_engine( engine_name, text ):
+    """ Parses one file with one engine; returns [ (parse_failed, gfa_entry_or_None, row_err_or_None), ... ], one per item. """
+    prsr = make_parser( engine_name )
+    ( items, err ) = prsr.make_item_list( text )
+    if err:
+        raise Exception( f'engine ``{engine_name}`` could not make item-list, ``{err}``' )
+    ( results, alma_requests, result_indexes ) = ( [], [], [] )
+    for item in items:
+        ( alma_request, err ) = prsr.parse_alma_request( item )
+        results.append( (err != None, None, None) )
+        if err == None:
+            alma_requests.append( alma_request )
+            result_indexes.append( len(results) - 1 )
+    ( gfa_entries, row_errs, err ) = prsr.prepare_gfa_entries( alma_requests, GFA_DATE_STR )
+    if err:
+        raise Exception( f'engine ``{engine_name}`` could not prepare gfa entries, ``{err}``' )
+    gfa_entries = iter( gfa_entries )
+    for ( row_index, result_index ) in enumerate( result_indexes ):
+        if row_index in row_errs:
+            results[result_index] = ( False, None, row_errs[row_index] )
+        else:
+            results[result_index] = ( False, next(gfa_entries), None )
+    return results
+
+
+def compare_results( reference_results, engine_results ):
+    """ Returns a description of each difference, like 'item 3: item_title: 'a' != 'b''. """
+    if len( reference_results ) != len( engine_results ):
+        return [ f'item-count: {len(reference_results)} != {len(engine_results)}' ]
+    mismatches = []
+    for ( index, ( reference, result ) ) in enumerate( zip(reference_results, engine_results) ):
+        ( ref_failed, ref_entry, ref_row_err ) = reference
+        ( failed, entry, row_err ) = result
+        if ( ref_failed, ref_row_err ) != ( failed, row_err ):
+            mismatches.append( f'item {index}: (parse-failed, row-err): {(ref_failed, ref_row_err)!r} != {(failed, row_err)!r}' )
+        elif ref_entry != entry:
+            for field_name in GfaEntry.__slots__:
+                if getattr( ref_entry, field_name ) != getattr( entry, field_name ):
+                    mismatches.append( f'item {index}: {field_name}: {getattr(ref_entry, field_name)!r} != {getattr(entry, field_name)!r}' )
+    return mismatches
+
+
+def compare_engines( corpus, engine_names=None, repeat=3 ):
+    """ Runs each engine over the corpus; returns { engine_name: {'seconds': best-of-`repeat` total, 'speedup': vs reference, 'mismatches': [...]} }. """
+    engine_names = sorted( PARSER_ENGINES ) if engine_names == None else engine_names
+    report = {}
+    reference_results = { label: run_engine(REFERENCE_ENGINE, text) for ( label, text ) in corpus }
+    for engine_name in engine_names:
+        ( seconds, mismatches ) = ( 0.0, [] )
+        for ( label, text ) in corpus:
+            timings = []
+            for i in range( repeat ):
+                start_time = time.perf_counter()
+                engine_results = run_engine( engine_name, text )
+                timings.append( time.perf_counter() - start_time )
+            seconds += min( timings )
+            mismatches.extend( f'{label}: {mismatch}' for mismatch in compare_results(reference_results[label], engine_results) )
+        report[engine_name] = { 'seconds': seconds, 'mismatches': mismatches }
+    for engine_name in engine_names:
+        report[engine_name]['speedup'] = report[REFERENCE_ENGINE]['seconds'] / report[engine_name]['seconds'] if REFERENCE_ENGINE in report else None
+    return report
+
+
+def format_report( report ):
+    lines = []
+    for ( engine_name, engine_report ) in report.items():
+        speedup = f'{engine_report["speedup"]:.2f}x' if engine_report['speedup'] != None else 'n/a'
+        lines.append( f'{engine_name}: {engine_report["seconds"]:.3f}s; speedup vs {REFERENCE_ENGINE}, {speedup}; mismatches, {len(engine_report["mismatches"])}' )
+        lines.extend( f'  {mismatch}' for mismatch in engine_report['mismatches'][0:20] )
+    return '\n'.join( lines )
+
+
+if __name__ == '__main__':
+    project_path = os.path.dirname( os.path.dirname(os.path.abspath(__file__)) )
+    dir_paths = sys.argv[1:] or [ f'{project_path}/test_dirs' ] + [ path for path in [os.environ.get('ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY', '')] if path ]
+    report = compare_engines( collect_corpus(dir_paths) )
+    print( format_report(report) )
+    sys.exit( 1 if any(engine_report['mismatches'] for engine_report in report.values()) else 0 )
@@ -0,0 +1,19 @@
+"""
+The available parsing engines, by name; `bs4` (the BeautifulSoup-based Parser) is the reference.
+Every engine must pass `lib/engine_harness.py` -- field-by-field identical GFA entries to `bs4` -- before it's used in production.
+"""
+
+from parse_alma_annex_requests_code.lib.lxml_parser import LxmlParser
+from parse_alma_annex_requests_code.lib.parser import Parser
+
+
+PARSER_ENGINES = { 'bs4': Parser, 'lxml': LxmlParser }
+
+REFERENCE_ENGINE = 'bs4'
+
+
+def make_parser( engine_name, mapping_config=None ):
+    """ Returns a parser for the named engine. """
+    if engine_name not in PARSER_ENGINES:
+        raise ValueError( f'unknown parser-engine, ``{engine_name}``; expected one of ``{sorted(PARSER_ENGINES)}``' )
+    return PARSER_ENGINES[engine_name]( mapping_config )
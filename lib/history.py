@@ -0,0 +1,176 @@
+"""
+Columnar history of the requests sent to GFA, for long-range analysis.
+A compaction job folds the per-run `REQ-ALMA-PARSED_{stamp}.dat` archives into one Parquet file per month, laid out for partition-discovery:
+    {history-dir}/month=2021-08/requests.parquet
+Columns: datetime_stamp, request_date, item_id, item_barcode, item_title, gfa_delivery, gfa_location, request_type, alma_pickup_library.
+  The low-cardinality codes are dictionary-encoded; patron fields are left out. request_type & alma_pickup_library come from a run's
+  json-lines sidecar; without one, request_type comes from the archived original, and alma_pickup_library is empty.
+Compaction is incremental: runs whose stamp is already in a month's file are skipped, and only the months gaining rows are rewritten
+  (to a temp-file, then renamed into place, so a scan never sees a half-written month).
+Needs `pyarrow` (not in requirements.pip); it's only imported if installed, and only this module uses it.
+Usage...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/history.py compact
+- $ python3 ./lib/history.py counts request_type [gfa_location ...]
+"""
+
+import csv, datetime, io, json, logging, os, sys
+
+try:
+    import pyarrow, pyarrow.dataset, pyarrow.parquet  # optional dependency
+except ImportError:
+    pyarrow = None
+
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.lib.engines import make_parser
+from parse_alma_annex_requests_code.lib.rollup import read_request_types
+from parse_alma_annex_requests_code.lib.storage import LocalStorage
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+PLAIN_COLUMNS = ( 'datetime_stamp', 'item_id', 'item_barcode', 'item_title' )
+DICTIONARY_COLUMNS = ( 'gfa_delivery', 'gfa_location', 'request_type', 'alma_pickup_library' )
+
+MONTH_FILE_NAME = 'requests.parquet'
+
+
+def make_schema():
+    """ Returns the history's arrow schema; built on demand, since pyarrow is optional. """
+    dictionary_type = pyarrow.dictionary( pyarrow.int16(), pyarrow.string() )
+    return pyarrow.schema(
+        [ ('datetime_stamp', pyarrow.string()), ('request_date', pyarrow.date32()) ]
+        + [ (column_name, pyarrow.string()) for column_name in PLAIN_COLUMNS[1:] ]
+        + [ (column_name, dictionary_type) for column_name in DICTIONARY_COLUMNS ] )
+
+
+def read_run_records( storage, parsed_dir_path, originals_dir_path, datetime_stamp, prsr ):
+    """ Returns one run's requests as column-lists, { column_name: [value, ...] }. """
+    with storage.open_stream( f'{parsed_dir_path}/REQ-ALMA-PARSED_{datetime_stamp}.dat' ) as stream:
+        rows = [ fields for fields in csv.reader(io.StringIO(stream.read().decode('utf-8'))) if len(fields) >= 4 ]
+    sidecar_path = f'{parsed_dir_path}/REQ-ALMA-PARSED_{datetime_stamp}.jsonl'
+    if storage.stat( sidecar_path ) != None:
+        with storage.open_stream( sidecar_path ) as stream:
+            sidecar_records = [ json.loads(line) for line in stream.read().decode('utf-8').splitlines() if line.strip() ]
+        request_types = [ record['request_type'] for record in sidecar_records ]
+        pickup_libraries = [ record['alma_pickup_library'] for record in sidecar_records ]
+    else:
+        barcode_request_types = read_request_types( storage, parsed_dir_path, originals_dir_path, datetime_stamp, prsr )
+        request_types = [ barcode_request_types.get(fields[1], '') for fields in rows ]
+        pickup_libraries = [ '' ] * len( rows )
+    request_date = datetime.date.fromisoformat( datetime_stamp[0:10] )
+    return {
+        'datetime_stamp': [ datetime_stamp ] * len( rows ), 'request_date': [ request_date ] * len( rows ),
+        'item_id': [ fields[0] for fields in rows ], 'item_barcode': [ fields[1] for fields in rows ], 'item_title': [ fields[6] if len(fields) > 6 else '' for fields in rows ],
+        'gfa_delivery': [ fields[2] for fields in rows ], 'gfa_location': [ fields[3] for fields in rows ],
+        'request_type': ( request_types + [''] * len(rows) )[0:len(rows)], 'alma_pickup_library': ( pickup_libraries + [''] * len(rows) )[0:len(rows)] }
+
+
+def read_compacted_stamps( month_filepath ):
+    """ Returns the run-stamps already in a month's file; only that one column is read. """
+    if not os.path.exists( month_filepath ):
+        return set()
+    return set( pyarrow.parquet.read_table(month_filepath, columns=['datetime_stamp']).column('datetime_stamp').unique().to_pylist() )
+
+
+def read_all_compacted_stamps( history_dir_path ):
+    """ Returns the run-stamps in every month's file.
+        Called by retention.find_unindexed_stamps() """
+    if pyarrow == None:
+        raise Exception( 'the history store needs `pyarrow`; `pip install pyarrow`' )
+    stamps = set()
+    if os.path.isdir( history_dir_path ):
+        for month_dir_name in sorted( os.listdir(history_dir_path) ):
+            stamps.update( read_compacted_stamps(f'{history_dir_path}/{month_dir_name}/{MONTH_FILE_NAME}') )
+    return stamps
+
+
+def write_month( month_filepath, tables ):
+    """ Writes a month's tables -- any existing rows first -- as one Parquet file, replacing the old file only once the new one is complete. """
+    table = pyarrow.concat_tables( tables ).unify_dictionaries().combine_chunks()
+    table = table.sort_by( 'datetime_stamp' )  # keeps row-group statistics useful for date-range scans
+    temp_filepath = f'{month_filepath}.tmp'
+    pyarrow.parquet.write_table( table, temp_filepath, compression='zstd', use_dictionary=list(DICTIONARY_COLUMNS) )
+    os.replace( temp_filepath, month_filepath )
+    return table.num_rows
+
+
+def compact( history_dir_path, parsed_dir_path, originals_dir_path='', storage=None, parser_engine='bs4' ):
+    """ Adds every archived run not yet in the history; returns ( summary, err ).
+        summary is like { 'runs_added': 3, 'rows_added': 120, 'months_written': ['2021-08'] } """
+    ( summary, err ) = ( {'runs_added': 0, 'rows_added': 0, 'months_written': []}, None )
+    try:
+        if pyarrow == None:
+            raise Exception( 'the history store needs `pyarrow`; `pip install pyarrow`' )
+        storage = LocalStorage() if storage == None else storage
+        prsr = make_parser( parser_engine )
+        schema = make_schema()
+        ## -- group new runs by month -----------
+        stamps_by_month = {}
+        for name in sorted( storage.list(parsed_dir_path) ):
+            if name.startswith( 'REQ-ALMA-PARSED_' ) and name.endswith( '.dat' ):
+                datetime_stamp = name[len('REQ-ALMA-PARSED_'):-len('.dat')]
+                stamps_by_month.setdefault( datetime_stamp[0:7], [] ).append( datetime_stamp )
+        ## -- rewrite each month gaining runs ---
+        for ( month, stamps ) in sorted( stamps_by_month.items() ):
+            month_filepath = f'{history_dir_path}/month={month}/{MONTH_FILE_NAME}'
+            compacted_stamps = read_compacted_stamps( month_filepath )
+            new_stamps = [ stamp for stamp in stamps if stamp not in compacted_stamps ]
+            if not new_stamps:
+                continue
+            new_tables = [ pyarrow.table(read_run_records(storage, parsed_dir_path, originals_dir_path, stamp, prsr), schema=schema) for stamp in new_stamps ]
+            os.makedirs( os.path.dirname(month_filepath), exist_ok=True )
+            existing_tables = [ pyarrow.parquet.read_table(month_filepath, schema=schema) ] if compacted_stamps else []
+            write_month( month_filepath, existing_tables + new_tables )
+            summary['runs_added'] += len( new_stamps )
+            summary['rows_added'] += sum( table.num_rows for table in new_tables )
+            summary['months_written'].append( month )
+        log.info( f'compaction summary, ``{summary}``' )
+    except Exception as e:
+        err = repr(e)
+        log.exception( f'Problem compacting history, ``{err}``' )
+    return ( summary, err )
+
+
+def open_history( history_dir_path ):
+    """ Returns the history as a pyarrow dataset, with `month` as a partition-column; scans read only the columns & months they ask for, eg...
+          open_history( path ).to_table( columns=['request_type'], filter=pyarrow.dataset.field('month') >= '2021-01' ) """
+    if pyarrow == None:
+        raise Exception( 'the history store needs `pyarrow`; `pip install pyarrow`' )
+    return pyarrow.dataset.dataset( history_dir_path, format='parquet', partitioning='hive', schema=make_schema().append(pyarrow.field('month', pyarrow.string())) )
+
+
+def count_by( history_dir_path, column_names ):
+    """ Returns [ {column: value, ..., 'request_count': n}, ... ] over the whole history, largest first. """
+    table = open_history( history_dir_path ).to_table( columns=list(column_names) ).unify_dictionaries()  # each month's file has its own dictionaries
+    counted = table.group_by( list(column_names) ).aggregate( [([], 'count_all')] ).rename_columns( [*column_names, 'request_count'] )
+    return sorted( counted.to_pylist(), key=lambda row: -row['request_count'] )
+
+
+if __name__ == '__main__':
+    history_dir_path = os.environ['ANX_ALMA__PATH_TO_HISTORY_DIRECTORY']
+    if sys.argv[1:2] == [ 'compact' ]:
+        ( summary, err ) = compact( history_dir_path, os.environ['ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY'], os.environ.get('ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY', ''), parser_engine=os.environ.get('ANX_ALMA__PARSER_ENGINE', 'bs4') )
+        print( err if err else summary )
+        sys.exit( 1 if err else 0 )
+    elif sys.argv[1:2] == [ 'counts' ] and sys.argv[2:]:
+        for row in count_by( history_dir_path, sys.argv[2:] ):
+            print( '  '.join(str(value) for value in row.values()) )
+    else:
+        print( 'usage: history.py compact | history.py counts column-name [column-name ...]' )
+        sys.exit( 1 )
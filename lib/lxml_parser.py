@@ -0,0 +1,88 @@
+"""
+An lxml-based parsing engine, meant to produce exactly what the BeautifulSoup-based Parser produces, faster.
+Only the xml-handling is replaced -- make_item_list(), parse_element() & item_to_xml() -- so every parse_* rule is shared with Parser.
+Equivalence is checked by `lib/engine_harness.py`.
+"""
+
+import logging, mmap, os
+
+from lxml import etree
+from parse_alma_annex_requests_code.lib.parser import Parser, find_xml_start
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+FEED_CHUNK_SIZE = 1024 * 1024
+
+
+class LxmlParser( Parser ):
+
+    def __init__( self, mapping_config=None ):
+        super().__init__( mapping_config )
+        self.indexed_item = None
+        self.item_index = {}  # local-name -> first descendant element with that name, for self.indexed_item
+
+    def make_item_list( self, all_text ):
+        ( self.items, err ) = ( [], None )
+        try:
+            assert type( all_text ) in ( str, bytes, mmap.mmap )
+            if type( all_text ) == str:
+                if not all_text.startswith( '<' ):
+                    all_text = all_text.lstrip()  # alma files can start with a blank line, which BeautifulSoup tolerates but strict lxml rejects
+                root = etree.fromstring( all_text.encode('utf-8') )  # bytes, since lxml rejects a str with an encoding-declaration
+            else:
+                root = self.parse_bytes( all_text )
+            self.items = [ element for element in root.iter('{*}rsExport') ]
+            log.debug( f'len(self.items), ``{len(self.items)}``' )
+        except Exception as e:
+            self.items = []
+            err = repr(e)
+            log.exception( f'problem making item-list, ``{err}``' )
+        return ( self.items, err )
+
+    def parse_bytes( self, file_bytes ):
+        """ Returns the root element of bytes or an mmap, fed to lxml a chunk at a time, so a mapped file is never copied whole.
+            lxml reads the encoding from the BOM or xml-declaration. """
+        feed_parser = etree.XMLParser()
+        for start in range( find_xml_start(file_bytes), len(file_bytes), FEED_CHUNK_SIZE ):
+            feed_parser.feed( file_bytes[start:start + FEED_CHUNK_SIZE] )
+        return feed_parser.close()
+
+    def parse_element( self, item, tag_name ):
+        """ Returns text for given tag-name -- like Parser.parse_element(), the text of the first descendant with that local-name.
+            The item's descendants are indexed once, on the first lookup, so each later lookup is a dict-get. """
+        ( element_text, err ) = ( '', None )
+        try:
+            assert type(item) == etree._Element
+            assert type(tag_name) == str
+            if self.indexed_item is not item:
+                self.item_index = {}
+                for element in item.iterdescendants( etree.Element ):  # elements only; skips comments & processing-instructions
+                    self.item_index.setdefault( element.tag.rpartition('}')[2], element )
+                self.indexed_item = item
+            element = self.item_index.get( tag_name )
+            if element is not None:
+                element_text = ''.join( element.itertext(etree.Element, with_tail=True) ) if len( element ) else ( element.text or '' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'problem parsing tag, ``{tag_name}``, ``{err}``' )
+        return ( element_text, err )
+
+    def item_to_xml( self, item ):
+        return etree.tostring( item, encoding='unicode', with_tail=False )
+
+    ## end class LxmlParser()
@@ -3,6 +3,8 @@ All Alma 'pickup-library' entries must resolve to one of these GFA 'delivery-sto
 [ 'AN', 'ED', 'EH', 'HA', 'OR', 'RO', 'SC' ]
 """
 
+GFA_DELIVERY_CODES = ( 'AN', 'ED', 'EH', 'HA', 'OR', 'RO', 'SC' )
+
 ALMA_PICKUP_TO_GFA_DELIVERY = {
     'ANNEX READING ROOM': 'AN',
     'ANNEX': 'AN',
@@ -29,6 +31,8 @@ All Alma 'libraryCode' entries must resolve to one of these GFA 'location' codes
 [ 'QH', 'QS' ]
 """
 
+GFA_LOCATION_CODES = ( 'QH', 'QS' )
+
 ALMA_LIBRARY_CODE_TO_GFA_LOCATION = {
     'ANNEX': 'QS',
     'ANNEX_HAY': 'QH',
@@ -39,3 +43,14 @@ ALMA_LIBRARY_CODE_TO_GFA_LOCATION = {
     'SCI': 'QS',
     'SCIENCE': 'QS'
 }
+
+
+"""
+These GFA 'delivery-stop' codes determine the GFA 'location' code, regardless of the Alma 'libraryCode'.
+"""
+
+GFA_DELIVERY_TO_GFA_LOCATION = {
+    'ED': 'QS',
+    'EH': 'QH',
+    'RO': 'QS'     # 2021-August-26: implemented to handle ALMA pickup-location `PERSONAL_DELIVERY`
+}
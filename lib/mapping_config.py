@@ -0,0 +1,145 @@
+"""
+Compiles the alma-to-gfa mappings into frozen lookup-tables.
+The mappings come from `lib/mapper.py`, or -- if `ANX_ALMA__MAPPING_CONFIG_PATH` is set -- from a json (or toml) file like...
+    {
+      "alma_pickup_to_gfa_delivery": { "Rockefeller Library": "RO", ... },
+      "alma_library_code_to_gfa_location": { "ROCK": "QS", ... },
+      "gfa_delivery_to_gfa_location": { "ED": "QS", ... }
+    }
+...which is re-read whenever its mtime changes, so a long-running process picks up edits without a restart.
+To check a config-file before deploying it...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/mapping_config.py /path/to/mapping_config.json
+"""
+
+import hashlib, json, logging, os, sys, types
+
+try:
+    import tomllib  # python 3.11+
+except ImportError:
+    tomllib = None
+
+## `__main__` runs this module directly, so add the enclosing-project path as the other entry-points do
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.lib import mapper
+from parse_alma_annex_requests_code.lib.resolver import MappingResolver
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+MAPPING_CONFIG_PATH = os.environ.get( 'ANX_ALMA__MAPPING_CONFIG_PATH', '' )  # empty means use `lib/mapper.py`
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+class MappingTables():
+    """ Immutable, validated lookup-tables compiled from one set of mappings. """
+
+    def __init__( self, alma_pickup_to_gfa_delivery, alma_library_code_to_gfa_location, gfa_delivery_to_gfa_location, source='lib/mapper.py' ):
+        self.source = source
+        self.validate( alma_pickup_to_gfa_delivery, alma_library_code_to_gfa_location, gfa_delivery_to_gfa_location )
+        self.alma_pickup_to_gfa_delivery = types.MappingProxyType( dict(alma_pickup_to_gfa_delivery) )
+        self.alma_library_code_to_gfa_location = types.MappingProxyType( dict(alma_library_code_to_gfa_location) )
+        self.gfa_delivery_to_gfa_location = types.MappingProxyType( dict(gfa_delivery_to_gfa_location) )
+        self.pickup_library_resolver = MappingResolver( self.alma_pickup_to_gfa_delivery, 'alma pickup-library' )
+        self.library_code_resolver = MappingResolver( self.alma_library_code_to_gfa_location, 'alma library-code' )
+        self.version = self.make_version()
+        log.info( f'mapping-tables compiled from ``{source}``; version, ``{self.version}``' )
+
+    def validate( self, alma_pickup_to_gfa_delivery, alma_library_code_to_gfa_location, gfa_delivery_to_gfa_location ):
+        """ Raises ValueError listing every entry that doesn't resolve to an allowed GFA code. """
+        problems = []
+        for ( table_name, table, allowed_keys, allowed_values ) in [
+                ( 'alma_pickup_to_gfa_delivery', alma_pickup_to_gfa_delivery, None, mapper.GFA_DELIVERY_CODES ),
+                ( 'alma_library_code_to_gfa_location', alma_library_code_to_gfa_location, None, mapper.GFA_LOCATION_CODES ),
+                ( 'gfa_delivery_to_gfa_location', gfa_delivery_to_gfa_location, mapper.GFA_DELIVERY_CODES, mapper.GFA_LOCATION_CODES ) ]:
+            if not isinstance( table, dict ):
+                problems.append( f'{table_name} is not a mapping' )
+                continue
+            for ( key, value ) in table.items():
+                if type(key) != str or type(value) != str:
+                    problems.append( f'{table_name}: ``{key}``: ``{value}`` is not a string-to-string entry' )
+                elif allowed_keys is not None and key not in allowed_keys:
+                    problems.append( f'{table_name}: key ``{key}`` is not one of ``{allowed_keys}``' )
+                elif value not in allowed_values:
+                    problems.append( f'{table_name}: ``{key}`` maps to ``{value}``, which is not one of ``{allowed_values}``' )
+        if problems:
+            raise ValueError( f'invalid mappings from ``{self.source}``: {"; ".join(problems)}' )
+        return
+
+    def make_version( self ):
+        """ Returns a short hash of the table contents, for logs & status-reports. """
+        canonical = json.dumps( [
+            dict(self.alma_pickup_to_gfa_delivery), dict(self.alma_library_code_to_gfa_location), dict(self.gfa_delivery_to_gfa_location) ],
+            sort_keys=True )
+        return hashlib.sha256( canonical.encode('utf-8') ).hexdigest()[0:12]
+
+    ## end class MappingTables()
+
+
+def load_mapping_tables( config_path ):
+    """ Reads & compiles a json or toml mapping-file; raises on an unreadable or invalid file. """
+    if config_path.endswith( '.toml' ):
+        if tomllib is None:
+            raise RuntimeError( 'toml mapping-files need python 3.11+; use json instead' )
+        with open( config_path, 'rb' ) as f:
+            data = tomllib.load( f )
+    else:
+        with open( config_path, encoding='utf-8' ) as f:
+            data = json.load( f )
+    return MappingTables(
+        data.get( 'alma_pickup_to_gfa_delivery', mapper.ALMA_PICKUP_TO_GFA_DELIVERY ),
+        data.get( 'alma_library_code_to_gfa_location', mapper.ALMA_LIBRARY_CODE_TO_GFA_LOCATION ),
+        data.get( 'gfa_delivery_to_gfa_location', mapper.GFA_DELIVERY_TO_GFA_LOCATION ),
+        source=config_path )
+
+
+class MappingConfig():
+    """ Serves the current MappingTables, recompiling them when the config-file's mtime changes.
+        A config-file that fails to load or validate is logged, and the previous tables stay in use. """
+
+    def __init__( self, config_path='' ):
+        self.config_path = config_path
+        self.config_mtime = None
+        self.tables = None
+
+    def get_tables( self ):
+        """ Returns current tables; costs one stat() when a config-file is set.
+            Called once per run, so a run never sees two versions of the mappings. """
+        if not self.config_path:
+            if self.tables is None:
+                self.tables = MappingTables( mapper.ALMA_PICKUP_TO_GFA_DELIVERY, mapper.ALMA_LIBRARY_CODE_TO_GFA_LOCATION, mapper.GFA_DELIVERY_TO_GFA_LOCATION )
+            return self.tables
+        try:
+            config_mtime = os.stat( self.config_path ).st_mtime_ns
+            if config_mtime != self.config_mtime:
+                log.info( f'loading mapping-config, ``{self.config_path}``' )
+                self.tables = load_mapping_tables( self.config_path )
+                self.config_mtime = config_mtime
+        except Exception as e:
+            if self.tables is None:
+                raise
+            log.exception( f'problem reloading mapping-config, ``{repr(e)}``; keeping version ``{self.tables.version}``' )
+        return self.tables
+
+    ## end class MappingConfig()
+
+
+DEFAULT_MAPPING_CONFIG = MappingConfig( MAPPING_CONFIG_PATH )
+
+
+if __name__ == '__main__':
+    config_path = sys.argv[1]
+    tables = load_mapping_tables( config_path )
+    print( f'``{config_path}`` is valid; version, ``{tables.version}``' )
@@ -1,8 +1,11 @@
-import datetime, logging, os, pathlib, sys
+import datetime, logging, mmap, os, pathlib, sys
 
 import bs4
 from bs4 import BeautifulSoup
-from parse_alma_annex_requests_code.lib import mapper
+from parse_alma_annex_requests_code.lib.mapping_config import DEFAULT_MAPPING_CONFIG
+from parse_alma_annex_requests_code.lib.records import AlmaRequest, GfaEntry
+from parse_alma_annex_requests_code.lib.sanitizer import Sanitizer
+from parse_alma_annex_requests_code.lib.storage import LocalStorage
 
 
 ## settings from env/activate
@@ -21,13 +24,33 @@ log = logging.getLogger(__name__)
 log.debug( 'log setup' )
 
 
+UTF8_BOM = b'\xef\xbb\xbf'
+
+XML_WHITESPACE_BYTES = b' \t\r\n'
+
+
+def find_xml_start( data ):
+    """ Returns the offset of the xml in `data` (bytes, or a memory-mapped file): past any utf-8 BOM and leading whitespace,
+          since alma files can start with a blank line, which a strict xml-parser rejects before the xml-declaration.
+        Other BOMs (eg utf-16's) are kept, for the xml-parser to read the encoding from. """
+    offset = len( UTF8_BOM ) if data[0:3] == UTF8_BOM else 0
+    while offset < len( data ) and data[offset:offset + 1] in XML_WHITESPACE_BYTES and offset < 1024:
+        offset += 1
+    return offset
+
+
 class Parser():
 
-    def __init__(self):
+    def __init__( self, mapping_config=None ):
         self.all_text = ''
         self.items = []  # bs4.element.ResultSet
         self.item_text = ''
         self.xml_obj = None
+        ## one snapshot of the mapping-tables per Parser, so a reload never lands mid-file
+        self.mapping_tables = ( mapping_config or DEFAULT_MAPPING_CONFIG ).get_tables()
+        self.pickup_library_resolver = self.mapping_tables.pickup_library_resolver
+        self.library_code_resolver = self.mapping_tables.library_code_resolver
+        self.sanitizer = Sanitizer()  # cleans every GFA field; its counts cover this Parser's run
 
     ## -- non-parsing methods -------------------
 
@@ -44,26 +67,63 @@ class Parser():
         log.debug( f'self.all_text, ``{self.all_text[0:100]}``' )
         return ( self.all_text, err )
 
+    def load_file_bytes( self, filepath, storage=None ):
+        """ Memory-maps the file, for make_item_list(); returns ( file_bytes, err ). Nothing is read, or decoded, until the xml-engine needs it.
+            file_bytes is an mmap -- or, for an empty file, which can't be mapped, b'' -- to be released with close_file_bytes().
+            With a non-local `storage` (see lib/storage.py), which can't be mapped, the file is read through storage.open_stream() into bytes.
+            Called by controller.process_file() and controller.load_and_prepare() """
+        ( file_bytes, err ) = ( b'', None )
+        try:
+            log.debug( f'filepath, ``{filepath}``' )
+            assert type( filepath ) == str
+            if storage != None and not isinstance( storage, LocalStorage ):
+                with storage.open_stream( filepath ) as stream:
+                    file_bytes = stream.read()
+                return ( file_bytes, err )
+            with open( filepath, 'rb' ) as f:
+                if os.fstat( f.fileno() ).st_size > 0:
+                    file_bytes = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )  # the mapping stays valid after the file is closed
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'problem loading source-file, ``{err}``' )
+        log.debug( f'len(file_bytes), ``{len(file_bytes)}``' )
+        return ( file_bytes, err )
+
+    def close_file_bytes( self, file_bytes ):
+        """ Releases a file_bytes from load_file_bytes(); the items made from it don't refer back to it. """
+        if type( file_bytes ) == mmap.mmap:
+            file_bytes.close()
+        return
+
     def make_item_list( self, all_text ):
+        """ all_text is a str, or bytes / an mmap from load_file_bytes(); bytes are decoded by the xml-engine, per the BOM or xml-declaration. """
         ( self.items, err ) = ( [], None )
         try:
-            log.debug( f'all_text, ``{all_text}``' )
-            assert type( all_text ) == str
+            assert type( all_text ) in ( str, bytes, mmap.mmap )
+            log.debug( f'len(all_text), ``{len(all_text)}``; type, ``{type(all_text).__name__}``' )
             ( self.items_text, err ) = ( [], None )
-            soup = BeautifulSoup( all_text, 'xml' )  # encoding not specified because I'm giving it unicode
+            if type( all_text ) != str:
+                all_text = bytes( all_text[find_xml_start(all_text):] )  # BeautifulSoup reads a document into memory regardless
+            elif not all_text.startswith( '<' ):
+                all_text = all_text.lstrip()  # before the xml-declaration, even a blank line puts the xml-parser into recovery, which can drop entities
+            soup = BeautifulSoup( all_text, 'xml' )  # for bytes, no encoding is given, so the declared encoding is used
             self.items = soup.select( 'rsExport' )
-            log.debug( f'self.items, ``{self.items}``' )
+            log.debug( f'len(self.items), ``{len(self.items)}``' )
             assert type(self.items) == bs4.element.ResultSet
             return ( self.items, err )
         except Exception as e:
             err = repr(e)
             log.exception( f'problem making item-list, ``{err}``' )
-        log.debug( f'self.items, ``{self.items}``' )
+        log.debug( f'len(self.items), ``{len(self.items)}``' )
         return ( self.items, err )
 
+    def item_to_xml( self, item ):
+        """ Returns an item's xml, eg for a quarantine-file. """
+        return str( item )
+
     def prepare_gfa_entry( self, item_id, item_title, item_barcode, patron_name, patron_barcode, patron_note, parsed_alma_pickup_library, parsed_alma_library_code ):
-        """ Prepares all GFA data elements. """
-        ( gfa_entry, err ) = ( [], None )
+        """ Prepares all GFA data elements; returns a GfaEntry. """
+        ( gfa_entry, err ) = ( None, None )
         try:
             for element in [ item_id, item_title, item_barcode, patron_name, patron_barcode, patron_note, parsed_alma_pickup_library, parsed_alma_library_code ]:
                 assert type( element ) == str
@@ -71,22 +131,101 @@ class Parser():
             if err == None:
                 ( gfa_location, err ) = self.transform_parsed_alma_library_code( parsed_alma_library_code, gfa_delivery )
                 if err == None:
-                    gfa_entry = [
-                        item_id, item_barcode, gfa_delivery, gfa_location, patron_name, patron_barcode, item_title, self.prepare_gfa_datetime(), patron_note
-                    ]
+                    gfa_entry = GfaEntry( **self.sanitizer.sanitize_fields( {
+                        'item_id': item_id, 'item_barcode': item_barcode, 'gfa_delivery': gfa_delivery, 'gfa_location': gfa_location, 'patron_name': patron_name,
+                        'patron_barcode': patron_barcode, 'item_title': item_title, 'gfa_date_str': self.prepare_gfa_datetime(), 'patron_note': patron_note } ) )
         except Exception as e:
             err = repr( e )
             log.exception( f'problem preparing gfa entry, ``{err}``' )
         log.debug( f'gfa_entry, ``{gfa_entry}``' )
         return ( gfa_entry, err )
 
+    def prepare_gfa_columns( self, item_ids, item_titles, item_barcodes, patron_names, patron_barcodes, patron_notes, parsed_alma_pickup_libraries, parsed_alma_library_codes, gfa_date_str=None ):
+        """ Batch version of prepare_gfa_entry(); each argument is a column (list) holding one value per request.
+            Each distinct (pickup-library, library-code) pair is transformed once, and the date-string is prepared once.
+            Returns ( gfa_columns, row_errs, err ):
+            - gfa_columns: [ item_ids, item_barcodes, gfa_deliveries, gfa_locations, patron_names, patron_barcodes, item_titles, gfa_date_strs, patron_notes ], holding only rows that transformed
+            - row_errs: { row_index: err } for rows that didn't
+            For callers holding columns; controller.process_requests() holds AlmaRequest records, and uses prepare_gfa_entries(). """
+        ( gfa_columns, row_errs, err ) = ( [], {}, None )
+        try:
+            columns = [ item_ids, item_titles, item_barcodes, patron_names, patron_barcodes, patron_notes, parsed_alma_pickup_libraries, parsed_alma_library_codes ]
+            row_count = len( item_ids )
+            for column in columns:
+                assert type( column ) == list
+                assert len( column ) == row_count
+            if gfa_date_str == None:
+                gfa_date_str = self.prepare_gfa_datetime()
+            gfa_deliveries = []
+            gfa_locations = []
+            for ( row_index, ( gfa_delivery, gfa_location, pair_err ) ) in enumerate( self.transform_distinct_pairs(parsed_alma_pickup_libraries, parsed_alma_library_codes) ):
+                if pair_err:
+                    row_errs[row_index] = pair_err
+                gfa_deliveries.append( gfa_delivery )
+                gfa_locations.append( gfa_location )
+            ## assemble gfa columns ----------------
+            gfa_columns = [ item_ids, item_barcodes, gfa_deliveries, gfa_locations, patron_names, patron_barcodes, item_titles, [gfa_date_str] * row_count, patron_notes ]
+            if row_errs:
+                gfa_columns = [ [value for (row_index, value) in enumerate(column) if row_index not in row_errs] for column in gfa_columns ]
+            sanitize = self.sanitizer.sanitize
+            gfa_columns = [ [sanitize(field_name, value) for value in column] for ( field_name, column ) in zip(GfaEntry.__slots__, gfa_columns) ]
+        except Exception as e:
+            ( gfa_columns, row_errs ) = ( [], {} )
+            err = repr( e )
+            log.exception( f'problem preparing gfa columns, ``{err}``' )
+        log.debug( f'row_errs, ``{row_errs}``' )
+        return ( gfa_columns, row_errs, err )
+
+    def prepare_gfa_entries( self, alma_requests, gfa_date_str=None ):
+        """ Batch version of prepare_gfa_entry() for a list of AlmaRequest records.
+            Each distinct (pickup-library, library-code) pair is transformed once, and the date-string is prepared once.
+            Returns ( gfa_entries, row_errs, err ) -- gfa_entries for the requests that transformed; row_errs as { row_index: err } for those that didn't.
+            Called by controller.process_requests() """
+        ( gfa_entries, row_errs, err ) = ( [], {}, None )
+        try:
+            assert type( alma_requests ) == list
+            if gfa_date_str == None:
+                gfa_date_str = self.prepare_gfa_datetime()
+            transformed_rows = self.transform_distinct_pairs(
+                [ request.parsed_alma_pickup_library for request in alma_requests ], [ request.parsed_alma_library_code for request in alma_requests ] )
+            for ( row_index, ( request, ( gfa_delivery, gfa_location, pair_err ) ) ) in enumerate( zip(alma_requests, transformed_rows) ):
+                if pair_err:
+                    row_errs[row_index] = pair_err
+                    continue
+                gfa_entries.append( GfaEntry( **self.sanitizer.sanitize_fields( {
+                    'item_id': request.item_id, 'item_barcode': request.item_barcode, 'gfa_delivery': gfa_delivery, 'gfa_location': gfa_location, 'patron_name': request.patron_name,
+                    'patron_barcode': request.patron_barcode, 'item_title': request.item_title, 'gfa_date_str': gfa_date_str, 'patron_note': request.patron_note } ) ) )
+        except Exception as e:
+            ( gfa_entries, row_errs ) = ( [], {} )
+            err = repr( e )
+            log.exception( f'problem preparing gfa entries, ``{err}``' )
+        log.debug( f'row_errs, ``{row_errs}``' )
+        return ( gfa_entries, row_errs, err )
+
+    def transform_distinct_pairs( self, parsed_alma_pickup_libraries, parsed_alma_library_codes ):
+        """ Returns [ (gfa_delivery, gfa_location, err), ... ], one per row, transforming each distinct pair only once.
+            Called by prepare_gfa_columns() and prepare_gfa_entries() """
+        transformed_pairs = {}  # ( pickup_library, library_code ) -> ( gfa_delivery, gfa_location, err )
+        transformed_rows = []
+        for pair in zip( parsed_alma_pickup_libraries, parsed_alma_library_codes ):
+            try:
+                transformed_rows.append( transformed_pairs[pair] )
+            except KeyError:
+                ( gfa_delivery, err ) = self.transform_parsed_alma_pickup_library( pair[0] )
+                gfa_location = ''
+                if err == None:
+                    ( gfa_location, err ) = self.transform_parsed_alma_library_code( pair[1], gfa_delivery )
+                transformed_pairs[pair] = ( gfa_delivery, gfa_location, err )
+                transformed_rows.append( transformed_pairs[pair] )
+        log.debug( f'``{len(transformed_pairs)}`` distinct pairs transformed for ``{len(transformed_rows)}`` rows' )
+        return transformed_rows
+
     def transform_parsed_alma_pickup_library( self, parsed_alma_pickup_library ):
         log.debug( f'parsed_alma_pickup_library, ``{parsed_alma_pickup_library}``' )
         ( gfa_delivery, err ) = ( '', None )
         try:
             assert type( parsed_alma_pickup_library) == str
-            source_dct = mapper.ALMA_PICKUP_TO_GFA_DELIVERY
-            gfa_delivery = source_dct[parsed_alma_pickup_library]
+            gfa_delivery = self.pickup_library_resolver.resolve( parsed_alma_pickup_library )
         except Exception as e:
             err = repr( e )
             log.exception( f'problem preparing gfa_delivery, ``{err}``' )
@@ -94,28 +233,35 @@ class Parser():
         return ( gfa_delivery, err )
 
     def transform_parsed_alma_library_code( self, parsed_alma_library_code, gfa_delivery ):
-        """ X
+        """ Some GFA delivery-stops determine the GFA location (see `mapper.GFA_DELIVERY_TO_GFA_LOCATION`); otherwise the alma library-code does.
             Called by prepare_gfa_entry() """
         ( gfa_location, err ) = ( '', None )
         log.debug( f'parsed_alma_library_code, ``{parsed_alma_library_code}``; gfa_delivery, ``{gfa_delivery}``' )
         try:
             assert type( parsed_alma_library_code) == str
             assert type( gfa_delivery ) == str
-            if gfa_delivery == 'ED':
-                gfa_location = 'QS'
-            elif gfa_delivery == 'EH':
-                gfa_location = 'QH'
-            elif gfa_delivery == 'RO':  # 2021-August-26: implemented to handle ALMA pickup-location `PERSONAL_DELIVERY`
-                gfa_location = 'QS'
+            delivery_overrides = self.mapping_tables.gfa_delivery_to_gfa_location
+            if gfa_delivery in delivery_overrides:
+                gfa_location = delivery_overrides[gfa_delivery]
             else:
-                source_dct = mapper.ALMA_LIBRARY_CODE_TO_GFA_LOCATION
-                gfa_location = source_dct[parsed_alma_library_code]
+                gfa_location = self.library_code_resolver.resolve( parsed_alma_library_code )
         except Exception as e:
             err = repr( e )
             log.exception( f'problem preparing gfa_location, ``{err}``' )
         log.debug( f'gfa_location, ``{gfa_location}``' )
         return ( gfa_location, err )
 
+    def prepare_sidecar_record( self, sidecar_fields, alma_request, gfa_entry ):
+        """ Returns the json-lines sidecar dict for one request: the raw alma fields, followed by the mapped GFA codes.
+            Called by controller.prepare_batch() """
+        return {
+            'request_id': sidecar_fields['request_id'], 'request_type': sidecar_fields['request_type'], 'mms_id': sidecar_fields['mms_id'],
+            'item_id': alma_request.item_id, 'item_barcode': alma_request.item_barcode, 'item_title': alma_request.item_title,
+            'patron_name': alma_request.patron_name, 'patron_barcode': alma_request.patron_barcode, 'patron_email': sidecar_fields['patron_email'], 'patron_note': alma_request.patron_note,
+            'alma_pickup_library': sidecar_fields['alma_pickup_library'], 'alma_library_code': alma_request.parsed_alma_library_code,
+            'parsed_alma_pickup_library': alma_request.parsed_alma_pickup_library,
+            'gfa_delivery': gfa_entry.gfa_delivery, 'gfa_location': gfa_entry.gfa_location, 'gfa_date_str': gfa_entry.gfa_date_str }
+
     def prepare_gfa_datetime( self, datetime_obj=None ):
         """ In practice, no datetime-object will be passed in, but the 'datetime_obj=None' allows for easy testing. """
         if datetime_obj == None:
@@ -126,6 +272,38 @@ class Parser():
 
     ## -- just parsers ---------------------------
 
+    def parse_alma_request( self, item ):
+        """ Runs all the parsers below over one item; returns an AlmaRequest.
+            Called by controller.process_requests() """
+        ( alma_request, err ) = ( None, None )
+        ( item_id, err01 ) = self.parse_item_id( item )
+        ( item_title, err02 ) = self.parse_item_title( item )
+        ( item_barcode, err03 ) = self.parse_item_barcode( item )
+        ( patron_name, err04 ) = self.parse_patron_name( item )
+        ( patron_barcode, err05 ) = self.parse_patron_barcode( item )
+        ( patron_note, err06 ) = self.parse_patron_note( item )
+        ( parsed_alma_pickup_library, err07 ) = self.parse_alma_pickup_library( item )
+        ( parsed_alma_library_code, err08 ) = self.parse_alma_library_code( item )
+        errs = [ err for err in [ err01, err02, err03, err04, err05, err06, err07, err08 ] if err ]
+        if errs:
+            err = '; '.join( errs )
+        else:
+            alma_request = AlmaRequest(
+                item_id=item_id, item_title=item_title, item_barcode=item_barcode, patron_name=patron_name, patron_barcode=patron_barcode,
+                patron_note=patron_note, parsed_alma_pickup_library=parsed_alma_pickup_library, parsed_alma_library_code=parsed_alma_library_code )
+        return ( alma_request, err )
+
+    def parse_sidecar_fields( self, item ):
+        """ Parses the alma fields the GFA line drops, for the json-lines sidecar; returns ( sidecar_fields, err ).
+            `alma_pickup_library` is the raw `library` element (empty for digitization requests), before any interpretation.
+            Called by controller.prepare_batch() """
+        ( sidecar_fields, errs ) = ( {}, [] )
+        for ( field_name, tag_name ) in [ ('request_id', 'requestId'), ('request_type', 'requestType'), ('mms_id', 'mmsId'), ('patron_email', 'patronEmail'), ('alma_pickup_library', 'library') ]:
+            ( sidecar_fields[field_name], err ) = self.parse_element( item, tag_name )
+            if err:
+                errs.append( err )
+        return ( sidecar_fields, '; '.join(errs) if errs else None )
+
     def parse_item_id( self, item ):
         ( item_id, err ) = self.parse_element( item, 'itemId' )
         log.debug( f'item_id, ``{item_id}``' )
@@ -0,0 +1,165 @@
+"""
+Fast pre-check of a new file, run before it's archived or fully parsed.
+One streaming expat pass -- no tree is built -- checks that the file...
+- is well-formed xml (so a truncated export is caught)
+- holds at least one `rsExport` record
+- has, in every record, the elements GFA needs:
+    - `barcode`
+    - either `pickup/library` or a digitization `requestType`
+    - `libraryCode` -- unless the request's GFA delivery-stop decides the location by itself (digitizations, and eg `PERSONAL_DELIVERY`; see mapper.GFA_DELIVERY_TO_GFA_LOCATION)
+  `itemId` isn't required: alma leaves it out of some valid requests, and GFA accepts an empty item-id.
+  An unmapped pickup-library isn't a preflight problem; it's reported, or quarantined, by the full parse.
+To check a file by hand...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/preflight.py /path/to/BUL_ANNEX-foo.xml
+"""
+
+import logging, os, sys
+from xml.parsers import expat
+
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.lib.mapping_config import DEFAULT_MAPPING_CONFIG
+from parse_alma_annex_requests_code.lib.parser import find_xml_start
+from parse_alma_annex_requests_code.lib.resolver import UnknownMappingKeyError
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+REQUIRED_ELEMENTS = ( 'barcode', )
+
+CAPTURED_ELEMENTS = ( 'requestType', 'pickup/library' )  # text is only collected for these
+
+CHUNK_SIZE = 64 * 1024
+
+MAX_REPORTED_PROBLEMS = 50
+
+
+class Preflight():
+    """ Checks one file per check_file() call. """
+
+    def __init__( self, mapping_config=None ):
+        self.mapping_tables = ( mapping_config or DEFAULT_MAPPING_CONFIG ).get_tables()
+
+    def check_file( self, filepath, storage=None ):
+        """ Streams the file -- from `storage` (see lib/storage.py), if given -- through the check; returns ( report, err ); report is like...
+              { 'filepath': ..., 'passed': False, 'well_formed': True, 'record_count': 12, 'problems': ['record 3 (line 57): missing `barcode`'] }
+            err is only for a problem running the check (eg an unreadable file); a bad file is a failed report, not an err. """
+        ( report, err ) = ( {}, None )
+        try:
+            assert type(filepath) == str
+            state = { 'depth_names': [], 'record_count': 0, 'record_line': 0, 'seen': set(), 'captured': {}, 'capturing': None, 'problems': [] }
+            parser = self.make_parser( state )
+            well_formed = True
+            try:
+                with ( storage.open_stream(filepath) if storage != None else open(filepath, 'rb') ) as file_handler:
+                    chunk = file_handler.read( CHUNK_SIZE )
+                    chunk = chunk[find_xml_start(chunk):]  # skips a BOM & blank lines, as the parser does
+                    while chunk:
+                        parser.Parse( chunk, False )
+                        chunk = file_handler.read( CHUNK_SIZE )
+                    parser.Parse( b'', True )
+            except expat.ExpatError as e:
+                well_formed = False
+                state['problems'].append( f'not well-formed xml: {expat.ErrorString(e.code)}, at line {e.lineno}, column {e.offset}' )
+            if well_formed and state['record_count'] == 0:
+                state['problems'].append( 'no `rsExport` records' )
+            report = {
+                'filepath': filepath, 'passed': not state['problems'], 'well_formed': well_formed,
+                'record_count': state['record_count'], 'problems': state['problems'] }
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem running preflight check, ``{err}``' )
+        log.debug( f'report, ``{report}``; err, ``{err}``' )
+        return ( report, err )
+
+    def make_parser( self, state ):
+        """ Returns an expat parser whose handlers track, per record, the element-names seen. """
+        parser = expat.ParserCreate( namespace_separator='}' )  # names arrive as `{namespace-uri}}{local-name}`
+        parser.buffer_text = True
+
+        def start_element( name, attributes ):
+            local_name = name.rpartition( '}' )[2]
+            if local_name == 'rsExport':
+                state['record_count'] += 1
+                state['record_line'] = parser.CurrentLineNumber
+                state['seen'] = set()
+                state['captured'] = {}
+            else:
+                if local_name == 'library' and state['depth_names'][-1:] == ['pickup']:
+                    local_name = 'pickup/library'
+                state['seen'].add( local_name )
+                if local_name in CAPTURED_ELEMENTS:
+                    state['capturing'] = local_name
+                    state['captured'].setdefault( local_name, [] )
+            state['depth_names'].append( local_name )
+
+        def end_element( name ):
+            local_name = state['depth_names'].pop()
+            if local_name == state['capturing']:
+                state['capturing'] = None
+            elif local_name == 'rsExport':
+                self.check_record( state )
+
+        def character_data( text ):
+            if state['capturing']:
+                state['captured'][state['capturing']].append( text )
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+        return parser
+
+    def check_record( self, state ):
+        """ Notes the required elements a just-ended record lacks. """
+        missing = [ f'`{element_name}`' for element_name in REQUIRED_ELEMENTS if element_name not in state['seen'] ]
+        is_digitization = 'digitization' in ''.join( state['captured'].get('requestType', []) ).lower()
+        if not is_digitization and 'pickup/library' not in state['seen']:
+            missing.append( '`pickup/library` (required unless the `requestType` is a digitization)' )
+        if 'libraryCode' not in state['seen'] and not is_digitization and not self.delivery_sets_location( ''.join(state['captured'].get('pickup/library', [])) ):
+            missing.append( '`libraryCode`' )
+        if missing:
+            if len( state['problems'] ) < MAX_REPORTED_PROBLEMS:
+                state['problems'].append( f'record {state["record_count"]} (line {state["record_line"]}): missing {", ".join(missing)}' )
+            elif len( state['problems'] ) == MAX_REPORTED_PROBLEMS:
+                state['problems'].append( '(further problems not listed)' )
+        return
+
+    def delivery_sets_location( self, pickup_library ):
+        """ Returns True if the pickup-library's GFA delivery-stop decides the GFA location, so no `libraryCode` is needed. """
+        try:
+            gfa_delivery = self.mapping_tables.pickup_library_resolver.resolve( pickup_library )
+        except UnknownMappingKeyError:
+            return True  # left for the full parse to report, or quarantine
+        return gfa_delivery in self.mapping_tables.gfa_delivery_to_gfa_location
+
+    def format_report( self, report ):
+        """ Returns the report as text, for the log and the reject-report file. """
+        lines = [
+            f'preflight {"passed" if report["passed"] else "REJECTED"}: `{report["filepath"]}`',
+            f'well-formed, {report["well_formed"]}; records, {report["record_count"]}' ]
+        lines.extend( f'- {problem}' for problem in report['problems'] )
+        return '\n'.join( lines ) + '\n'
+
+    ## end class Preflight()
+
+
+if __name__ == '__main__':
+    preflight = Preflight()
+    ( report, err ) = preflight.check_file( sys.argv[1] )
+    print( err if err else preflight.format_report(report) )
+    sys.exit( 0 if report and report['passed'] else 1 )
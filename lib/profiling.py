@@ -0,0 +1,221 @@
+"""
+Profiling for production runs.
+- MemoryProfiler -- enabled by `$ python3 ./controller.py --memprofile`.
+    At each stage-boundary a tracemalloc snapshot is taken and peak RSS is recorded; the report lists, per stage,
+    the traced memory, the stage's traced peak, the process's peak RSS, the growth since the previous stage, and the top allocation sites.
+    Disabled -- the default -- tracemalloc is never started, and stage() returns immediately.
+- CpuProfiler -- enabled by `--cprofile`, or by the env-setting `ANX_ALMA__CPROFILE`; optionally only every Nth run is profiled.
+    Writes a cProfile `.pstats` file per profiled run.
+To summarize a `.pstats` file (top functions by cumulative time)...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/profiling.py /path/to/REQ-ALMA-CPROFILE_2021-07-13T13-41-39.pstats 25
+"""
+
+import cProfile, io, logging, os, pstats, sys, tracemalloc
+
+try:
+    import resource  # unix only
+except ImportError:
+    resource = None
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+SNAPSHOT_FILTERS = ( tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'), tracemalloc.Filter(False, '<unknown>') )
+
+
+def format_size( size_bytes ):
+    """ Returns a size like '1.5 MiB'; growth keeps its sign. """
+    for unit in ( 'B', 'KiB', 'MiB' ):
+        if abs( size_bytes ) < 1024:
+            return f'{size_bytes:.1f} {unit}' if unit != 'B' else f'{size_bytes} B'
+        size_bytes = size_bytes / 1024
+    return f'{size_bytes:.1f} GiB'
+
+
+def get_current_rss_bytes():
+    """ Returns the process's current resident-set-size, or None where `/proc` is unavailable (eg macOS). """
+    try:
+        with open( '/proc/self/statm' ) as file_handler:
+            return int( file_handler.read().split()[1] ) * os.sysconf( 'SC_PAGE_SIZE' )
+    except ( OSError, ValueError ):
+        return None
+
+
+class MemoryProfiler():
+    """ Records memory at named stage-boundaries; one instance per run. """
+
+    def __init__( self, enabled=False, top_n=10 ):
+        self.enabled = enabled
+        self.top_n = top_n
+        self.stages = []  # [ (stage_name, snapshot, traced_bytes, stage_peak_bytes, peak_rss_bytes), ... ]
+
+    def start( self ):
+        self.stages = []  # a resident controller reuses its profiler
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return
+
+    def stage( self, stage_name ):
+        """ Marks the end of a stage. """
+        if not self.enabled:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces( SNAPSHOT_FILTERS )
+        ( traced_bytes, stage_peak_bytes ) = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()  # so each stage reports its own peak
+        self.stages.append( (stage_name, snapshot, traced_bytes, stage_peak_bytes, self.get_peak_rss_bytes()) )
+        log.debug( f'stage ``{stage_name}``; traced, ``{format_size(traced_bytes)}``' )
+        return
+
+    def stop( self ):
+        if self.enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        return
+
+    def get_peak_rss_bytes( self ):
+        """ Returns the process's peak resident-set-size so far, or None where the `resource` module is unavailable. """
+        if resource == None:
+            return None
+        max_rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024  # bytes on macOS, KiB on linux
+
+    def make_report( self ):
+        lines = []
+        previous_snapshot = None
+        for ( stage_name, snapshot, traced_bytes, stage_peak_bytes, peak_rss_bytes ) in self.stages:
+            peak_rss = format_size( peak_rss_bytes ) if peak_rss_bytes != None else 'n/a'
+            lines.append( f'stage `{stage_name}`: traced {format_size(traced_bytes)}; stage-peak {format_size(stage_peak_bytes)}; peak rss {peak_rss}' )
+            if previous_snapshot != None:
+                lines.append( '  growth since previous stage:' )
+                for stat_diff in snapshot.compare_to( previous_snapshot, 'lineno' )[0:self.top_n]:
+                    lines.append( f'    {format_size(stat_diff.size_diff):>12}  {stat_diff.traceback[0]}' )
+            lines.append( '  top allocation sites:' )
+            for stat in snapshot.statistics( 'lineno' )[0:self.top_n]:
+                lines.append( f'    {format_size(stat.size):>12}  {stat.traceback[0]}  ({stat.count} blocks)' )
+            previous_snapshot = snapshot
+        return '\n'.join( lines ) + '\n'
+
+    def write_report( self, filepath ):
+        """ Writes the report; returns err. """
+        err = None
+        try:
+            with open( filepath, 'w', encoding='utf-8' ) as file_handler:
+                file_handler.write( self.make_report() )
+            log.info( f'memory-profile written to ``{filepath}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem writing memory-profile, ``{err}``' )
+        return err
+
+    ## end class MemoryProfiler()
+
+
+class CpuProfiler():
+    """ Runs cProfile over a run's processing when a profile is due; one instance per run. """
+
+    def __init__( self, enabled=False, every_n_runs=1, counter_filepath='' ):
+        self.enabled = enabled
+        self.every_n_runs = every_n_runs
+        self.counter_filepath = counter_filepath  # persists the run-count between runs; '' profiles every run
+        self.profile = None
+        self.thread_profiles = []  # from profiled() callables, run on other threads
+
+    def start( self ):
+        """ Starts profiling if enabled and this run is due; a problem with the run-count only skips profiling. """
+        self.profile = None  # a resident controller reuses its profiler
+        self.thread_profiles = []
+        if self.enabled == False:
+            return
+        try:
+            is_due = self.is_due()
+        except Exception:
+            log.exception( 'problem counting runs; not profiling' )
+            return
+        if is_due:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return
+
+    def stop( self ):
+        if self.profile != None:
+            self.profile.disable()
+        return
+
+    def profiled( self, func ):
+        """ Returns `func`, wrapped to run under a profile of its own if this run is being profiled.
+            cProfile only sees the thread that enabled it, so work handed to another thread (eg by asyncio.to_thread()) needs this; write_stats() merges the threads' stats in. """
+        if self.profile == None:
+            return func
+        def run_profiled( *args, **kwargs ):
+            thread_profile = cProfile.Profile()
+            try:
+                thread_profile.enable()
+            except ValueError:  # python 3.12+ allows one profile at a time, and it already sees every thread
+                return func( *args, **kwargs )
+            try:
+                return func( *args, **kwargs )
+            finally:
+                thread_profile.disable()
+                self.thread_profiles.append( thread_profile )  # list-appends are thread-safe
+        return run_profiled
+
+    def is_due( self ):
+        """ Counts this run; returns True for every `every_n_runs`-th run. """
+        if self.every_n_runs <= 1 or self.counter_filepath == '':
+            return True
+        run_count = 0
+        try:
+            with open( self.counter_filepath ) as file_handler:
+                run_count = int( file_handler.read().strip() or '0' )
+        except FileNotFoundError:
+            pass
+        run_count += 1
+        with open( self.counter_filepath, 'w' ) as file_handler:
+            file_handler.write( f'{run_count}\n' )
+        log.debug( f'cprofile run_count, ``{run_count}``; every_n_runs, ``{self.every_n_runs}``' )
+        return run_count % self.every_n_runs == 0
+
+    def write_stats( self, filepath ):
+        """ Dumps the profile, with any threads' profiles merged in, if this run was profiled; returns err. """
+        err = None
+        if self.profile == None:
+            return err
+        try:
+            stats = pstats.Stats( self.profile )
+            for thread_profile in self.thread_profiles:
+                stats.add( thread_profile )
+            stats.dump_stats( filepath )
+            log.info( f'cpu-profile written to ``{filepath}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem writing cpu-profile, ``{err}``' )
+        return err
+
+    ## end class CpuProfiler()
+
+
+def summarize_stats( filepath, top_n=20 ):
+    """ Returns the top `top_n` functions of a `.pstats` file, by cumulative time. """
+    stream = io.StringIO()
+    stats = pstats.Stats( filepath, stream=stream )
+    stats.strip_dirs().sort_stats( 'cumulative' ).print_stats( top_n )
+    return stream.getvalue()
+
+
+if __name__ == '__main__':
+    print( summarize_stats(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 20) )
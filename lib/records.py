@@ -0,0 +1,60 @@
+"""
+Compact record-types for one parsed Alma request and one GFA entry.
+Fields are set by keyword, so a value can't land in the wrong position.
+Low-cardinality fields are interned, so a large batch holds one copy of each distinct code & date-string.
+"""
+
+import sys
+
+
+class AlmaRequest():
+    """ Fields parsed from one alma `rsExport` element.
+        Created by Parser.parse_alma_request() """
+
+    __slots__ = ( 'item_id', 'item_title', 'item_barcode', 'patron_name', 'patron_barcode', 'patron_note', 'parsed_alma_pickup_library', 'parsed_alma_library_code' )
+
+    def __init__( self, *, item_id, item_title, item_barcode, patron_name, patron_barcode, patron_note, parsed_alma_pickup_library, parsed_alma_library_code ):
+        self.item_id = item_id
+        self.item_title = item_title
+        self.item_barcode = item_barcode
+        self.patron_name = patron_name
+        self.patron_barcode = patron_barcode
+        self.patron_note = patron_note
+        self.parsed_alma_pickup_library = sys.intern( parsed_alma_pickup_library )
+        self.parsed_alma_library_code = sys.intern( parsed_alma_library_code )
+
+    def __eq__( self, other ):
+        return type(other) == type(self) and all( getattr(self, name) == getattr(other, name) for name in self.__slots__ )
+
+    def __repr__( self ):
+        fields = ', '.join( f'{name}={getattr(self, name)!r}' for name in self.__slots__ )
+        return f'AlmaRequest({fields})'
+
+    ## end class AlmaRequest()
+
+
+class GfaEntry():
+    """ One line of a GFA data-file.
+        Created by Parser.prepare_gfa_entry() and Parser.prepare_gfa_entries() """
+
+    __slots__ = ( 'item_id', 'item_barcode', 'gfa_delivery', 'gfa_location', 'patron_name', 'patron_barcode', 'item_title', 'gfa_date_str', 'patron_note' )  # GFA line order
+
+    def __init__( self, *, item_id, item_barcode, gfa_delivery, gfa_location, patron_name, patron_barcode, item_title, gfa_date_str, patron_note ):
+        self.item_id = item_id
+        self.item_barcode = item_barcode
+        self.gfa_delivery = sys.intern( gfa_delivery )
+        self.gfa_location = sys.intern( gfa_location )
+        self.patron_name = patron_name
+        self.patron_barcode = patron_barcode
+        self.item_title = item_title
+        self.gfa_date_str = sys.intern( gfa_date_str )
+        self.patron_note = patron_note
+
+    def __eq__( self, other ):
+        return type(other) == type(self) and all( getattr(self, name) == getattr(other, name) for name in self.__slots__ )
+
+    def __repr__( self ):
+        fields = ', '.join( f'{name}={getattr(self, name)!r}' for name in self.__slots__ )
+        return f'GfaEntry({fields})'
+
+    ## end class GfaEntry()
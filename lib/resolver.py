@@ -0,0 +1,83 @@
+import difflib, logging, os, re, types
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+NON_ALPHANUMERIC_PATTERN = re.compile( r'[\W_]+' )  # punctuation, underscores & whitespace-runs
+
+
+def normalize_key( key ):
+    """ Returns a comparison-key ignoring case, whitespace & punctuation, like 'Hay at Rock Reading Room' -> 'hay at rock reading room'. """
+    return NON_ALPHANUMERIC_PATTERN.sub( ' ', key.casefold() ).strip()
+
+
+class UnknownMappingKeyError( KeyError ):
+    """ Raised when an alma value can't be resolved; the message lists any close matches. """
+
+    def __init__( self, mapping_name, raw_key, suggestions ):
+        self.mapping_name = mapping_name
+        self.raw_key = raw_key
+        self.suggestions = suggestions
+        message = f'unknown {mapping_name}, ``{raw_key}``'
+        if suggestions:
+            message = f'{message}; close matches, ``{suggestions}``'
+        super().__init__( message )
+
+    def __str__( self ):
+        return self.args[0]
+
+
+class MappingResolver():
+    """ Resolves alma values against a mapper-dict.
+        Keys are compiled into an index of normalized keys, and every resolved raw value is memoized,
+          so repeat lookups in a run are a single dict hit. """
+
+    def __init__( self, source_dct, mapping_name, suggest=True ):
+        self.mapping_name = mapping_name
+        self.suggest = suggest
+        index = {}              # normalized-key -> mapped-value
+        self.display_keys = {}  # normalized-key -> first source-key, for suggestions
+        self.memo = {}          # raw-key -> mapped-value
+        for ( key, value ) in source_dct.items():
+            normalized_key = normalize_key( key )
+            if normalized_key in index and index[normalized_key] != value:
+                raise ValueError( f'{mapping_name} keys ``{self.display_keys[normalized_key]}`` and ``{key}`` normalize alike but map to different values' )
+            index[normalized_key] = value
+            self.display_keys.setdefault( normalized_key, key )
+        self.index = types.MappingProxyType( index )
+        log.debug( f'{mapping_name} index built with ``{len(self.index)}`` normalized keys' )
+
+    def resolve( self, raw_key ):
+        """ Returns the mapped value, or raises UnknownMappingKeyError. """
+        try:
+            return self.memo[raw_key]
+        except KeyError:
+            pass
+        try:
+            value = self.index[ normalize_key(raw_key) ]
+        except KeyError:
+            suggestions = self.suggest_keys( raw_key ) if self.suggest else []
+            raise UnknownMappingKeyError( self.mapping_name, raw_key, suggestions ) from None
+        self.memo[raw_key] = value
+        return value
+
+    def suggest_keys( self, raw_key, limit=3 ):
+        """ Returns up to `limit` source-keys that look like raw_key, best match first. """
+        close_matches = difflib.get_close_matches( normalize_key(raw_key), self.index.keys(), n=limit, cutoff=0.6 )
+        return [ self.display_keys[match] for match in close_matches ]
+
+    ## end class MappingResolver()
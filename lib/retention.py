@@ -0,0 +1,217 @@
+"""
+Retention for the archive & GFA directories, which otherwise grow without bound.
+A policy per directory -- from the env-setting `ANX_ALMA__RETENTION_POLICIES_JSON` -- like...
+    { "archived_originals": {"max_age_days": 730}, "archived_parsed": {"max_age_days": 730, "max_total_bytes": 5000000000},
+      "gfa_count": {"max_age_days": 30, "max_count": 500}, "gfa_data": {"max_age_days": 30, "max_count": 500} }
+  ...prunes a run's files once it's older than `max_age_days`, beyond the newest `max_count` runs, or beyond `max_total_bytes` (newest kept first).
+  An unlisted directory, or rule, prunes nothing.
+Notes...
+- Runs are found, and aged, by the datetime-stamp in their file-names, so listing a directory never stats its files; only the size-rule stats,
+    and only the runs left by the other rules, newest first.
+- A run's files (eg `.dat` & `.jsonl`) are kept or pruned together.
+- Only run-output files are pruned (PRUNABLE_PREFIXES); quarantined & rejected files, which await a person, never are.
+- In the archive directories, a run not yet in the rollup (`ANX_ALMA__ROLLUP_DB_PATH`) or history (`ANX_ALMA__PATH_TO_HISTORY_DIRECTORY`)
+    stores, where configured, is kept: their backfill & compaction read these files.
+- Deletes go in batches of `batch_size`; `max_batches` bounds one invocation, and the next picks up where it stopped.
+Usage...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/retention.py --dry-run
+- $ python3 ./lib/retention.py [--max-batches 10]
+"""
+
+import argparse, datetime, json, logging, os, re, sys, time
+
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.lib.storage import LocalStorage
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+PRUNABLE_PREFIXES = ( 'REQ-ALMA-ORIG_', 'REQ-ALMA-PARSED_', 'REQ-PARSED_', 'REQ-ALMA-MEMPROFILE_', 'REQ-ALMA-CPROFILE_' )
+
+FILE_STAMP_PATTERN = re.compile( r'_(\d{4}-\d{2}-\d{2}T\d{2}-\d{2}-\d{2})(?:_\d{3})?(?:\.[a-z]+)+$' )  # `REQ-PARSED_{stamp}_001.dat` is one batch of a run; its manifest is `.manifest.json`
+
+POLICY_RULES = ( 'max_age_days', 'max_count', 'max_total_bytes' )
+
+DIRECTORY_ENV_KEYS = {
+    'archived_originals': 'ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY',
+    'archived_parsed': 'ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY',
+    'gfa_count': 'ANX_ALMA__PATH_TO_GFA_COUNT_DIR',
+    'gfa_data': 'ANX_ALMA__PATH_TO_GFA_DATA_DIR',
+    'manifests': 'ANX_ALMA__PATH_TO_MANIFEST_DIRECTORY' }
+
+ARCHIVE_DIRECTORIES = ( 'archived_originals', 'archived_parsed' )  # the ones the rollup & history stores read from
+
+
+def parse_file_stamp( file_name ):
+    """ Returns the datetime-stamp of a run-output file-name, like '2021-07-13T13-41-39', or '' for any other file. """
+    if not file_name.startswith( PRUNABLE_PREFIXES ):
+        return ''
+    match = FILE_STAMP_PATTERN.search( file_name )
+    return match.group( 1 ) if match else ''
+
+
+def find_unindexed_stamps( parsed_stamps, rollup_db_path='', history_dir_path='' ):
+    """ Returns the stamps, of those given, that a configured rollup or history store hasn't taken in yet. """
+    unindexed_stamps = set()
+    if rollup_db_path:
+        from parse_alma_annex_requests_code.lib.rollup import RollupStore
+        store = RollupStore( rollup_db_path )
+        unindexed_stamps.update( set(parsed_stamps) - store.get_rolled_up_stamps() )
+        store.close()
+    if history_dir_path:
+        from parse_alma_annex_requests_code.lib.history import read_all_compacted_stamps  # imported only when configured, as it needs pyarrow
+        unindexed_stamps.update( set(parsed_stamps) - read_all_compacted_stamps(history_dir_path) )
+    return unindexed_stamps
+
+
+class Pruner():
+    """ Plans, and carries out, the pruning of one directory at a time. """
+
+    def __init__( self, storage=None, batch_size=500, now=None ):
+        self.storage = LocalStorage() if storage == None else storage
+        self.batch_size = batch_size
+        self.now = now  # a datetime; None means the current time
+
+    def plan( self, dir_path, policy, keep_stamps=frozenset() ):
+        """ Returns ( plan, err ); plan is like...
+              { 'dir_path': ..., 'run_count': 40, 'prune_stamps': ['2021-07-13T13-41-39', ...], 'prune_paths': [...],
+                'kept_unindexed': 2, 'kept_bytes': None }
+            kept_bytes, the size of the runs left, is only known when the size-rule ran. """
+        ( plan, err ) = ( {}, None )
+        try:
+            assert type(dir_path) == str
+            assert all( rule_name in POLICY_RULES for rule_name in policy ), f'unknown retention rule in ``{policy}``'
+            ## -- group run-files by stamp ----------
+            names_by_stamp = {}
+            for name in self.storage.list( dir_path ):
+                stamp = parse_file_stamp( name )
+                if stamp:
+                    names_by_stamp.setdefault( stamp, [] ).append( name )
+            stamps = sorted( names_by_stamp, reverse=True )  # newest first; the stamps sort as times
+            ## -- apply the rules -------------------
+            prune = set()
+            if policy.get( 'max_age_days' ):
+                now = self.now or datetime.datetime.now()
+                cutoff_stamp = ( now - datetime.timedelta(days=policy['max_age_days']) ).isoformat()[0:19].replace( ':', '-' )  # like Archiver.make_datetime_stamp()
+                prune.update( stamp for stamp in stamps if stamp < cutoff_stamp )
+            if policy.get( 'max_count' ):
+                prune.update( stamps[policy['max_count']:] )
+            kept_bytes = None
+            if policy.get( 'max_total_bytes' ):
+                ( kept_bytes, over_budget ) = ( 0, False )
+                for stamp in stamps:
+                    if stamp in prune:
+                        continue
+                    if over_budget:
+                        prune.add( stamp )  # everything older goes too; no need to stat
+                        continue
+                    run_bytes = sum( self.get_size(f'{dir_path}/{name}') for name in names_by_stamp[stamp] )
+                    if kept_bytes + run_bytes > policy['max_total_bytes'] and kept_bytes > 0:  # the newest kept run stays, however big
+                        prune.add( stamp )
+                        over_budget = True
+                    else:
+                        kept_bytes += run_bytes
+            kept_unindexed = len( prune & set(keep_stamps) )
+            prune_stamps = sorted( prune - set(keep_stamps) )  # oldest first, so a bounded invocation prunes the oldest
+            plan = {
+                'dir_path': dir_path, 'run_count': len( stamps ), 'prune_stamps': prune_stamps,
+                'prune_paths': [ f'{dir_path}/{name}' for stamp in prune_stamps for name in sorted(names_by_stamp[stamp]) ],
+                'kept_unindexed': kept_unindexed, 'kept_bytes': kept_bytes }
+            log.debug( f'dir_path, ``{dir_path}``; runs, ``{len(stamps)}``; runs to prune, ``{len(prune_stamps)}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem planning pruning, ``{err}``' )
+        return ( plan, err )
+
+    def get_size( self, path ):
+        stat_result = self.storage.stat( path )
+        return stat_result.size if stat_result != None else 0  # gone since the listing
+
+    def prune( self, plan, max_batches=0, pause_seconds=0.0 ):
+        """ Deletes the plan's files, batch by batch; max_batches 0 means no limit. Returns ( deleted_count, err ). """
+        ( deleted_count, err ) = ( 0, None )
+        try:
+            paths = plan['prune_paths']
+            for ( batch_index, start ) in enumerate( range(0, len(paths), self.batch_size) ):
+                if max_batches and batch_index >= max_batches:
+                    log.info( f'stopping after ``{max_batches}`` batch(es); ``{len(paths) - deleted_count}`` file(s) left for the next run' )
+                    break
+                batch_paths = paths[start:start + self.batch_size]
+                self.storage.delete_many( batch_paths )
+                deleted_count += len( batch_paths )
+                if pause_seconds:
+                    time.sleep( pause_seconds )  # eases the load on a shared filesystem
+            log.info( f'pruned ``{deleted_count}`` file(s) from ``{plan["dir_path"]}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem pruning, ``{err}``' )
+        return ( deleted_count, err )
+
+    ## end class Pruner()
+
+
+def format_plan( plan, dry_run ):
+    """ Returns one report line for a directory's plan. """
+    verb = 'would prune' if dry_run else 'pruning'
+    line = f'{plan["dir_path"]}: {plan["run_count"]} run(s); {verb} {len(plan["prune_stamps"])} run(s), {len(plan["prune_paths"])} file(s)'
+    if plan['prune_stamps']:
+        line += f', {plan["prune_stamps"][0]} to {plan["prune_stamps"][-1]}'
+    if plan['kept_bytes'] != None:
+        line += f'; keeping {plan["kept_bytes"]} bytes'
+    if plan['kept_unindexed']:
+        line += f'; kept {plan["kept_unindexed"]} run(s) not yet in the rollup/history stores'
+    return line
+
+
+def run_retention( policies, dry_run=True, max_batches=0, rollup_db_path='', history_dir_path='', pruner=None ):
+    """ Plans -- and, unless dry_run, prunes -- each directory with a policy; returns ( report_lines, err ). """
+    ( report_lines, err ) = ( [], None )
+    pruner = Pruner() if pruner == None else pruner
+    for ( directory_key, policy ) in sorted( policies.items() ):
+        if directory_key not in DIRECTORY_ENV_KEYS:
+            return ( report_lines, f'unknown retention directory, ``{directory_key}``; expected one of ``{sorted(DIRECTORY_ENV_KEYS)}``' )
+        dir_path = os.environ[DIRECTORY_ENV_KEYS[directory_key]]
+        keep_stamps = set()
+        if directory_key in ARCHIVE_DIRECTORIES and ( rollup_db_path or history_dir_path ):
+            parsed_dir_path = os.environ[DIRECTORY_ENV_KEYS['archived_parsed']]
+            parsed_stamps = set( parse_file_stamp(name) for name in pruner.storage.list(parsed_dir_path) ) - { '' }
+            keep_stamps = find_unindexed_stamps( parsed_stamps, rollup_db_path, history_dir_path )
+        ( plan, err ) = pruner.plan( dir_path, policy, keep_stamps )
+        if err:
+            return ( report_lines, err )
+        report_lines.append( format_plan(plan, dry_run) )
+        if not dry_run:
+            ( deleted_count, err ) = pruner.prune( plan, max_batches )
+            if err:
+                return ( report_lines, err )
+    return ( report_lines, err )
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser( description='Prunes old run-files, per ANX_ALMA__RETENTION_POLICIES_JSON.' )
+    arg_parser.add_argument( '--dry-run', action='store_true', help='report what would be pruned, without deleting' )
+    arg_parser.add_argument( '--max-batches', type=int, default=0, help='stop each directory after this many delete-batches; 0 means no limit' )
+    args = arg_parser.parse_args()
+    ( report_lines, err ) = run_retention(
+        json.loads( os.environ.get('ANX_ALMA__RETENTION_POLICIES_JSON', '{}') ), dry_run=args.dry_run, max_batches=args.max_batches,
+        rollup_db_path=os.environ.get('ANX_ALMA__ROLLUP_DB_PATH', ''), history_dir_path=os.environ.get('ANX_ALMA__PATH_TO_HISTORY_DIRECTORY', '') )
+    print( '\n'.join(report_lines) )
+    if err:
+        print( err )
+    sys.exit( 1 if err else 0 )
@@ -0,0 +1,225 @@
+"""
+Daily rollup of the requests sent to GFA, kept in a small sqlite database so reports never re-read the archives.
+A row counts the requests of one day with the same GFA delivery-stop, GFA location, alma request-type and collection ('HAY' or 'non-HAY', by GFA location).
+The day is the processing-day, from the file's datetime-stamp.
+Each file is added once, under its datetime-stamp; adding an already-rolled-up stamp is a no-op, so a backfill can be re-run safely.
+Usage...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/rollup.py report [--period month] [--from 2021-08-01] [--to 2021-08-31] [--by gfa_delivery,gfa_location]
+- $ python3 ./lib/rollup.py backfill
+    (rolls up every `REQ-ALMA-PARSED_{stamp}.dat` in the archived-parsed directory; request-types come from the file's json-lines sidecar,
+    or else from its archived original, or else are counted as 'UNKNOWN')
+"""
+
+import argparse, collections, csv, io, json, logging, os, sqlite3, sys
+
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.lib.engines import make_parser
+from parse_alma_annex_requests_code.lib.storage import LocalStorage
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+ROLLUP_DIMENSIONS = ( 'gfa_delivery', 'gfa_location', 'request_type', 'collection' )
+
+HAY_GFA_LOCATION = 'QH'
+
+UNKNOWN_REQUEST_TYPE = 'UNKNOWN'
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS daily_counts (
+        day TEXT NOT NULL, gfa_delivery TEXT NOT NULL, gfa_location TEXT NOT NULL, request_type TEXT NOT NULL, collection TEXT NOT NULL,
+        request_count INTEGER NOT NULL,
+        PRIMARY KEY ( day, gfa_delivery, gfa_location, request_type, collection ) );
+    CREATE TABLE IF NOT EXISTS rolled_up_files (
+        datetime_stamp TEXT PRIMARY KEY, request_count INTEGER NOT NULL );
+    """
+
+
+def make_rollup_key( gfa_delivery, gfa_location, request_type ):
+    """ Returns the ( gfa_delivery, gfa_location, request_type, collection ) a request is counted under. """
+    collection = 'HAY' if gfa_location == HAY_GFA_LOCATION else 'non-HAY'
+    return ( gfa_delivery, gfa_location, request_type or UNKNOWN_REQUEST_TYPE, collection )
+
+
+class RollupStore():
+    """ The rollup database; the connection is opened, and the tables made, on first use. """
+
+    def __init__( self, db_path ):
+        self.db_path = db_path
+        self.connection = None
+
+    def connect( self ):
+        if self.connection == None:
+            self.connection = sqlite3.connect( self.db_path, timeout=30 )  # overlapping runs wait on each other's writes
+            self.connection.executescript( SCHEMA )
+        return self.connection
+
+    def close( self ):
+        if self.connection != None:
+            self.connection.close()
+            self.connection = None
+        return
+
+    def add_file_counts( self, datetime_stamp, counts ):
+        """ Adds one file's counts -- { (gfa_delivery, gfa_location, request_type, collection): request_count } -- to its day, in one transaction.
+            Returns ( added, err ); added is False if the stamp was already rolled up.
+            Called by controller.save_rollup() and backfill() """
+        ( added, err ) = ( False, None )
+        try:
+            assert type(datetime_stamp) == str
+            day = datetime_stamp[0:10]
+            connection = self.connect()
+            with connection:
+                cursor = connection.execute( 'INSERT OR IGNORE INTO rolled_up_files ( datetime_stamp, request_count ) VALUES ( ?, ? )', (datetime_stamp, sum(counts.values())) )
+                if cursor.rowcount == 1:
+                    connection.executemany( """
+                        INSERT INTO daily_counts ( day, gfa_delivery, gfa_location, request_type, collection, request_count ) VALUES ( ?, ?, ?, ?, ?, ? )
+                        ON CONFLICT ( day, gfa_delivery, gfa_location, request_type, collection ) DO UPDATE SET request_count = request_count + excluded.request_count
+                        """, [ (day, *key, request_count) for ( key, request_count ) in counts.items() ] )
+                    added = True
+            log.debug( f'datetime_stamp, ``{datetime_stamp}``; added, ``{added}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem adding rollup counts, ``{err}``' )
+        return ( added, err )
+
+    def get_rolled_up_stamps( self ):
+        """ Returns the set of datetime-stamps already rolled up.
+            Called by retention.find_unindexed_stamps() """
+        return set( row[0] for row in self.connect().execute('SELECT datetime_stamp FROM rolled_up_files') )
+
+    def report( self, period='day', start_day='', end_day='', dimensions=ROLLUP_DIMENSIONS ):
+        """ Returns ( rows, err ); rows are dicts of the period ('2021-08-02', or for months '2021-08'), the requested dimensions, and request_count.
+            start_day & end_day ('2021-08-02') are inclusive; empty means unbounded. """
+        ( rows, err ) = ( [], None )
+        try:
+            assert period in ( 'day', 'month' )
+            assert all( dimension in ROLLUP_DIMENSIONS for dimension in dimensions )  # also keeps the column-names below safe
+            period_column = 'day' if period == 'day' else 'substr( day, 1, 7 )'
+            group_columns = ', '.join( [period_column] + list(dimensions) )
+            sql = f"""
+                SELECT {group_columns}, SUM( request_count ) FROM daily_counts
+                WHERE ( ? = '' OR day >= ? ) AND ( ? = '' OR day <= ? )
+                GROUP BY {group_columns} ORDER BY {group_columns}
+                """
+            for row in self.connect().execute( sql, (start_day, start_day, end_day, end_day) ):
+                rows.append( dict(zip([period, *dimensions, 'request_count'], row)) )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem making rollup report, ``{err}``' )
+        return ( rows, err )
+
+    ## end class RollupStore()
+
+
+def format_report( rows, period='day', dimensions=ROLLUP_DIMENSIONS ):
+    """ Returns the report rows as an aligned text table, with a total line. """
+    headings = [ period, *dimensions, 'request_count' ]
+    lines = [ [str(row[heading]) for heading in headings] for row in rows ]
+    lines.append( ['total'] + [''] * len(dimensions) + [str(sum(row['request_count'] for row in rows))] )
+    widths = [ max(len(heading), *(len(line[index]) for line in lines)) for ( index, heading ) in enumerate(headings) ]
+    text_lines = [ '  '.join(heading.ljust(width) for ( heading, width ) in zip(headings, widths)).rstrip() ]
+    text_lines.extend( '  '.join(value.ljust(width) for ( value, width ) in zip(line, widths)).rstrip() for line in lines )
+    return '\n'.join( text_lines ) + '\n'
+
+
+## -- backfill ------------------------------
+
+
+def count_parsed_text( parsed_text, request_types ):
+    """ Returns the rollup counts for one parsed-data file.
+        request_types: one request-type per data-line, or { item_barcode: request_type }; a missing type counts as 'UNKNOWN'. """
+    counts = collections.Counter()
+    for ( line_index, fields ) in enumerate( csv.reader(io.StringIO(parsed_text)) ):
+        if len( fields ) < 4:
+            continue
+        ( item_barcode, gfa_delivery, gfa_location ) = ( fields[1], fields[2], fields[3] )
+        request_type = request_types.get( item_barcode, '' ) if type(request_types) == dict else ( request_types[line_index] if line_index < len(request_types) else '' )
+        counts[make_rollup_key( gfa_delivery, gfa_location, request_type )] += 1
+    return counts
+
+
+def read_request_types( storage, parsed_dir_path, originals_dir_path, datetime_stamp, prsr ):
+    """ Returns a file's request-types: a per-line list from its json-lines sidecar, else { item_barcode: request_type } from its archived original, else {}. """
+    sidecar_path = f'{parsed_dir_path}/REQ-ALMA-PARSED_{datetime_stamp}.jsonl'
+    if storage.stat( sidecar_path ) != None:
+        with storage.open_stream( sidecar_path ) as stream:
+            return [ json.loads(line)['request_type'] for line in stream.read().decode('utf-8').splitlines() if line.strip() ]
+    original_path = f'{originals_dir_path}/REQ-ALMA-ORIG_{datetime_stamp}.xml'
+    if originals_dir_path and storage.stat( original_path ) != None:
+        with storage.open_stream( original_path ) as stream:
+            ( items, err ) = prsr.make_item_list( stream.read().decode('utf-8') )
+        request_types = {}
+        for item in items:
+            ( item_barcode, err ) = prsr.parse_element( item, 'barcode' )
+            ( request_type, err ) = prsr.parse_element( item, 'requestType' )
+            request_types.setdefault( item_barcode, request_type )
+        return request_types
+    return {}
+
+
+def backfill( store, parsed_dir_path, originals_dir_path='', storage=None, parser_engine='bs4' ):
+    """ Rolls up every archived parsed-data file not yet in the store; returns ( summary, err ).
+        summary is like { 'added': 12, 'skipped': 3, 'request_count': 1234, 'unknown_request_types': 0 } """
+    ( summary, err ) = ( {'added': 0, 'skipped': 0, 'request_count': 0, 'unknown_request_types': 0}, None )
+    try:
+        storage = LocalStorage() if storage == None else storage
+        prsr = make_parser( parser_engine )
+        for name in sorted( storage.list(parsed_dir_path) ):
+            if not ( name.startswith('REQ-ALMA-PARSED_') and name.endswith('.dat') ):
+                continue
+            datetime_stamp = name[len('REQ-ALMA-PARSED_'):-len('.dat')]
+            with storage.open_stream( f'{parsed_dir_path}/{name}' ) as stream:
+                parsed_text = stream.read().decode( 'utf-8' )
+            request_types = read_request_types( storage, parsed_dir_path, originals_dir_path, datetime_stamp, prsr )
+            counts = count_parsed_text( parsed_text, request_types )
+            ( added, err ) = store.add_file_counts( datetime_stamp, counts )
+            if err:
+                raise Exception( f'Problem adding counts for ``{name}``, ``{err}``' )
+            if added:
+                summary['added'] += 1
+                summary['request_count'] += sum( counts.values() )
+                summary['unknown_request_types'] += sum( count for ( key, count ) in counts.items() if key[2] == UNKNOWN_REQUEST_TYPE )
+            else:
+                summary['skipped'] += 1
+        log.info( f'backfill summary, ``{summary}``' )
+    except Exception as e:
+        err = repr(e)
+        log.exception( f'Problem backfilling rollup, ``{err}``' )
+    return ( summary, err )
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser( description='Reports, or backfills, the daily rollup of requests sent to GFA.' )
+    arg_parser.add_argument( 'command', choices=['report', 'backfill'] )
+    arg_parser.add_argument( '--period', choices=['day', 'month'], default='day' )
+    arg_parser.add_argument( '--from', dest='start_day', default='', help='first day, like 2021-08-01' )
+    arg_parser.add_argument( '--to', dest='end_day', default='', help='last day, like 2021-08-31' )
+    arg_parser.add_argument( '--by', default=','.join(ROLLUP_DIMENSIONS), help=f'comma-separated, from: {", ".join(ROLLUP_DIMENSIONS)}' )
+    args = arg_parser.parse_args()
+    store = RollupStore( os.environ['ANX_ALMA__ROLLUP_DB_PATH'] )
+    if args.command == 'backfill':
+        ( summary, err ) = backfill( store, os.environ['ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY'], os.environ.get('ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY', ''), parser_engine=os.environ.get('ANX_ALMA__PARSER_ENGINE', 'bs4') )
+        print( err if err else summary )
+    else:
+        dimensions = [ dimension for dimension in args.by.split(',') if dimension ]
+        ( rows, err ) = store.report( args.period, args.start_day, args.end_day, dimensions )
+        print( err if err else format_report(rows, args.period, dimensions) )
+    store.close()
+    sys.exit( 1 if err else 0 )
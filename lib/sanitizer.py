@@ -0,0 +1,90 @@
+"""
+Cleans GFA field values so nothing in a title, name or note can break the quoted, line-per-request GFA data-file format.
+Each field is cleaned in one `str.translate()` pass, using a table precompiled for that field's policy:
+- 'strip': control-characters are removed
+- 'replace': control-characters (tab, CR, LF, etc) become a space
+- 'escape': control-characters become backslash-escapes (eg `\\t`, `\\x07`), and backslashes are doubled
+Under every policy an embedded double-quote becomes a single-quote ('strip', 'replace') or is doubled ('escape').
+Optionally, non-ascii values are also unicode-normalized (eg 'NFC'); off by default, since alma sends some titles decomposed and GFA takes them as-is.
+"""
+
+import collections, json, logging, os, unicodedata
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+FIELD_POLICIES = json.loads( os.environ.get('ANX_ALMA__SANITIZE_POLICIES_JSON', '{}') )  # eg '{"patron_note": "escape"}'; unlisted fields use 'replace'
+NORMALIZE_FORM = os.environ.get( 'ANX_ALMA__SANITIZE_NORMALIZE_FORM', '' )  # eg 'NFC'; empty disables normalization
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+GFA_FIELDS = ( 'item_id', 'item_barcode', 'gfa_delivery', 'gfa_location', 'patron_name', 'patron_barcode', 'item_title', 'gfa_date_str', 'patron_note' )  # GFA line order
+
+CONTROL_CODEPOINTS = list( range(0x00, 0x20) ) + list( range(0x7f, 0xa0) ) + [ 0x2028, 0x2029 ]  # C0, DEL, C1, unicode line/paragraph separators
+
+SHORT_ESCAPES = { '\t': '\\t', '\n': '\\n', '\r': '\\r' }
+
+
+def make_translation_table( policy ):
+    """ Returns the str.translate() table for a policy.
+        Called once per policy, at import. """
+    if policy == 'strip':
+        table = { codepoint: None for codepoint in CONTROL_CODEPOINTS }
+        table[ord('"')] = "'"
+    elif policy == 'replace':
+        table = { codepoint: ' ' for codepoint in CONTROL_CODEPOINTS }
+        table[ord('"')] = "'"
+    elif policy == 'escape':
+        table = { codepoint: SHORT_ESCAPES.get(chr(codepoint), f'\\x{codepoint:02x}' if codepoint < 0x100 else f'\\u{codepoint:04x}') for codepoint in CONTROL_CODEPOINTS }
+        table[ord('\\')] = '\\\\'
+        table[ord('"')] = '""'
+    else:
+        raise ValueError( f'unknown sanitize-policy, ``{policy}``' )
+    return table
+
+
+TRANSLATION_TABLES = { policy: make_translation_table(policy) for policy in ( 'strip', 'replace', 'escape' ) }
+
+
+class Sanitizer():
+    """ Applies each field's policy, and counts what was changed; one instance per run. """
+
+    def __init__( self, field_policies=None, normalize_form=None ):
+        field_policies = FIELD_POLICIES if field_policies == None else field_policies
+        for ( field_name, policy ) in field_policies.items():
+            if field_name not in GFA_FIELDS or policy not in TRANSLATION_TABLES:
+                raise ValueError( f'bad sanitize-policy, ``{field_name}``: ``{policy}``' )
+        self.field_tables = { field_name: TRANSLATION_TABLES[field_policies.get(field_name, 'replace')] for field_name in GFA_FIELDS }
+        self.normalize_form = NORMALIZE_FORM if normalize_form == None else normalize_form  # '' disables normalization
+        self.counts = collections.Counter()   # like { 'item_title.translated': 2, 'patron_note.normalized': 1 }
+
+    def sanitize( self, field_name, value ):
+        """ Returns the cleaned value; an unchanged value is returned as the same object. """
+        cleaned = value.translate( self.field_tables[field_name] )
+        if cleaned != value:
+            self.counts[f'{field_name}.translated'] += 1
+        else:
+            cleaned = value
+        if self.normalize_form and not cleaned.isascii() and not unicodedata.is_normalized( self.normalize_form, cleaned ):
+            cleaned = unicodedata.normalize( self.normalize_form, cleaned )
+            self.counts[f'{field_name}.normalized'] += 1
+        return cleaned
+
+    def sanitize_fields( self, fields ):
+        """ Cleans, in place, a dict of GFA field-values. """
+        for field_name in fields:
+            fields[field_name] = self.sanitize( field_name, fields[field_name] )
+        return fields
+
+    ## end class Sanitizer()
@@ -0,0 +1,240 @@
+"""
+Runs several source-profiles -- each an alma export-feed with its own source, archive & GFA directories, mapping-tables and limits -- in one process.
+The profiles come from a json file, at `ANX_ALMA__SOURCE_PROFILES_PATH`, like...
+    { "max_workers": 2, "poll_seconds": 30,
+      "profiles": [
+        { "name": "annex", "max_concurrent": 1,
+          "settings": { "ANX_ALMA__PATH_TO_SOURCE_DIRECTORY": "/path/annex/source", "ANX_ALMA__PATH_TO_GFA_DATA_DIR": "/path/annex/gfa_data", ... } },
+        { "name": "hay", "max_concurrent": 2,
+          "settings": { "ANX_ALMA__PATH_TO_SOURCE_DIRECTORY": "/path/hay/source", "ANX_ALMA__MAPPING_CONFIG_PATH": "/path/hay_mappings.json", ... } } ] }
+  ...where a profile's `settings` are layered over the env-settings, so settings common to every profile can stay in env/activate.
+Scheduling...
+- A turn is one file, processed by Controller.process_requests(). Up to `max_workers` turns run at once, each on its own thread.
+- Each free worker goes to the next source, round-robin, that's below its `max_concurrent` cap; so a big backlog in one feed
+    gets one turn in its rotation, and can't starve the others.
+- A source that finds no file, or whose turn fails, isn't checked again for `poll_seconds`; a source that processed a file is eligible again right away.
+- `max_concurrent` above 1 needs claim-mode (`ANX_ALMA__CLAIM_FILES`), so two turns never take the same file; it's on by default for such profiles.
+Shared & warm...
+- Every file still gets its own datetime-stamp, across all sources.
+- Modules are imported once, and each distinct mapping-config is compiled once, then shared by every profile & turn using it
+    (MappingConfig still reloads a changed file). Each turn gets its own Parser, a cheap object, since it holds per-run counts.
+- Module-level settings (`ANX_ALMA__SANITIZE_*`, `ANX_ALMA__SPOOL_RETRY_*`, logging) come from the env-settings, and are shared by every profile.
+Usage...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/scheduler.py  # drains every source, then exits; a cron-replacement for one cron-entry per feed
+- $ python3 ./lib/scheduler.py --resident  # keeps serving every source until interrupted
+"""
+
+import argparse, collections, json, logging, os, socket, sys, threading, time
+
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.controller import Controller, StampMaker
+from parse_alma_annex_requests_code.lib.mapping_config import DEFAULT_MAPPING_CONFIG, MappingConfig
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+class SourceProfile():
+    """ One source's settings & limits, and its scheduling-state; the state is only touched under the Scheduler's condition-lock. """
+
+    def __init__( self, name, settings, max_concurrent=1 ):
+        assert type(name) == str and name
+        assert type(max_concurrent) == int and max_concurrent >= 1
+        self.name = name
+        self.settings = settings  # the full settings, env-settings included
+        self.max_concurrent = max_concurrent
+        self.idle_controllers = []  # reused across turns; one per concurrent turn
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.next_check_at = 0.0
+        self.drained = False  # found no file (or failed) since its last processed file
+        self.counts = collections.Counter()  # turn-results: 'ok', 'no file', 'error'
+
+    ## end class SourceProfile()
+
+
+def load_profiles( config, base_settings=None ):
+    """ Returns ( profiles, max_workers, poll_seconds ) from a parsed profiles-config; raises ValueError on a bad config. """
+    base_settings = dict( os.environ if base_settings == None else base_settings )
+    ( profiles, problems, source_dirs ) = ( [], [], {} )
+    for ( index, profile_config ) in enumerate( config.get('profiles', []) ):
+        name = profile_config.get( 'name', '' )
+        if not name or name in [ profile.name for profile in profiles ]:
+            problems.append( f'profile {index + 1}: missing or repeated name, ``{name}``' )
+            continue
+        settings = dict( base_settings )
+        settings.update( profile_config.get('settings', {}) )
+        max_concurrent = int( profile_config.get('max_concurrent', 1) )
+        if max_concurrent > 1:
+            if json.loads( settings.setdefault('ANX_ALMA__CLAIM_FILES', 'true') ) == False:
+                problems.append( f'profile ``{name}``: max_concurrent ``{max_concurrent}`` needs ANX_ALMA__CLAIM_FILES' )
+        source_dir = settings.get( 'ANX_ALMA__PATH_TO_SOURCE_DIRECTORY', '' )
+        if not source_dir:
+            problems.append( f'profile ``{name}``: no ANX_ALMA__PATH_TO_SOURCE_DIRECTORY' )
+        elif source_dir in source_dirs:
+            problems.append( f'profiles ``{source_dirs[source_dir]}`` & ``{name}`` share source-directory ``{source_dir}``' )
+        source_dirs[source_dir] = name
+        profiles.append( SourceProfile(name, settings, max_concurrent) )
+    if not profiles and not problems:
+        problems.append( 'no profiles' )
+    if problems:
+        raise ValueError( f'invalid source-profiles: {"; ".join(problems)}' )
+    return ( profiles, int(config.get('max_workers', 1)), float(config.get('poll_seconds', 30)) )
+
+
+class Scheduler():
+    """ Shares `max_workers` worker-threads among the profiles, round-robin, within each profile's cap. """
+
+    def __init__( self, profiles, max_workers=1, poll_seconds=30.0 ):
+        assert max_workers >= 1
+        self.profiles = profiles
+        self.max_workers = max_workers
+        self.poll_seconds = poll_seconds
+        self.mapping_configs = { DEFAULT_MAPPING_CONFIG.config_path: DEFAULT_MAPPING_CONFIG }  # config-path -> MappingConfig, shared by every profile using it
+        self.stamp_maker = StampMaker()  # shared, since profiles may share archive-directories, and a profile's concurrent turns always share them
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.running = 0
+        self.next_index = 0  # where the round-robin resumes
+        self.turn_log = collections.deque( maxlen=1000 )  # [ (profile_name, result), ... ], most recent last
+        self.controller_count = 0  # numbers each controller's worker-id
+        for profile in self.profiles:
+            profile.idle_controllers.append( self.make_controller(profile) )  # a bad profile fails here, at startup, not on its first turn
+
+    def get_mapping_config( self, config_path ):
+        """ Returns the shared MappingConfig for the path.
+            Called by make_controller() """
+        with self.condition:
+            if config_path not in self.mapping_configs:
+                self.mapping_configs[config_path] = MappingConfig( config_path )
+            return self.mapping_configs[config_path]
+
+    def make_controller( self, profile ):
+        """ Returns a Controller for the profile, sharing the warm mapping-config.
+            Each controller gets a worker-id of its own, since a profile's concurrent turns share a process, and so its default worker-id.
+            Called by __init__() and run_turn() """
+        mapping_config = self.get_mapping_config( profile.settings.get('ANX_ALMA__MAPPING_CONFIG_PATH', '') )
+        mapping_config.get_tables()  # compiles (& validates) the tables now, rather than on the first file
+        with self.condition:
+            self.controller_count += 1
+            controller_number = self.controller_count
+        base_worker_id = profile.settings.get( 'ANX_ALMA__WORKER_ID', f'{socket.gethostname()}-{os.getpid()}' )
+        settings = dict( profile.settings, ANX_ALMA__WORKER_ID=f'{base_worker_id}-{controller_number}' )
+        return Controller( settings=settings, mapping_config=mapping_config, stamp_maker=self.stamp_maker )
+
+    def run( self, until_drained=False ):
+        """ Dispatches turns until stop() -- or, with `until_drained`, until every source has found no file; returns ( summary, err ).
+            summary is like { 'annex': {'ok': 3, 'no file': 1, 'error': 0, 'peak_in_flight': 1}, ... }
+            Running turns always finish before run() returns. """
+        ( summary, err ) = ( {}, None )
+        threads = []
+        try:
+            with self.condition:
+                while not self.stop_event.is_set():
+                    profile = self.pick_next_profile( time.time(), until_drained ) if self.running < self.max_workers else None
+                    if profile != None:
+                        ( profile.in_flight, self.running ) = ( profile.in_flight + 1, self.running + 1 )
+                        profile.peak_in_flight = max( profile.peak_in_flight, profile.in_flight )
+                        thread = threading.Thread( target=self.run_turn, args=(profile,), name=f'scheduler-{profile.name}', daemon=True )
+                        thread.start()
+                        threads = [ thread for thread in threads if thread.is_alive() ] + [ thread ]
+                        continue
+                    if until_drained and self.running == 0 and all( profile.drained for profile in self.profiles ):
+                        break
+                    self.condition.wait( self.get_wait_seconds(time.time()) )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem scheduling turns, ``{err}``' )
+        finally:
+            for thread in threads:
+                thread.join()
+        summary = { profile.name: {'ok': profile.counts['ok'], 'no file': profile.counts['no file'], 'error': profile.counts['error'], 'peak_in_flight': profile.peak_in_flight}
+            for profile in self.profiles }
+        log.info( f'scheduler summary, ``{summary}``' )
+        return ( summary, err )
+
+    def stop( self ):
+        """ Stops dispatching; running turns finish. """
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        return
+
+    def pick_next_profile( self, now, until_drained ):
+        """ Returns the next profile, round-robin, that's below its cap & due for a check; or None.
+            Called by run(), holding the condition-lock """
+        for offset in range( len(self.profiles) ):
+            index = ( self.next_index + offset ) % len( self.profiles )
+            profile = self.profiles[index]
+            if profile.in_flight >= profile.max_concurrent or profile.next_check_at > now:
+                continue
+            if until_drained and profile.drained:
+                continue
+            self.next_index = index + 1
+            return profile
+        return None
+
+    def get_wait_seconds( self, now ):
+        """ Returns how long the dispatcher can sleep before a source is next due; None means until a turn finishes.
+            Called by run(), holding the condition-lock """
+        due_times = [ profile.next_check_at for profile in self.profiles if profile.in_flight < profile.max_concurrent and profile.next_check_at > now ]
+        return max( 0.0, min(due_times) - now ) if due_times else None
+
+    def run_turn( self, profile ):
+        """ Processes one file for the profile, on a worker-thread.
+            Called by run() """
+        with self.condition:
+            controller = profile.idle_controllers.pop() if profile.idle_controllers else None
+        result = 'error'
+        try:
+            controller = controller or self.make_controller( profile )
+            controller.process_requests()
+            result = 'ok'
+        except SystemExit:
+            result = 'no file'
+        except Exception:
+            log.exception( f'turn failed for profile ``{profile.name}``; retrying after the poll-interval' )
+        with self.condition:
+            if controller != None:
+                profile.idle_controllers.append( controller )
+            ( profile.in_flight, self.running ) = ( profile.in_flight - 1, self.running - 1 )
+            profile.counts[result] += 1
+            profile.drained = ( result != 'ok' )
+            profile.next_check_at = 0.0 if result == 'ok' else time.time() + self.poll_seconds  # an 'ok' also clears a wait set by a concurrent turn
+            self.turn_log.append( (profile.name, result) )
+            self.condition.notify_all()
+        return
+
+    ## end class Scheduler()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser( description='serves several source-profiles from one process' )
+    arg_parser.add_argument( '--resident', action='store_true', help='keep serving every source until interrupted, rather than exiting once all are drained' )
+    args = arg_parser.parse_args()
+    with open( os.environ['ANX_ALMA__SOURCE_PROFILES_PATH'], encoding='utf-8' ) as f:
+        ( profiles, max_workers, poll_seconds ) = load_profiles( json.load(f) )
+    scheduler = Scheduler( profiles, max_workers, poll_seconds )
+    try:
+        ( summary, err ) = scheduler.run( until_drained=not args.resident )
+    except KeyboardInterrupt:
+        scheduler.stop()
+        sys.exit( 0 )
+    for ( profile_name, counts ) in summary.items():
+        print( f'{profile_name}: {counts}' )
+    sys.exit( 1 if err else 0 )
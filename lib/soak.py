@@ -0,0 +1,253 @@
+"""
+End-to-end soak harness: drops synthetic `BUL_ANNEX-*.xml` files into a temporary source-directory at a random (poisson) rate,
+  with log-normally distributed record-counts, while the processor runs -- cron-style or resident -- against temporary directories.
+Measures...
+- latency, from each drop to the mtime of its first `REQ-PARSED_*.cnt` (a drop is matched to its run through a marker-comment, kept in the archived original)
+- backlog depth (waiting `BUL_ANNEX*.xml` files) and current RSS, sampled over time
+Cron-style mode calls process_requests() once per `cron_interval_seconds`, as cron would; it reuses one Controller, so its stamps stay unique.
+Files are processed with quarantine-mode on, since the synthetic records include deliberately unmapped codes; a drop whose records are
+  all quarantined sends no count-file, and is reported as unmatched.
+Usage...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/soak.py --duration 600 --rate 4 --median-records 50 --mode resident [--json-out soak.json]
+"""
+
+import argparse, json, logging, math, os, random, re, shutil, sys, tempfile, threading, time
+
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.controller import Controller
+from parse_alma_annex_requests_code.lib.engine_harness import make_synthetic_text
+from parse_alma_annex_requests_code.lib.profiling import get_current_rss_bytes
+from parse_alma_annex_requests_code.lib.retention import parse_file_stamp
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+DROP_MARKER_PATTERN = re.compile( rb'<!-- soak-drop (\d+) -->' )
+
+SOAK_DIRECTORY_ENV_KEYS = {
+    'source': 'ANX_ALMA__PATH_TO_SOURCE_DIRECTORY',
+    'archived_originals': 'ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY',
+    'archived_parsed': 'ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY',
+    'gfa_count': 'ANX_ALMA__PATH_TO_GFA_COUNT_DIR',
+    'gfa_data': 'ANX_ALMA__PATH_TO_GFA_DATA_DIR',
+    'quarantine': 'ANX_ALMA__PATH_TO_QUARANTINE_DIRECTORY',
+    'profiles': 'ANX_ALMA__PATH_TO_PROFILE_DIRECTORY' }
+
+SOAK_OPTIONAL_ENV_KEYS = {  # stores the operator may have turned on; kept on for the soak, but moved into its work-directory
+    'manifests': 'ANX_ALMA__PATH_TO_MANIFEST_DIRECTORY',
+    'spool': 'ANX_ALMA__PATH_TO_SPOOL_DIRECTORY',
+    'rollup.sqlite': 'ANX_ALMA__ROLLUP_DB_PATH' }
+
+
+def percentile( sorted_values, fraction ):
+    """ Returns the nearest-rank percentile of already-sorted values, or None if there are none. """
+    if not sorted_values:
+        return None
+    return sorted_values[ max(0, math.ceil(fraction * len(sorted_values)) - 1) ]
+
+
+class SoakHarness():
+    """ One soak run, in its own temporary directory-tree. """
+
+    def __init__( self, work_dir, mode='resident', rate_per_minute=6.0, median_records=50, size_sigma=1.0, max_records=5000,
+            cron_interval_seconds=60.0, poll_seconds=1.0, sample_seconds=1.0, max_drops=0, seed=0 ):
+        assert mode in ( 'resident', 'cron' )
+        self.work_dir = work_dir
+        self.mode = mode
+        self.rate_per_minute = rate_per_minute
+        ( self.median_records, self.size_sigma, self.max_records ) = ( median_records, size_sigma, max_records )
+        self.cron_interval_seconds = cron_interval_seconds
+        self.poll_seconds = poll_seconds  # resident-mode's wait after finding no file
+        self.sample_seconds = sample_seconds
+        self.max_drops = max_drops  # 0 means no limit
+        self.rng = random.Random( seed )
+        self.dirs = { dir_name: f'{work_dir}/{dir_name}' for dir_name in SOAK_DIRECTORY_ENV_KEYS }
+        self.drops = {}  # drop_number -> { 'dropped_at': ..., 'record_count': ..., 'counted_at': None }
+        self.seen_count_stamps = set()
+        self.samples = []  # [ (seconds since start, backlog, rss_bytes), ... ]
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def make_environ( self ):
+        """ Returns the env-settings pointing the controller at the soak directories; they're layered over the operator's env-settings.
+            Every store the controller could write to is overridden -- moved into the work-directory, or left off -- storage is forced local,
+              and the status-server is off, so nothing outside the work-directory is touched. """
+        environ = { env_key: self.dirs[dir_name] for ( dir_name, env_key ) in SOAK_DIRECTORY_ENV_KEYS.items() }
+        for ( work_name, env_key ) in SOAK_OPTIONAL_ENV_KEYS.items():
+            environ[env_key] = f'{self.work_dir}/{work_name}' if os.environ.get( env_key, '' ) else ''
+        environ.update( {
+            'ANX_ALMA__DEV_MODE': 'false', 'ANX_ALMA__QUARANTINE_MODE': 'true', 'ANX_ALMA__NEW_FILE_QUIET_SECONDS': '0',
+            'ANX_ALMA__RESIDENT_POLL_SECONDS': str(self.poll_seconds), 'ANX_ALMA__STORAGE_BACKEND': 'local',
+            'ANX_ALMA__STATUS_PORT': '0', 'ANX_ALMA__STATUS_SOCKET_PATH': '' } )
+        return environ
+
+    def run( self, duration_seconds, drain_timeout_seconds=300.0 ):
+        """ Drops files for `duration_seconds`, then waits up to `drain_timeout_seconds` for them to be processed; returns ( report, err ).
+            The controller gets the run's settings directly; the env-settings aren't changed. """
+        ( report, err ) = ( {}, None )
+        controller = None
+        try:
+            environ = self.make_environ()
+            for dir_path in list( self.dirs.values() ) + [ environ['ANX_ALMA__PATH_TO_MANIFEST_DIRECTORY'], environ['ANX_ALMA__PATH_TO_SPOOL_DIRECTORY'] ]:
+                if dir_path:
+                    os.makedirs( dir_path, exist_ok=True )
+            controller = Controller( settings=dict(os.environ, **environ) )
+            self.start_time = time.time()
+            threads = [
+                threading.Thread( target=self.run_processor, args=(controller,), name='soak-processor', daemon=True ),
+                threading.Thread( target=self.run_sampler, name='soak-sampler', daemon=True ) ]
+            for thread in threads:
+                thread.start()
+            ## -- drop files ------------------------
+            end_time = self.start_time + duration_seconds
+            next_drop_time = self.start_time + self.rng.expovariate( self.rate_per_minute / 60 )
+            while next_drop_time < end_time and ( self.max_drops == 0 or len(self.drops) < self.max_drops ):
+                time.sleep( max(0.0, next_drop_time - time.time()) )
+                self.drop_file()
+                next_drop_time += self.rng.expovariate( self.rate_per_minute / 60 )
+            ## -- drain -----------------------------
+            drain_end_time = time.time() + drain_timeout_seconds
+            while time.time() < drain_end_time and self.count_pending_drops() > 0:
+                time.sleep( min(self.sample_seconds, 0.1) )
+            ## -- stop ------------------------------
+            self.stop_event.set()
+            controller.stop_event.set()  # resident-mode stops after its current run
+            for thread in threads:
+                thread.join()
+            self.match_count_files()
+            report = self.make_report()
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem running soak, ``{err}``' )
+        finally:
+            self.stop_event.set()
+            if controller != None:
+                controller.stop_event.set()
+        return ( report, err )
+
+    def drop_file( self ):
+        """ Writes one synthetic file, under a temporary name, then renames it into place, so the processor never sees a partial file. """
+        drop_number = len( self.drops ) + 1
+        record_count = max( 1, min(self.max_records, round(self.median_records * math.exp(self.rng.gauss(0, self.size_sigma)))) )
+        text = make_synthetic_text( record_count, seed=drop_number )
+        ( declaration, rest ) = text.split( '\n', 1 )
+        text = f'{declaration}\n<!-- soak-drop {drop_number} -->\n{rest}'
+        temp_path = f'{self.dirs["source"]}/.soak-{drop_number}.tmp'
+        with open( temp_path, 'w', encoding='utf-8' ) as file_handler:
+            file_handler.write( text )
+        with self.lock:
+            os.rename( temp_path, f'{self.dirs["source"]}/BUL_ANNEX-soak-{drop_number:06}.xml' )
+            self.drops[drop_number] = { 'dropped_at': time.time(), 'record_count': record_count, 'counted_at': None }
+        log.debug( f'dropped ``{drop_number}``; records, ``{record_count}``' )
+        return
+
+    def run_processor( self, controller ):
+        """ Runs the controller, in the harness's mode, until stopped. """
+        if self.mode == 'resident':
+            controller.run_resident()
+            return
+        while not self.stop_event.is_set():
+            try:
+                controller.process_requests()
+            except SystemExit:
+                pass  # no file ready
+            except Exception:
+                log.exception( 'soak cron-run failed' )
+            self.stop_event.wait( self.cron_interval_seconds )
+        return
+
+    def run_sampler( self ):
+        while not self.stop_event.is_set():
+            backlog = len( [name for name in os.listdir(self.dirs['source']) if name.startswith('BUL_ANNEX')] )
+            self.samples.append( (round(time.time() - self.start_time, 3), backlog, get_current_rss_bytes()) )
+            self.match_count_files()
+            self.stop_event.wait( self.sample_seconds )
+        return
+
+    def match_count_files( self ):
+        """ Matches each new run's count-file to its drop, through the marker in the run's archived original. """
+        for name in sorted( os.listdir(self.dirs['gfa_count']) ):
+            stamp = parse_file_stamp( name )
+            if not stamp or stamp in self.seen_count_stamps:
+                continue
+            counted_at = os.stat( f'{self.dirs["gfa_count"]}/{name}' ).st_mtime
+            with open( f'{self.dirs["archived_originals"]}/REQ-ALMA-ORIG_{stamp}.xml', 'rb' ) as file_handler:
+                match = DROP_MARKER_PATTERN.search( file_handler.read(500) )
+            with self.lock:
+                self.seen_count_stamps.add( stamp )
+                if match and int( match.group(1) ) in self.drops:
+                    self.drops[int( match.group(1) )]['counted_at'] = counted_at
+        return
+
+    def count_pending_drops( self ):
+        self.match_count_files()
+        with self.lock:
+            return len( [drop for drop in self.drops.values() if drop['counted_at'] == None] )
+
+    def make_report( self ):
+        latencies = sorted( drop['counted_at'] - drop['dropped_at'] for drop in self.drops.values() if drop['counted_at'] != None )
+        processed_records = sum( drop['record_count'] for drop in self.drops.values() if drop['counted_at'] != None )
+        elapsed_seconds = max( [drop['counted_at'] for drop in self.drops.values() if drop['counted_at'] != None], default=self.start_time ) - self.start_time
+        rss_values = [ sample[2] for sample in self.samples if sample[2] != None ]
+        return {
+            'mode': self.mode, 'dropped': len( self.drops ), 'processed': len( latencies ), 'unmatched': len( self.drops ) - len( latencies ),
+            'records_dropped': sum( drop['record_count'] for drop in self.drops.values() ),
+            'latency_seconds': { name: ( round(percentile(latencies, fraction), 3) if latencies else None ) for ( name, fraction ) in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)] },
+            'records_per_second': round( processed_records / elapsed_seconds, 1 ) if elapsed_seconds > 0 else None,
+            'max_backlog': max( [sample[1] for sample in self.samples], default=0 ),
+            'peak_rss_bytes': max( rss_values, default=None ),
+            'samples': self.samples }
+
+    ## end class SoakHarness()
+
+
+def format_report( report ):
+    """ Returns the report, less its samples, as text. """
+    latency = report['latency_seconds']
+    lines = [
+        f'mode, {report["mode"]}; dropped, {report["dropped"]} files ({report["records_dropped"]} records); processed, {report["processed"]}; unmatched, {report["unmatched"]}',
+        f'latency (drop to count-file), seconds: p50 {latency["p50"]}; p90 {latency["p90"]}; p99 {latency["p99"]}; max {latency["max"]}',
+        f'records/second, {report["records_per_second"]}; max backlog, {report["max_backlog"]} files; peak rss, {report["peak_rss_bytes"]} bytes' ]
+    return '\n'.join( lines )
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser( description='Soak-tests the processor with synthetic file-drops, in temporary directories.' )
+    arg_parser.add_argument( '--duration', type=float, default=300, help='seconds of dropping files' )
+    arg_parser.add_argument( '--rate', type=float, default=6, help='mean drops per minute' )
+    arg_parser.add_argument( '--median-records', type=int, default=50 )
+    arg_parser.add_argument( '--size-sigma', type=float, default=1.0, help='log-normal spread of the record-counts' )
+    arg_parser.add_argument( '--mode', choices=['resident', 'cron'], default='resident' )
+    arg_parser.add_argument( '--cron-interval', type=float, default=60, help='cron-mode seconds between runs' )
+    arg_parser.add_argument( '--drain-timeout', type=float, default=300 )
+    arg_parser.add_argument( '--json-out', default='', help='also write the full report, with its samples, to this path' )
+    arg_parser.add_argument( '--keep', action='store_true', help='keep the temporary directories' )
+    args = arg_parser.parse_args()
+    work_dir = tempfile.mkdtemp( prefix='anx-soak-' )
+    harness = SoakHarness( work_dir, mode=args.mode, rate_per_minute=args.rate, median_records=args.median_records, size_sigma=args.size_sigma, cron_interval_seconds=args.cron_interval )
+    ( report, err ) = harness.run( args.duration, args.drain_timeout )
+    if args.json_out and report:
+        with open( args.json_out, 'w' ) as file_handler:
+            json.dump( report, file_handler, indent=2 )
+    print( err if err else format_report(report) )
+    if args.keep:
+        print( f'directories kept in ``{work_dir}``' )
+    else:
+        shutil.rmtree( work_dir )
+    sys.exit( 1 if err or report['unmatched'] else 0 )
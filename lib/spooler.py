@@ -0,0 +1,153 @@
+"""
+Local spool for GFA deliveries.
+Each delivery -- one count-file & data-file pair -- is written durably to `{spool-dir}/{delivery-name}/` before anything is sent,
+  then copied to the GFA directories -- through the run's storage-backend -- by deliver_pending(). A delivery that fails is retried on later passes, with exponential backoff,
+  so a GFA-directory outage only delays delivery; the parse-work is never redone.
+To run a delivery pass by hand...
+- $ cd to parse_alma_annex_requests_code
+- $ source ../env/bin/activate
+- $ python3 ./lib/spooler.py
+"""
+
+import fcntl, json, logging, os, shutil, sys, time
+
+sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.lib.storage import LocalStorage, make_storage
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+RETRY_BASE_SECONDS = int( os.environ.get('ANX_ALMA__SPOOL_RETRY_BASE_SECONDS', '30') )
+RETRY_MAX_SECONDS = int( os.environ.get('ANX_ALMA__SPOOL_RETRY_MAX_SECONDS', '3600') )
+
+LOCK_FILE_NAME = '.deliver.lock'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+class Spooler():
+
+    def __init__( self, spool_dir_path, retry_base_seconds=RETRY_BASE_SECONDS, retry_max_seconds=RETRY_MAX_SECONDS, storage=None ):
+        self.spool_dir_path = spool_dir_path  # always a local directory
+        self.storage = storage or LocalStorage()  # where the gfa directories are; see lib/storage.py
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+
+    def spool_delivery( self, delivery_name, payloads ):
+        """ Durably stores one delivery; returns err.
+            payloads: [ (file_name, text, destination_dir_path), ... ], delivered in that order; text may be a str, or bytes already encoded as utf-8.
+            The delivery is built in a `.tmp` directory and renamed into place, so a crash never leaves a half-spooled delivery. """
+        err = None
+        try:
+            assert type(delivery_name) == str
+            assert type(payloads) == list
+            temp_dir_path = f'{self.spool_dir_path}/{delivery_name}.tmp'
+            os.makedirs( temp_dir_path, exist_ok=True )
+            files = []
+            for ( file_name, text, destination_dir_path ) in payloads:
+                self.write_durably( f'{temp_dir_path}/{file_name}', text if type(text) == bytes else text.encode('utf-8') )
+                files.append( {'file_name': file_name, 'destination_dir_path': destination_dir_path} )
+            state = { 'files': files, 'attempts': 0, 'next_attempt_at': 0, 'spooled_at': time.time(), 'last_err': None }
+            self.write_durably( f'{temp_dir_path}/state.json', json.dumps(state).encode('utf-8') )
+            os.replace( temp_dir_path, f'{self.spool_dir_path}/{delivery_name}' )
+            self.fsync_dir( self.spool_dir_path )
+            log.info( f'spooled delivery, ``{delivery_name}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem spooling delivery, ``{err}``' )
+        return err
+
+    def deliver_pending( self, now=None ):
+        """ Tries each spooled delivery that's due, oldest first; returns ( delivered_names, err ).
+            A failed delivery is rescheduled, and doesn't count as an err; err is only for a problem with the spool itself.
+            Passes hold an exclusive lock on the spool, so overlapping runs never deliver -- or remove -- the same delivery at once. """
+        ( delivered_names, err ) = ( [], None )
+        try:
+            now = time.time() if now == None else now
+            with open( f'{self.spool_dir_path}/{LOCK_FILE_NAME}', 'a' ) as lock_handler:
+                fcntl.flock( lock_handler, fcntl.LOCK_EX )  # waits for any other pass -- another process's, or another thread's -- to finish; released on close
+                for delivery_name in self.list_deliveries():
+                    delivery_dir_path = f'{self.spool_dir_path}/{delivery_name}'
+                    state_path = f'{delivery_dir_path}/state.json'
+                    with open( state_path, encoding='utf-8' ) as f:
+                        state = json.load( f )
+                    if state['next_attempt_at'] > now:
+                        continue
+                    try:
+                        for file_info in state['files']:
+                            destination_filepath = f'{file_info["destination_dir_path"]}/{file_info["file_name"]}'
+                            spooled_filepath = f'{delivery_dir_path}/{file_info["file_name"]}'
+                            if isinstance( self.storage, LocalStorage ):
+                                shutil.copyfile( spooled_filepath, destination_filepath )
+                                try:
+                                    os.chmod( destination_filepath, 0o666 )   # `rw-/rw-/rw-`
+                                except Exception:
+                                    log.exception( 'could not set file-permissions on destination-path' )
+                                    ## not a delivery failure
+                            else:
+                                self.storage.put_file( spooled_filepath, destination_filepath )  # eg into the bucket, like the unspooled gfa files
+                            log.info( f'delivered ``{destination_filepath}``' )
+                    except Exception as e:
+                        state['attempts'] += 1
+                        state['last_err'] = repr( e )
+                        state['next_attempt_at'] = now + self.backoff_seconds( state['attempts'] )
+                        self.write_durably( state_path, json.dumps(state).encode('utf-8') )
+                        log.warning( f'delivery ``{delivery_name}`` failed, attempt ``{state["attempts"]}``; retrying after ``{state["next_attempt_at"]}``; err, ``{state["last_err"]}``' )
+                        continue
+                    shutil.rmtree( delivery_dir_path )
+                    delivered_names.append( delivery_name )
+            log.info( f'spool-depth, ``{self.depth()}``; delivered, ``{delivered_names}``' )
+        except Exception as e:
+            err = repr(e)
+            log.exception( f'Problem delivering spooled files, ``{err}``' )
+        return ( delivered_names, err )
+
+    def backoff_seconds( self, attempts ):
+        """ Returns the wait before the next attempt: base, 2x base, 4x base... capped at retry_max_seconds. """
+        return min( self.retry_base_seconds * (2 ** (attempts - 1)), self.retry_max_seconds )
+
+    def list_deliveries( self ):
+        """ Returns spooled delivery-names, oldest first (names start with the run's datetime-stamp). """
+        with os.scandir( self.spool_dir_path ) as entries:
+            return sorted( entry.name for entry in entries if entry.is_dir() and not entry.name.endswith('.tmp') )
+
+    def depth( self ):
+        """ Returns the number of deliveries waiting in the spool. """
+        return len( self.list_deliveries() )
+
+    def write_durably( self, filepath, data ):
+        """ Writes & fsyncs a file, via a temp-file and rename, so it's either complete or absent. """
+        temp_filepath = f'{filepath}.part'
+        with open( temp_filepath, 'wb' ) as file_handler:
+            file_handler.write( data )
+            file_handler.flush()
+            os.fsync( file_handler.fileno() )
+        os.replace( temp_filepath, filepath )
+        return
+
+    def fsync_dir( self, dir_path ):
+        """ Persists renames within a directory. """
+        dir_fd = os.open( dir_path, os.O_RDONLY )
+        try:
+            os.fsync( dir_fd )
+        finally:
+            os.close( dir_fd )
+        return
+
+    ## end class Spooler()
+
+
+if __name__ == '__main__':
+    spooler = Spooler( os.environ['ANX_ALMA__PATH_TO_SPOOL_DIRECTORY'], storage=make_storage(os.environ) )
+    ( delivered_names, err ) = spooler.deliver_pending()
+    print( f'delivered, ``{delivered_names}``; spool-depth, ``{spooler.depth()}``; err, ``{err}``' )
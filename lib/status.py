@@ -0,0 +1,150 @@
+"""
+Run-status, and an optional embedded HTTP server that reports it as json, for resident (`--resident`) operation.
+The server binds to localhost, or to a unix-socket; it only reads the in-memory RunStatus, so a request never touches the filesystem.
+- GET /healthz -- liveness; answers `{"alive": true}` without even taking the status-lock
+- GET /status -- last run's stamp & result, current stage of an in-flight run, files pending in the source-directory (as of the last check),
+    records-per-second over recent runs, and the mapping-tables version
+"""
+
+import collections, http.server, json, logging, os, socketserver, threading, time
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+class RunStatus():
+    """ What the controller is doing; updated by the controller, read by the StatusServer's threads. """
+
+    def __init__( self, recent_run_count=20 ):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.last_run_stamp = ''
+        self.last_run_result = ''  # 'ok', 'no file', or 'error: ...'
+        self.last_run_finished_at = None
+        self.current_file = ''
+        self.current_stage = ''
+        self.pending_file_count = None
+        self.spool_depth = None  # gfa deliveries waiting in the spool; None when there's no spool
+        self.mapping_version = ''
+        self.recent_runs = collections.deque( maxlen=recent_run_count )  # [ (record_count, seconds), ... ]
+
+    def start_run( self, file_path, mapping_version ):
+        with self.lock:
+            ( self.current_file, self.current_stage, self.mapping_version ) = ( file_path, 'start', mapping_version )
+        return
+
+    def set_stage( self, stage_name ):
+        self.current_stage = stage_name  # a single assignment; no lock needed
+        return
+
+    def set_pending_file_count( self, pending_file_count ):
+        self.pending_file_count = pending_file_count
+        return
+
+    def set_spool_depth( self, spool_depth ):
+        self.spool_depth = spool_depth
+        return
+
+    def finish_run( self, run_stamp, result, record_count=0, seconds=0.0 ):
+        with self.lock:
+            ( self.last_run_stamp, self.last_run_result, self.last_run_finished_at ) = ( run_stamp, result, time.time() )
+            ( self.current_file, self.current_stage ) = ( '', '' )
+            if result == 'ok':
+                self.recent_runs.append( (record_count, seconds) )
+        return
+
+    def snapshot( self ):
+        """ Returns the status as a json-ready dict. """
+        with self.lock:
+            ( total_records, total_seconds ) = ( sum(run[0] for run in self.recent_runs), sum(run[1] for run in self.recent_runs) )
+            return {
+                'uptime_seconds': round( time.time() - self.started_at, 1 ),
+                'last_run_stamp': self.last_run_stamp,
+                'last_run_result': self.last_run_result,
+                'last_run_finished_at': self.last_run_finished_at,
+                'in_flight': { 'file': self.current_file, 'stage': self.current_stage } if self.current_file else None,
+                'pending_file_count': self.pending_file_count,
+                'spool_depth': self.spool_depth,
+                'recent_run_count': len( self.recent_runs ),
+                'records_per_second': round( total_records / total_seconds, 1 ) if total_seconds > 0 else None,
+                'mapping_version': self.mapping_version }
+
+    ## end class RunStatus()
+
+
+class StatusRequestHandler( http.server.BaseHTTPRequestHandler ):
+
+    def do_GET( self ):
+        if self.path == '/healthz':
+            self.send_json( 200, {'alive': True} )
+        elif self.path == '/status':
+            self.send_json( 200, self.server.run_status.snapshot() )
+        else:
+            self.send_json( 404, {'error': f'unknown path, `{self.path}`; try `/status` or `/healthz`'} )
+
+    def send_json( self, status_code, data ):
+        body = json.dumps( data ).encode( 'utf-8' )
+        self.send_response( status_code )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Content-Length', str(len(body)) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def address_string( self ):
+        return str( self.client_address or 'unix-socket' )  # a unix-socket client has no address
+
+    def log_message( self, format, *args ):
+        log.debug( format % args )  # polls are frequent; keep them out of the info-log
+
+    ## end class StatusRequestHandler()
+
+
+class UnixHTTPServer( socketserver.ThreadingMixIn, socketserver.UnixStreamServer ):
+    daemon_threads = True
+
+
+class StatusServer():
+    """ Serves a RunStatus from a background thread, on `host:port` (port 0 picks a free port), or on `unix_socket_path` if given. """
+
+    def __init__( self, run_status, host='127.0.0.1', port=0, unix_socket_path='' ):
+        if unix_socket_path:
+            if os.path.exists( unix_socket_path ):
+                os.remove( unix_socket_path )  # left by an earlier process
+            self.httpd = UnixHTTPServer( unix_socket_path, StatusRequestHandler )
+        else:
+            self.httpd = http.server.ThreadingHTTPServer( (host, port), StatusRequestHandler )
+        self.httpd.run_status = run_status
+        self.unix_socket_path = unix_socket_path
+        self.thread = None
+
+    @property
+    def address( self ):
+        return self.unix_socket_path or self.httpd.server_address
+
+    def start( self ):
+        self.thread = threading.Thread( target=self.httpd.serve_forever, name='status-server', daemon=True )
+        self.thread.start()
+        log.info( f'status-server listening on ``{self.address}``' )
+        return
+
+    def stop( self ):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.unix_socket_path and os.path.exists( self.unix_socket_path ):
+            os.remove( self.unix_socket_path )
+        return
+
+    ## end class StatusServer()
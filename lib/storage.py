@@ -0,0 +1,275 @@
+"""
+Storage backends for the Archiver.
+Each backend offers the same small interface, on slash-separated paths:
+- put( path, data, mode=None ) -- data is bytes or a binary file-object; `mode` is a permission-hint (local-filesystem only)
+- put_file( local_filepath, path ) -- stores a local file
+- open_stream( path ) -- returns a binary file-object, for use in a with-block
+- copy( source_path, destination_path, link=False ) -- with `link`, a hard-link where the backend can make one
+- delete( path ) -- a missing path is not an error
+- list( dir_path ) -- returns the names of the files directly in `dir_path`, without stat'ing them
+- list_stats( dir_path, name_filter=None ) -- returns { name: StorageStat } for the files directly in `dir_path` whose names pass `name_filter`,
+    taken from the listing itself where the backend's listing carries them
+- stat( path ) -- returns a StorageStat, or None if there's nothing at `path`
+- put_many( [ (path, data), ... ] ) & delete_many( [ path, ... ] ) -- batched versions
+Backends...
+- LocalStorage -- the local filesystem; the default
+- MemoryStorage -- a dict; for fast tests & benchmarks
+- S3Storage -- an S3-compatible object-store (AWS, MinIO...); needs `boto3`, which is only imported when an S3Storage is created
+make_storage() returns the backend a run's settings name.
+"""
+
+import collections, concurrent.futures, io, logging, os, shutil, time
+
+
+## settings from env/activate
+LOG_PATH = os.environ['ANX_ALMA__LOG_PATH']
+LOG_LEVEL = os.environ['ANX_ALMA__LOG_LEVEL']  # 'DEBUG' or 'INFO'
+
+
+## logging
+log_level = { 'DEBUG': logging.DEBUG, 'INFO': logging.INFO }
+logging.basicConfig(
+    filename=LOG_PATH, level=log_level[LOG_LEVEL],
+    format='[%(asctime)s] %(levelname)s [%(module)s-%(funcName)s()::%(lineno)d] %(message)s',
+    datefmt='%d/%b/%Y %H:%M:%S'
+    )
+log = logging.getLogger(__name__)
+log.debug( 'log setup' )
+
+
+StorageStat = collections.namedtuple( 'StorageStat', ['size', 'mtime'] )
+
+
+class LocalStorage():
+    """ The local filesystem. """
+
+    def put( self, path, data, mode=None ):
+        with open( path, 'wb' ) as file_handler:
+            if type(data) == bytes:
+                file_handler.write( data )
+            else:
+                shutil.copyfileobj( data, file_handler )
+        if mode != None:
+            try:
+                os.chmod( path, mode )
+            except Exception:
+                log.exception( f'could not set file-permissions on ``{path}``' )
+                ## not a storage failure
+        return
+
+    def put_file( self, local_filepath, path ):
+        shutil.copy2( local_filepath, path )
+        return
+
+    def open_stream( self, path ):
+        return open( path, 'rb' )
+
+    def copy( self, source_path, destination_path, link=False ):
+        if link:
+            try:
+                os.link( source_path, destination_path )
+                return
+            except OSError:
+                log.debug( f'could not hard-link ``{source_path}``; copying' )
+        shutil.copy2( source_path, destination_path )
+        return
+
+    def delete( self, path ):
+        try:
+            os.remove( path )
+        except FileNotFoundError:
+            pass
+        return
+
+    def list( self, dir_path ):
+        with os.scandir( dir_path ) as entries:
+            return [ entry.name for entry in entries if entry.is_file() ]  # is_file() uses the scan's cached entry-type
+
+    def list_stats( self, dir_path, name_filter=None ):
+        """ Stats each wanted entry through its DirEntry, which stats without a path-lookup, and caches the result (on Windows, the scan already holds it). """
+        with os.scandir( dir_path ) as entries:
+            wanted_entries = [ entry for entry in entries if (name_filter == None or name_filter(entry.name)) and entry.is_file() ]
+            return { entry.name: StorageStat(entry.stat().st_size, entry.stat().st_mtime) for entry in wanted_entries }
+
+    def stat( self, path ):
+        try:
+            stat_result = os.stat( path )
+        except FileNotFoundError:
+            return None
+        return StorageStat( stat_result.st_size, stat_result.st_mtime )
+
+    def put_many( self, items ):
+        for ( path, data ) in items:
+            self.put( path, data )
+        return
+
+    def delete_many( self, paths ):
+        for path in paths:
+            self.delete( path )
+        return
+
+    ## end class LocalStorage()
+
+
+class MemoryStorage():
+    """ Files held in a dict, as { path: (bytes, mtime) }; directories are implied by the paths. """
+
+    def __init__( self ):
+        self.files = {}
+
+    def put( self, path, data, mode=None ):
+        if type(data) != bytes:
+            data = data.read()
+        self.files[path] = ( data, time.time() )
+        return
+
+    def put_file( self, local_filepath, path ):
+        with open( local_filepath, 'rb' ) as file_handler:
+            self.files[path] = ( file_handler.read(), os.stat(local_filepath).st_mtime )
+        return
+
+    def open_stream( self, path ):
+        if path not in self.files:
+            raise FileNotFoundError( path )
+        return io.BytesIO( self.files[path][0] )
+
+    def copy( self, source_path, destination_path, link=False ):
+        if source_path not in self.files:
+            raise FileNotFoundError( source_path )
+        self.files[destination_path] = self.files[source_path]   # bytes are immutable, so a copy can share them, like a link
+        return
+
+    def delete( self, path ):
+        self.files.pop( path, None )
+        return
+
+    def list( self, dir_path ):
+        prefix = f'{dir_path.rstrip("/")}/'
+        return [ path[len(prefix):] for path in self.files if path.startswith(prefix) and '/' not in path[len(prefix):] ]
+
+    def list_stats( self, dir_path, name_filter=None ):
+        return { name: self.stat(f'{dir_path.rstrip("/")}/{name}') for name in self.list(dir_path) if name_filter == None or name_filter(name) }
+
+    def stat( self, path ):
+        if path not in self.files:
+            return None
+        ( data, mtime ) = self.files[path]
+        return StorageStat( len(data), mtime )
+
+    def put_many( self, items ):
+        for ( path, data ) in items:
+            self.put( path, data )
+        return
+
+    def delete_many( self, paths ):
+        for path in paths:
+            self.delete( path )
+        return
+
+    ## end class MemoryStorage()
+
+
+class S3Storage():
+    """ An S3-compatible bucket; a path maps to the key `{key_prefix}{path.lstrip('/')}`.
+        `client` may be passed in (eg one made against a local MinIO or moto endpoint); otherwise one is made from `client_kwargs`. """
+
+    DELETE_BATCH_SIZE = 1000  # the most keys one DeleteObjects call takes
+
+    def __init__( self, bucket, key_prefix='', client=None, max_workers=8, **client_kwargs ):
+        if client == None:
+            import boto3  # optional dependency; only needed for this backend
+            client = boto3.client( 's3', **client_kwargs )
+        self.client = client
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        self.max_workers = max_workers
+
+    def make_key( self, path ):
+        return f'{self.key_prefix}{path.lstrip("/")}'
+
+    def put( self, path, data, mode=None ):
+        if type(data) == bytes:
+            self.client.put_object( Bucket=self.bucket, Key=self.make_key(path), Body=data )
+        else:
+            self.client.upload_fileobj( data, self.bucket, self.make_key(path) )
+        return
+
+    def put_file( self, local_filepath, path ):
+        self.client.upload_file( local_filepath, self.bucket, self.make_key(path) )
+        return
+
+    def open_stream( self, path ):
+        try:
+            response = self.client.get_object( Bucket=self.bucket, Key=self.make_key(path) )
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError( path )
+        return response['Body']
+
+    def copy( self, source_path, destination_path, link=False ):
+        """ Always a server-side copy; object-stores have no links. """
+        self.client.copy_object( Bucket=self.bucket, Key=self.make_key(destination_path), CopySource={'Bucket': self.bucket, 'Key': self.make_key(source_path)} )
+        return
+
+    def delete( self, path ):
+        self.client.delete_object( Bucket=self.bucket, Key=self.make_key(path) )
+        return
+
+    def list( self, dir_path ):
+        prefix = self.make_key( f'{dir_path.rstrip("/")}/' )
+        names = []
+        paginator = self.client.get_paginator( 'list_objects_v2' )
+        for page in paginator.paginate( Bucket=self.bucket, Prefix=prefix, Delimiter='/' ):
+            names.extend( obj['Key'][len(prefix):] for obj in page.get('Contents', []) )
+        return names
+
+    def list_stats( self, dir_path, name_filter=None ):
+        """ The listing carries each object's size & last-modified time, so nothing is head'ed. """
+        prefix = self.make_key( f'{dir_path.rstrip("/")}/' )
+        stats = {}
+        paginator = self.client.get_paginator( 'list_objects_v2' )
+        for page in paginator.paginate( Bucket=self.bucket, Prefix=prefix, Delimiter='/' ):
+            for obj in page.get( 'Contents', [] ):
+                name = obj['Key'][len(prefix):]
+                if name_filter == None or name_filter( name ):
+                    stats[name] = StorageStat( obj['Size'], obj['LastModified'].timestamp() )
+        return stats
+
+    def stat( self, path ):
+        try:
+            response = self.client.head_object( Bucket=self.bucket, Key=self.make_key(path) )
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ( '404', 'NoSuchKey' ):
+                return None
+            raise
+        return StorageStat( response['ContentLength'], response['LastModified'].timestamp() )
+
+    def put_many( self, items ):
+        """ Uploads concurrently; object-store latency, not bandwidth, is the usual limit. """
+        with concurrent.futures.ThreadPoolExecutor( max_workers=self.max_workers ) as executor:
+            for future in [ executor.submit(self.put, path, data) for ( path, data ) in items ]:
+                future.result()
+        return
+
+    def delete_many( self, paths ):
+        """ Deletes in batches of up to DELETE_BATCH_SIZE keys per request. """
+        keys = [ self.make_key(path) for path in paths ]
+        for start in range( 0, len(keys), self.DELETE_BATCH_SIZE ):
+            batch = keys[start:start + self.DELETE_BATCH_SIZE]
+            response = self.client.delete_objects( Bucket=self.bucket, Delete={'Objects': [ {'Key': key} for key in batch ], 'Quiet': True} )
+            if response.get( 'Errors' ):
+                raise Exception( f'problem deleting objects, ``{response["Errors"]}``' )
+        return
+
+    ## end class S3Storage()
+
+
+def make_storage( settings ):
+    """ Returns the backend named by `ANX_ALMA__STORAGE_BACKEND` -- `local` (the default) or `s3` -- for the controller's Archiver.
+        Called by controller.Controller() """
+    backend_name = settings.get( 'ANX_ALMA__STORAGE_BACKEND', 'local' )
+    if backend_name == 'local':
+        return LocalStorage()
+    if backend_name == 's3':
+        client_kwargs = { 'endpoint_url': settings['ANX_ALMA__S3_ENDPOINT_URL'] } if settings.get( 'ANX_ALMA__S3_ENDPOINT_URL' ) else {}  # eg a MinIO server
+        return S3Storage( settings['ANX_ALMA__S3_BUCKET'], key_prefix=settings.get('ANX_ALMA__S3_KEY_PREFIX', ''), **client_kwargs )
+    raise ValueError( f'unknown storage-backend, ``{backend_name}``; expected `local` or `s3`' )
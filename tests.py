@@ -8,12 +8,28 @@ Usage:
     - example: $ python3 ./tests.py ParserTest.test_prepare_gfa_entry__from_hay_digitization
 """
 
-import datetime, logging, os, shutil, sys, unittest
+import csv, datetime, hashlib, io, json, logging, mmap, os, re, shutil, socket, sys, tempfile, threading, time, tracemalloc, unittest, urllib.error, urllib.request
 import bs4
 
 sys.path.append( os.environ['ANX_ALMA__ENCLOSING_PROJECT_PATH'] )
+from parse_alma_annex_requests_code.controller import Controller
+from parse_alma_annex_requests_code.lib import history, mapper, rollup, scheduler, soak
 from parse_alma_annex_requests_code.lib.archiver import Archiver
+from parse_alma_annex_requests_code.lib.engine_harness import collect_corpus, compare_engines, compare_results, make_synthetic_text, run_engine
+from parse_alma_annex_requests_code.lib.engines import PARSER_ENGINES, REFERENCE_ENGINE, make_parser
+from parse_alma_annex_requests_code.lib.mapping_config import MappingConfig, MappingTables
 from parse_alma_annex_requests_code.lib.parser import Parser
+from parse_alma_annex_requests_code.lib.preflight import Preflight
+from parse_alma_annex_requests_code.lib.profiling import CpuProfiler, MemoryProfiler, summarize_stats
+from parse_alma_annex_requests_code.lib.records import AlmaRequest, GfaEntry
+from parse_alma_annex_requests_code.lib.retention import Pruner, parse_file_stamp, run_retention
+from parse_alma_annex_requests_code.lib.rollup import RollupStore, make_rollup_key
+from parse_alma_annex_requests_code.lib.sanitizer import Sanitizer
+from parse_alma_annex_requests_code.lib.soak import SoakHarness
+from parse_alma_annex_requests_code.lib.spooler import Spooler
+from parse_alma_annex_requests_code.lib.status import RunStatus, StatusServer
+from parse_alma_annex_requests_code.lib.storage import LocalStorage, MemoryStorage, S3Storage
+from parse_alma_annex_requests_code.lib.resolver import MappingResolver, UnknownMappingKeyError, normalize_key
 
 
 TEST_DIRS_PATH = os.environ['ANX_ALMA__TEST_DIRS_PATH']
@@ -50,6 +66,81 @@ class ArchiverTest( unittest.TestCase ):
         self.assertEqual( 'BUL_ANNEX-foo.xml', new_file_name )
         self.assertTrue( err == None )
 
+    def test_detect_new_file__quiet_period_and_marker(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            now = time.time()
+            for ( file_name, age_seconds ) in [ ('BUL_ANNEX-old.xml', 300), ('BUL_ANNEX-older.xml', 600), ('BUL_ANNEX-uploading.xml', 5), ('notes.txt', 900), ('BUL_ANNEX-older.xml.part', 900) ]:
+                with open( f'{temp_dir}/{file_name}', 'w' ) as f:
+                    f.write( 'x' )
+                os.utime( f'{temp_dir}/{file_name}', (now - age_seconds, now - age_seconds) )
+            os.mkdir( f'{temp_dir}/BUL_ANNEX-a-directory.xml' )
+            ## oldest quiet file first; files still being written are skipped
+            self.assertEqual( ('BUL_ANNEX-older.xml', None), self.arcvr.check_for_new_file(temp_dir, quiet_seconds=60, now=now) )
+            self.assertEqual( 3, self.arcvr.pending_file_count )
+            os.remove( f'{temp_dir}/BUL_ANNEX-older.xml' )
+            self.assertEqual( ('BUL_ANNEX-old.xml', None), self.arcvr.check_for_new_file(temp_dir, quiet_seconds=60, now=now) )
+            self.assertEqual( ('', None), self.arcvr.check_for_new_file(temp_dir, quiet_seconds=1000, now=now) )
+            ## a marker-file makes a file ready immediately
+            with open( f'{temp_dir}/BUL_ANNEX-uploading.xml.done', 'w' ) as f:
+                f.write( '' )
+            self.assertEqual( ('BUL_ANNEX-uploading.xml', None), self.arcvr.check_for_new_file(temp_dir, quiet_seconds=1000, now=now) )
+            err = self.arcvr.delete_original( f'{temp_dir}/BUL_ANNEX-uploading.xml' )
+            self.assertEqual( None, err )
+            self.assertFalse( os.path.exists(f'{temp_dir}/BUL_ANNEX-uploading.xml.done') )
+        finally:
+            shutil.rmtree( temp_dir )
+
+    def test_claim_file__one_winner(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with open( f'{temp_dir}/BUL_ANNEX-foo.xml', 'w' ) as f:
+                f.write( 'x' )
+            ( claimed_a, err_a ) = self.arcvr.claim_file( temp_dir, 'BUL_ANNEX-foo.xml', 'worker-a' )
+            ( claimed_b, err_b ) = self.arcvr.claim_file( temp_dir, 'BUL_ANNEX-foo.xml', 'worker-b' )
+            self.assertEqual( f'{temp_dir}/processing/worker-a/BUL_ANNEX-foo.xml', claimed_a )
+            self.assertEqual( ( '', None, None ), ( claimed_b, err_a, err_b ) )
+            self.assertTrue( os.path.exists(f'{claimed_a}.lease') )
+            self.assertEqual( ('', None), self.arcvr.check_for_new_file(temp_dir) )   # claimed files aren't offered again
+            ## finishing removes the lease & claim-directory
+            self.assertEqual( None, self.arcvr.delete_original(claimed_a) )
+            self.assertEqual( [], os.listdir(f'{temp_dir}/processing') )
+        finally:
+            shutil.rmtree( temp_dir )
+
+    def test_claim_file__same_worker_loser_keeps_lease(self):
+        """ A losing claim by the same worker-id leaves the winner's claim & lease alone. """
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with open( f'{temp_dir}/BUL_ANNEX-foo.xml', 'w' ) as f:
+                f.write( 'x' )
+            ( claimed_a, err_a ) = self.arcvr.claim_file( temp_dir, 'BUL_ANNEX-foo.xml', 'worker-a' )
+            ( claimed_b, err_b ) = self.arcvr.claim_file( temp_dir, 'BUL_ANNEX-foo.xml', 'worker-a' )
+            self.assertEqual( ( '', None, None ), ( claimed_b, err_a, err_b ) )
+            self.assertTrue( os.path.exists(claimed_a) )
+            self.assertTrue( os.path.exists(f'{claimed_a}.lease') )
+        finally:
+            shutil.rmtree( temp_dir )
+
+    def test_recover_stale_claims(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for file_name in [ 'BUL_ANNEX-stale.xml', 'BUL_ANNEX-fresh.xml' ]:
+                with open( f'{temp_dir}/{file_name}', 'w' ) as f:
+                    f.write( 'x' )
+            ( stale_path, err ) = self.arcvr.claim_file( temp_dir, 'BUL_ANNEX-stale.xml', 'worker-dead' )
+            ( fresh_path, err ) = self.arcvr.claim_file( temp_dir, 'BUL_ANNEX-fresh.xml', 'worker-alive' )
+            now = time.time()
+            os.utime( f'{stale_path}.lease', (now - 1000, now - 1000) )
+            self.assertEqual( None, self.arcvr.heartbeat_claim(fresh_path) )
+            ( recovered_names, err ) = self.arcvr.recover_stale_claims( temp_dir, lease_seconds=600, now=now )
+            self.assertEqual( ( ['BUL_ANNEX-stale.xml'], None ), ( recovered_names, err ) )
+            self.assertTrue( os.path.exists(f'{temp_dir}/BUL_ANNEX-stale.xml') )
+            self.assertTrue( os.path.exists(fresh_path) )
+            self.assertEqual( ['worker-alive'], os.listdir(f'{temp_dir}/processing') )
+        finally:
+            shutil.rmtree( temp_dir )
+
     def test_make_datetime_stamp(self):
         datetime_obj = datetime.datetime(2021, 7, 13, 14, 40, 49 )
         dt_result = self.arcvr.make_datetime_stamp( datetime_obj )
@@ -76,8 +167,8 @@ class ArchiverTest( unittest.TestCase ):
 
     def test_stringify_gfa_data(self):
         gfa_items = [
-            ['a1', 'b1', 'c1', 'd1', 'e1', 'f1', 'g1', 'h1', 'i1' ],
-            ['aa2', 'bb2', 'cc2', 'd2', 'e2', 'f2', 'g2', 'h2', 'i2' ],
+            GfaEntry( item_id='a1', item_barcode='b1', gfa_delivery='c1', gfa_location='d1', patron_name='e1', patron_barcode='f1', item_title='g1', gfa_date_str='h1', patron_note='i1' ),
+            GfaEntry( item_id='aa2', item_barcode='bb2', gfa_delivery='cc2', gfa_location='d2', patron_name='e2', patron_barcode='f2', item_title='g2', gfa_date_str='h2', patron_note='i2' ),
         ]
         ( stringified_data, err ) = self.arcvr.stringify_gfa_data( gfa_items )
         log.debug( f'stringified_data in test, ``{stringified_data}``' )
@@ -87,6 +178,15 @@ class ArchiverTest( unittest.TestCase ):
             )
         self.assertTrue( err == None )
 
+    def test_stringify_gfa_columns(self):
+        gfa_columns = [ ['a1', 'aa2'], ['b1', 'bb2'], ['c1', 'cc2'], ['d1', 'd2'], ['e1', 'e2'], ['f1', 'f2'], ['g1', 'g2'], ['h1', 'h2'], ['i1', 'i2'] ]
+        ( stringified_data, err ) = self.arcvr.stringify_gfa_columns( gfa_columns )
+        self.assertEqual(
+            '''"a1","b1","c1","d1","e1","f1","g1","h1","i1"\n"aa2","bb2","cc2","d2","e2","f2","g2","h2","i2"\n''',
+            stringified_data
+            )
+        self.assertTrue( err == None )
+
     def test_save_parsed_to_archives(self):
         text = 'foo'
         datetime_stamp = '1960-02-02T08-15-00'
@@ -96,6 +196,24 @@ class ArchiverTest( unittest.TestCase ):
         self.assertEqual( True, success )
         self.assertEqual( None, err )
 
+    def test_save_quarantined_to_archives(self):
+        datetime_stamp = '1960-02-02T08-15-00'
+        test_destination_dir = f'{TEST_DIRS_PATH}/quarantine_destination_dir'
+        self.clear_dir( test_destination_dir )
+        prsr = Parser()
+        ( all_text, err ) = prsr.load_file( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml' )
+        ( item_list, err ) = prsr.make_item_list( all_text )
+        quarantined_items = [ (str(item_list[0]), ["KeyError('Rockefeller Library')"]) ]
+        ( destination_filepath, err ) = self.arcvr.save_quarantined_to_archives( quarantined_items, datetime_stamp, test_destination_dir )
+        self.assertEqual( f'{test_destination_dir}/REQ-ALMA-QUARANTINE_1960-02-02T08-15-00.xml', destination_filepath )
+        self.assertEqual( None, err )
+        ## quarantine-file can be re-parsed once the mapper is fixed
+        ( quarantined_text, err ) = prsr.load_file( destination_filepath )
+        self.assertTrue( "quarantine-reason: KeyError('Rockefeller Library')" in quarantined_text )
+        ( quarantined_list, err ) = prsr.make_item_list( quarantined_text )
+        self.assertEqual( 1, len(quarantined_list) )
+        self.assertEqual( ('2332679300006966', None), prsr.parse_item_id(quarantined_list[0]) )
+
     def test_send_gfa_count_file(self):
         """ Can't test for success cuz files disappear quickly. """
         count = 2
@@ -181,6 +299,23 @@ class ParserTest( unittest.TestCase ):
         self.assertEqual( 12, len(items) )
         self.assertEqual( bs4.element.Tag, type(items[0]) )
 
+    def test_make_item_list__from_file_bytes(self):
+        ( file_bytes, err ) = self.prsr.load_file_bytes( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml' )
+        self.assertEqual( (mmap.mmap, None), (type(file_bytes), err) )
+        ( items, err ) = self.prsr.make_item_list( file_bytes )
+        self.prsr.close_file_bytes( file_bytes )
+        self.assertEqual( ( 12, 'Education.' ), ( len(items), self.prsr.parse_item_title(items[0])[0] ) )
+        with tempfile.NamedTemporaryFile( suffix='.xml' ) as f:   # an empty file can't be mapped
+            self.assertEqual( (b'', None), self.prsr.load_file_bytes(f.name) )
+
+    def test_make_item_list__leading_blank_line(self):
+        """ A blank line before the xml-declaration mustn't cost the `&gt;` entity in item 10's barcode. """
+        with open( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml', encoding='utf-8' ) as f:
+            text = '\n' + f.read()
+        for all_text in ( text, b'\xef\xbb\xbf' + text.encode('utf-8') ):
+            ( items, err ) = self.prsr.make_item_list( all_text )
+            self.assertTrue( self.prsr.parse_item_barcode(items[10])[0].endswith('Kreml, O>; Start page 225; End page 243; Volume 32; Issue 1; Publication date 2015') )
+
     def test_parse_item_id(self):
         ( all_text, err ) = self.prsr.load_file( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml' )
         ( item_list, err ) = self.prsr.make_item_list( all_text )
@@ -322,14 +457,14 @@ class ParserTest( unittest.TestCase ):
         ## ( item_id, item_title, item_barcode, patron_name, patron_barcode, patron_note, parsed_alma_pickup_library, parsed_alma_library_code )
         ( gfa_entry, err ) = self.prsr.prepare_gfa_entry(
                 '2332679300006966', 'Education.', '31236011508853', 'Ddddd, Bbbbbb', '12345678901234', 'b-test, new-configuration, physical-rock, 2:59pm', 'Rockefeller Library', 'ROCK' )
-        self.assertEqual( '2332679300006966', gfa_entry[0] )
-        self.assertEqual( '31236011508853', gfa_entry[1] )
-        self.assertEqual( 'RO', gfa_entry[2] )
-        self.assertEqual( 'QS', gfa_entry[3] )
-        self.assertEqual( 'Ddddd, Bbbbbb', gfa_entry[4] )
-        self.assertEqual( '12345678901234', gfa_entry[5] )
-        self.assertEqual( 'Education.', gfa_entry[6] )
-        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry[7] )
+        self.assertEqual( '2332679300006966', gfa_entry.item_id )
+        self.assertEqual( '31236011508853', gfa_entry.item_barcode )
+        self.assertEqual( 'RO', gfa_entry.gfa_delivery )
+        self.assertEqual( 'QS', gfa_entry.gfa_location )
+        self.assertEqual( 'Ddddd, Bbbbbb', gfa_entry.patron_name )
+        self.assertEqual( '12345678901234', gfa_entry.patron_barcode )
+        self.assertEqual( 'Education.', gfa_entry.item_title )
+        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry.gfa_date_str )
         self.assertEqual( None, err )
 
     def test_prepare_gfa_entry__hay(self):
@@ -337,14 +472,14 @@ class ParserTest( unittest.TestCase ):
         ## returned: [ 'item_id', item_barcode, gfa-delivery-code, gfa-location-code, patron_name, patron_barcode, title, date, note ]
         ( gfa_entry, err ) = self.prsr.prepare_gfa_entry(
                 '23334087800006966', 'Southern medical journal.', '31236070043131', 'Mmmmmmmm, Mmm', '12345678901234', 'b-test, new-configuration, physical-hay, 2:59pm', 'John Hay Library', 'HAY' )
-        self.assertEqual( '23334087800006966', gfa_entry[0] )
-        self.assertEqual( '31236070043131', gfa_entry[1] )
-        self.assertEqual( 'HA', gfa_entry[2] )
-        self.assertEqual( 'QH', gfa_entry[3] )
-        self.assertEqual( 'Mmmmmmmm, Mmm', gfa_entry[4] )
-        self.assertEqual( '12345678901234', gfa_entry[5] )
-        self.assertEqual( 'Southern medical journal.', gfa_entry[6] )
-        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry[7] )
+        self.assertEqual( '23334087800006966', gfa_entry.item_id )
+        self.assertEqual( '31236070043131', gfa_entry.item_barcode )
+        self.assertEqual( 'HA', gfa_entry.gfa_delivery )
+        self.assertEqual( 'QH', gfa_entry.gfa_location )
+        self.assertEqual( 'Mmmmmmmm, Mmm', gfa_entry.patron_name )
+        self.assertEqual( '12345678901234', gfa_entry.patron_barcode )
+        self.assertEqual( 'Southern medical journal.', gfa_entry.item_title )
+        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry.gfa_date_str )
         self.assertEqual( None, err )
 
     def test_prepare_gfa_entry__rock_from_personal(self):
@@ -352,14 +487,14 @@ class ParserTest( unittest.TestCase ):
         ## returned: [ 'item_id', item_barcode, gfa-delivery-code, gfa-location-code, patron_name, patron_barcode, title, date, note ]
         ( gfa_entry, err ) = self.prsr.prepare_gfa_entry(
                 '23319705570006966', 'Taiwan tian zhu jiao shi liao hui bian / Gu Weiying bian.', '31236093072141', 'Nnnnnnnn, Rrrrrrr', '12345678901234', 'b-test, new-configuration, physical-personal-deliver, 2:59pm', 'PERSONAL_DELIVERY', '' )
-        self.assertEqual( '23319705570006966', gfa_entry[0] )
-        self.assertEqual( '31236093072141', gfa_entry[1] )
-        self.assertEqual( 'RO', gfa_entry[2] )
-        self.assertEqual( 'QS', gfa_entry[3] )
-        self.assertEqual( 'Nnnnnnnn, Rrrrrrr', gfa_entry[4] )
-        self.assertEqual( '12345678901234', gfa_entry[5] )
-        self.assertEqual( 'Taiwan tian zhu jiao shi liao hui bian / Gu Weiying bian.', gfa_entry[6] )
-        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry[7] )
+        self.assertEqual( '23319705570006966', gfa_entry.item_id )
+        self.assertEqual( '31236093072141', gfa_entry.item_barcode )
+        self.assertEqual( 'RO', gfa_entry.gfa_delivery )
+        self.assertEqual( 'QS', gfa_entry.gfa_location )
+        self.assertEqual( 'Nnnnnnnn, Rrrrrrr', gfa_entry.patron_name )
+        self.assertEqual( '12345678901234', gfa_entry.patron_barcode )
+        self.assertEqual( 'Taiwan tian zhu jiao shi liao hui bian / Gu Weiying bian.', gfa_entry.item_title )
+        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry.gfa_date_str )
         self.assertEqual( None, err )
 
     def test_prepare_gfa_entry__from_hay_digitization(self):
@@ -375,14 +510,14 @@ class ParserTest( unittest.TestCase ):
                 'DIGITAL_REQUEST_HAY',
                 '' )
         log.debug( 'assertions begin' )
-        self.assertEqual( '23252022350006966', gfa_entry[0] )
-        self.assertEqual( '31236098095956', gfa_entry[1] )
-        self.assertEqual( 'EH', gfa_entry[2] )
-        self.assertEqual( 'QH', gfa_entry[3] )
-        self.assertEqual( 'Kkkkkkk, Jjjjjjjj', gfa_entry[4] )
-        self.assertEqual( '12345678901234', gfa_entry[5] )
-        self.assertEqual( 'Spit temple : the selected performances of Cecilia Vicuña / edited by Rosa Alcalá', gfa_entry[6] )
-        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry[7] )
+        self.assertEqual( '23252022350006966', gfa_entry.item_id )
+        self.assertEqual( '31236098095956', gfa_entry.item_barcode )
+        self.assertEqual( 'EH', gfa_entry.gfa_delivery )
+        self.assertEqual( 'QH', gfa_entry.gfa_location )
+        self.assertEqual( 'Kkkkkkk, Jjjjjjjj', gfa_entry.patron_name )
+        self.assertEqual( '12345678901234', gfa_entry.patron_barcode )
+        self.assertEqual( 'Spit temple : the selected performances of Cecilia Vicuña / edited by Rosa Alcalá', gfa_entry.item_title )
+        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry.gfa_date_str )
         self.assertEqual( None, err )
 
     def test_prepare_gfa_entry__from_NONHAY_digitization(self):
@@ -398,15 +533,88 @@ class ParserTest( unittest.TestCase ):
                 'DIGITAL_REQUEST_NONHAY',
                 '' )
         log.debug( 'assertions begin' )
-        self.assertEqual( '23262289010006966', gfa_entry[0] )
-        self.assertEqual( '31236090510895', gfa_entry[1] )
-        self.assertEqual( 'ED', gfa_entry[2] )
-        self.assertEqual( 'QS', gfa_entry[3] )
-        self.assertEqual( 'Aaaaaaa, Jjjjjjj', gfa_entry[4] )
-        self.assertEqual( '12345678901234', gfa_entry[5] )
-        self.assertEqual( 'Family medicine.', gfa_entry[6] )
-        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry[7] )
+        self.assertEqual( '23262289010006966', gfa_entry.item_id )
+        self.assertEqual( '31236090510895', gfa_entry.item_barcode )
+        self.assertEqual( 'ED', gfa_entry.gfa_delivery )
+        self.assertEqual( 'QS', gfa_entry.gfa_location )
+        self.assertEqual( 'Aaaaaaa, Jjjjjjj', gfa_entry.patron_name )
+        self.assertEqual( '12345678901234', gfa_entry.patron_barcode )
+        self.assertEqual( 'Family medicine.', gfa_entry.item_title )
+        self.assertEqual( datetime.datetime.now().strftime( '%a %b %d %Y' ), gfa_entry.gfa_date_str )
+        self.assertEqual( None, err )
+
+    def test_prepare_gfa_columns__matches_prepare_gfa_entry(self):
+        ( all_text, err ) = self.prsr.load_file( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml' )
+        ( item_list, err ) = self.prsr.make_item_list( all_text )
+        parsers = [ self.prsr.parse_item_id, self.prsr.parse_item_title, self.prsr.parse_item_barcode, self.prsr.parse_patron_name,
+            self.prsr.parse_patron_barcode, self.prsr.parse_patron_note, self.prsr.parse_alma_pickup_library, self.prsr.parse_alma_library_code ]
+        columns = [ [parse(item)[0] for item in item_list] for parse in parsers ]
+        ( gfa_columns, row_errs, err ) = self.prsr.prepare_gfa_columns( *columns )
+        self.assertEqual( None, err )
+        self.assertEqual( {}, row_errs )
+        expected_entries = [ self.prsr.prepare_gfa_entry( *row )[0] for row in zip(*columns) ]
+        self.assertEqual( [[getattr(entry, name) for name in GfaEntry.__slots__] for entry in expected_entries], [list(row) for row in zip(*gfa_columns)] )
+
+    def test_prepare_gfa_columns__faster_than_per_record(self):
+        """ Benchmark: with few distinct (pickup-library, library-code) pairs, the columnar transform beats prepare_gfa_entry() per record. """
+        row_count = 6000
+        pickups = [ 'Rockefeller Library', 'John Hay Library', 'Rockefeller Library' ] * ( row_count // 3 )
+        codes = [ 'ROCK', 'HAY', 'ROCK' ] * ( row_count // 3 )
+        ids = [ f'id{i}' for i in range(row_count) ]
+        start_time = time.perf_counter()
+        ( gfa_columns, row_errs, err ) = self.prsr.prepare_gfa_columns( ids, ids, ids, ids, ids, ids, pickups, codes )
+        columnar_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for row in zip( ids, ids, ids, ids, ids, ids, pickups, codes ):
+            self.prsr.prepare_gfa_entry( *row )
+        per_record_seconds = time.perf_counter() - start_time
+        self.assertEqual( ( row_count, {}, None ), ( len(gfa_columns[0]), row_errs, err ) )
+        self.assertTrue( columnar_seconds < per_record_seconds / 4, (columnar_seconds, per_record_seconds) )
+
+    def test_prepare_gfa_entries__distinct_pairs_and_row_errs(self):
+        calls = []
+        original_transform = self.prsr.transform_parsed_alma_pickup_library
+        def counting_transform( pickup_library ):
+            calls.append( pickup_library )
+            return original_transform( pickup_library )
+        self.prsr.transform_parsed_alma_pickup_library = counting_transform
+        pickups = [ 'Rockefeller Library', 'Unknown Library', 'Rockefeller Library', 'John Hay Library', 'Rockefeller Library' ]
+        codes = [ 'ROCK', 'ROCK', 'ROCK', 'HAY', 'ROCK' ]
+        alma_requests = [
+            AlmaRequest( item_id=f'id{i}', item_title='t', item_barcode='b', patron_name='n', patron_barcode='p', patron_note='', parsed_alma_pickup_library=pickup, parsed_alma_library_code=code )
+            for ( i, ( pickup, code ) ) in enumerate( zip(pickups, codes) ) ]
+        ( gfa_entries, row_errs, err ) = self.prsr.prepare_gfa_entries( alma_requests, gfa_date_str='Tue Feb 02 1960' )
         self.assertEqual( None, err )
+        self.assertEqual( 3, len(calls) )   # one transform per distinct pair
+        self.assertEqual( [1], list(row_errs.keys()) )
+        self.assertEqual( ['id0', 'id2', 'id3', 'id4'], [entry.item_id for entry in gfa_entries] )
+        self.assertEqual( ['RO', 'RO', 'HA', 'RO'], [entry.gfa_delivery for entry in gfa_entries] )
+        self.assertEqual( ['QS', 'QS', 'QH', 'QS'], [entry.gfa_location for entry in gfa_entries] )
+        self.assertEqual( ['Tue Feb 02 1960'] * 4, [entry.gfa_date_str for entry in gfa_entries] )
+
+    def test_parse_alma_request(self):
+        ( all_text, err ) = self.prsr.load_file( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml' )
+        ( item_list, err ) = self.prsr.make_item_list( all_text )
+        ( alma_request, err ) = self.prsr.parse_alma_request( item_list[1] )
+        self.assertEqual( None, err )
+        self.assertEqual( '23334087800006966', alma_request.item_id )
+        self.assertEqual( 'Southern medical journal.', alma_request.item_title )
+        self.assertEqual( 'John Hay Library', alma_request.parsed_alma_pickup_library )
+        self.assertEqual( 'HAY', alma_request.parsed_alma_library_code )
+        self.assertEqual( 'no_note', alma_request.patron_note )
+
+    def test_prepare_gfa_entries__matches_prepare_gfa_entry(self):
+        ( all_text, err ) = self.prsr.load_file( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml' )
+        ( item_list, err ) = self.prsr.make_item_list( all_text )
+        alma_requests = [ self.prsr.parse_alma_request(item)[0] for item in item_list ]
+        ( gfa_entries, row_errs, err ) = self.prsr.prepare_gfa_entries( alma_requests )
+        self.assertEqual( None, err )
+        self.assertEqual( {}, row_errs )
+        expected_entries = [
+            self.prsr.prepare_gfa_entry( r.item_id, r.item_title, r.item_barcode, r.patron_name, r.patron_barcode, r.patron_note, r.parsed_alma_pickup_library, r.parsed_alma_library_code )[0]
+            for r in alma_requests ]
+        self.assertEqual( expected_entries, gfa_entries )
+        self.assertTrue( gfa_entries[0].gfa_date_str is gfa_entries[-1].gfa_date_str )   # one shared date-string
 
     def test_transform_parsed_alma_library_code(self):
         """ Checks transform_parsed_alma_library_code() 
@@ -426,8 +634,1170 @@ class ParserTest( unittest.TestCase ):
         (value_C, err_C) = self.prsr.transform_parsed_alma_library_code( 'SCIENCE', 'SC' )
         self.assertEqual( expected_C, value_C )
 
+    def test_transform_parsed_alma_pickup_library__variant_and_unknown(self):
+        self.assertEqual( ('HA', None), self.prsr.transform_parsed_alma_pickup_library('john hay library') )
+        ( gfa_delivery, err ) = self.prsr.transform_parsed_alma_pickup_library( 'Sciences Libary' )
+        self.assertEqual( '', gfa_delivery )
+        self.assertTrue( 'Sciences Library' in err )
+
     ## end class ParserTest()
 
 
+class RecordsTest( unittest.TestCase ):
+
+    def test_gfa_entry_is_compact_and_keyword_only(self):
+        entry = GfaEntry( item_id='a', item_barcode='b', gfa_delivery='RO', gfa_location='QS', patron_name='e', patron_barcode='f', item_title='g', gfa_date_str='Tue Feb 02 1960', patron_note='i' )
+        self.assertFalse( hasattr(entry, '__dict__') )
+        with self.assertRaises( AttributeError ):
+            entry.extra_field = 'x'
+        with self.assertRaises( TypeError ):
+            GfaEntry( 'a', 'b', 'RO', 'QS', 'e', 'f', 'g', 'h', 'i' )
+
+    def test_low_cardinality_fields_interned(self):
+        ( delivery_a, delivery_b ) = ( ''.join(['R', 'O']), ''.join(['R', 'O']) )
+        self.assertFalse( delivery_a is delivery_b )
+        entry_a = GfaEntry( item_id='1', item_barcode='b', gfa_delivery=delivery_a, gfa_location='QS', patron_name='e', patron_barcode='f', item_title='g', gfa_date_str='h', patron_note='i' )
+        entry_b = GfaEntry( item_id='2', item_barcode='b', gfa_delivery=delivery_b, gfa_location='QS', patron_name='e', patron_barcode='f', item_title='g', gfa_date_str='h', patron_note='i' )
+        self.assertTrue( entry_a.gfa_delivery is entry_b.gfa_delivery )
+
+    ## end class RecordsTest()
+
+
+class SanitizerTest( unittest.TestCase ):
+
+    ## -- tests ---------------------------------
+
+    def test_policies(self):
+        value = 'a\tb\r\nc "d" \\e\x07'
+        self.assertEqual( "abc 'd' \\e", Sanitizer( {'item_title': 'strip'} ).sanitize('item_title', value) )
+        self.assertEqual( "a b  c 'd' \\e ", Sanitizer( {'item_title': 'replace'} ).sanitize('item_title', value) )
+        self.assertEqual( 'a\\tb\\r\\nc ""d"" \\\\e\\x07', Sanitizer( {'item_title': 'escape'} ).sanitize('item_title', value) )
+
+    def test_normalization_and_counts(self):
+        sanitizer = Sanitizer( normalize_form='NFC' )
+        decomposed = 'Vicun\u0303a'
+        self.assertEqual( 'Vicu\u00f1a', sanitizer.sanitize('item_title', decomposed) )
+        clean = 'Education.'
+        self.assertTrue( sanitizer.sanitize('item_title', clean) is clean )
+        sanitizer.sanitize( 'patron_note', 'line one\nline two' )
+        self.assertEqual( {'item_title.normalized': 1, 'patron_note.translated': 1}, dict(sanitizer.counts) )
+        self.assertEqual( decomposed, Sanitizer( normalize_form='' ).sanitize('item_title', decomposed) )
+
+    def test_bad_policy(self):
+        with self.assertRaises( ValueError ):
+            Sanitizer( {'item_title': 'shout'} )
+
+    def test_prepare_gfa_entry_sanitizes(self):
+        prsr = Parser()
+        ( gfa_entry, err ) = prsr.prepare_gfa_entry(
+            '2332679300006966', 'The "Education"\tjournal.', '31236011508853', 'Ddddd,\x0bBbbbbb', '12345678901234', 'note', 'Rockefeller Library', 'ROCK' )
+        self.assertEqual( None, err )
+        self.assertEqual( "The 'Education' journal.", gfa_entry.item_title )
+        self.assertEqual( 'Ddddd, Bbbbbb', gfa_entry.patron_name )
+        self.assertEqual( 2, sum(prsr.sanitizer.counts.values()) )
+
+    ## end class SanitizerTest()
+
+
+class ResolverTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.resolver = MappingResolver( mapper.ALMA_PICKUP_TO_GFA_DELIVERY, 'alma pickup-library' )
+
+    ## -- tests ---------------------------------
+
+    def test_normalize_key(self):
+        self.assertEqual( 'hay at rock reading room', normalize_key('  Hay at  Rock\tReading-Room. ') )
+        self.assertEqual( 'digital request hay', normalize_key('DIGITAL_REQUEST_HAY') )
+
+    def test_resolve__variants(self):
+        self.assertEqual( 'RO', self.resolver.resolve('Rockefeller Library') )
+        self.assertEqual( 'RO', self.resolver.resolve('rockefeller  library ') )
+        self.assertEqual( 'HA', self.resolver.resolve('JOHN HAY LIBRARY') )
+        self.assertEqual( 'EH', self.resolver.resolve('digital-request-hay') )
+
+    def test_resolve__memoized(self):
+        self.resolver.resolve( 'sciences library' )
+        self.assertEqual( {'sciences library': 'SC'}, self.resolver.memo )
+
+    def test_resolve__unknown_key_suggests(self):
+        with self.assertRaises( UnknownMappingKeyError ) as context:
+            self.resolver.resolve( 'Rockefeler Libary' )
+        self.assertEqual( 'Rockefeller Library', context.exception.suggestions[0] )
+        self.assertTrue( 'close matches' in str(context.exception) )
+        self.assertTrue( isinstance(context.exception, KeyError) )
+
+    def test_resolve__unknown_key_no_suggestion(self):
+        resolver = MappingResolver( mapper.ALMA_PICKUP_TO_GFA_DELIVERY, 'alma pickup-library', suggest=False )
+        with self.assertRaises( UnknownMappingKeyError ) as context:
+            resolver.resolve( 'Rockefeler Libary' )
+        self.assertEqual( [], context.exception.suggestions )
+
+    def test_conflicting_keys(self):
+        with self.assertRaises( ValueError ):
+            MappingResolver( {'ROCK': 'RO', 'rock ': 'SC'}, 'test mapping' )
+
+    ## end class ResolverTest()
+
+
+class MappingConfigTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        self.config_path = f'{self.temp_dir}/mapping_config.json'
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+
+    ## -- tests ---------------------------------
+
+    def test_builtin_tables(self):
+        tables = MappingConfig( '' ).get_tables()
+        self.assertEqual( 'RO', tables.pickup_library_resolver.resolve('Rockefeller Library') )
+        self.assertEqual( 'QH', tables.gfa_delivery_to_gfa_location['EH'] )
+        with self.assertRaises( TypeError ):
+            tables.gfa_delivery_to_gfa_location['EH'] = 'QS'   # frozen
+
+    def test_invalid_code_rejected(self):
+        with self.assertRaises( ValueError ) as context:
+            MappingTables( {'Rockefeller Library': 'XX'}, {'ROCK': 'QS'}, {'ED': 'QS'} )
+        self.assertTrue( 'XX' in str(context.exception) )
+        with self.assertRaises( ValueError ):
+            MappingTables( {'Rockefeller Library': 'RO'}, {'ROCK': 'QS'}, {'ZZ': 'QS'} )
+
+    def test_reload_on_mtime_change(self):
+        self.write_config( {'alma_pickup_to_gfa_delivery': {'Rockefeller Library': 'RO'}}, mtime=1000 )
+        mapping_config = MappingConfig( self.config_path )
+        tables_a = mapping_config.get_tables()
+        self.assertEqual( 'RO', tables_a.pickup_library_resolver.resolve('Rockefeller Library') )
+        self.assertTrue( mapping_config.get_tables() is tables_a )   # unchanged mtime, no reload
+        self.write_config( {'alma_pickup_to_gfa_delivery': {'Rockefeller Library': 'SC'}}, mtime=2000 )
+        tables_b = mapping_config.get_tables()
+        self.assertEqual( 'SC', tables_b.pickup_library_resolver.resolve('Rockefeller Library') )
+        self.assertNotEqual( tables_a.version, tables_b.version )
+        ## a bad edit keeps the previous tables
+        self.write_config( {'alma_pickup_to_gfa_delivery': {'Rockefeller Library': 'XX'}}, mtime=3000 )
+        self.assertTrue( mapping_config.get_tables() is tables_b )
+
+    def test_parser_uses_config_overrides(self):
+        self.write_config( {'gfa_delivery_to_gfa_location': {'ED': 'QS', 'EH': 'QH', 'RO': 'QH'}}, mtime=1000 )
+        prsr = Parser( mapping_config=MappingConfig(self.config_path) )
+        self.assertEqual( ('QH', None), prsr.transform_parsed_alma_library_code('ROCK', 'RO') )
+        self.assertEqual( ('QS', None), prsr.transform_parsed_alma_library_code('SCIENCE', 'SC') )
+
+    ## -- helpers -------------------------------
+
+    def write_config( self, data, mtime ):
+        with open( self.config_path, 'w' ) as f:
+            json.dump( data, f )
+        os.utime( self.config_path, (mtime, mtime) )
+        return
+
+    ## end class MappingConfigTest()
+
+
+class StorageTest( unittest.TestCase ):
+    """ Runs the same checks against each backend; the S3 checks use moto's in-process stand-in, and are skipped without boto3 & moto. """
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+
+    ## -- tests ---------------------------------
+
+    def test_local_storage(self):
+        self.check_backend( LocalStorage(), self.temp_dir )
+
+    def test_memory_storage(self):
+        self.check_backend( MemoryStorage(), '/mem' )
+
+    def test_s3_storage(self):
+        try:
+            import boto3, moto
+        except ImportError:
+            self.skipTest( 'boto3 & moto not installed' )
+        with moto.mock_aws():
+            client = boto3.client( 's3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test' )
+            client.create_bucket( Bucket='annex' )
+            self.check_backend( S3Storage('annex', key_prefix='archives/', client=client), 'parsed' )
+
+    def test_archiver_with_memory_storage(self):
+        storage = MemoryStorage()
+        arcvr = Archiver( storage=storage )
+        storage.put( '/source/BUL_ANNEX-foo.xml', b'<xml/>' )
+        storage.put( '/source/notes.txt', b'x' )
+        self.assertEqual( ('BUL_ANNEX-foo.xml', None), arcvr.check_for_new_file('/source') )
+        self.assertEqual( None, arcvr.send_gfa_data_file('"a","b"\n', '1960-02-02T08-15-00', '/gfa_data') )
+        self.assertEqual( '"a","b"\n', storage.open_stream('/gfa_data/REQ-PARSED_1960-02-02T08-15-00.dat').read().decode('utf-8') )
+        self.assertEqual( None, arcvr.delete_original('/source/BUL_ANNEX-foo.xml') )
+        self.assertEqual( ['notes.txt'], storage.list('/source') )
+
+    ## -- helpers -------------------------------
+
+    def check_backend( self, storage, dir_path ):
+        storage.put( f'{dir_path}/a.dat', b'alpha' )
+        storage.put( f'{dir_path}/b.dat', io.BytesIO(b'beta') )
+        storage.put_many( [ (f'{dir_path}/c{i}.dat', b'c') for i in range(3) ] )
+        self.assertEqual( ['a.dat', 'b.dat', 'c0.dat', 'c1.dat', 'c2.dat'], sorted(storage.list(dir_path)) )
+        self.assertEqual( {'a.dat': 5, 'b.dat': 4}, {name: stat_result.size for ( name, stat_result ) in storage.list_stats(dir_path, name_filter=lambda name: name < 'c').items()} )
+        with storage.open_stream( f'{dir_path}/b.dat' ) as stream:
+            self.assertEqual( b'beta', stream.read() )
+        self.assertEqual( 5, storage.stat(f'{dir_path}/a.dat').size )
+        self.assertEqual( None, storage.stat(f'{dir_path}/missing.dat') )
+        storage.copy( f'{dir_path}/a.dat', f'{dir_path}/a-copy.dat', link=True )
+        with storage.open_stream( f'{dir_path}/a-copy.dat' ) as stream:
+            self.assertEqual( b'alpha', stream.read() )
+        local_filepath = f'{self.temp_dir}/local.xml'
+        with open( local_filepath, 'wb' ) as f:
+            f.write( b'<xml/>' )
+        storage.put_file( local_filepath, f'{dir_path}/orig.xml' )
+        self.assertEqual( 6, storage.stat(f'{dir_path}/orig.xml').size )
+        storage.delete_many( [f'{dir_path}/c{i}.dat' for i in range(3)] + [f'{dir_path}/local.xml'] )
+        storage.delete( f'{dir_path}/missing.dat' )   # not an error
+        self.assertEqual( ['a-copy.dat', 'a.dat', 'b.dat', 'orig.xml'], sorted(storage.list(dir_path)) )
+
+    ## end class StorageTest()
+
+
+class MemoryProfilerTest( unittest.TestCase ):
+
+    def test_disabled_records_nothing(self):
+        profiler = MemoryProfiler()
+        profiler.start()
+        profiler.stage( 'start' )
+        self.assertEqual( ( [], False ), ( profiler.stages, tracemalloc.is_tracing() ) )
+
+    def test_stages_and_growth(self):
+        profiler = MemoryProfiler( enabled=True, top_n=3 )
+        profiler.start()
+        try:
+            profiler.stage( 'start' )
+            held = [ bytearray(1000) for i in range(1000) ]   # ~1 MiB, allocated on this line
+            profiler.stage( 'allocated' )
+        finally:
+            profiler.stop()
+        self.assertEqual( ['start', 'allocated'], [ stage[0] for stage in profiler.stages ] )
+        self.assertTrue( profiler.stages[1][2] - profiler.stages[0][2] > 1000 * 1000 )
+        report = profiler.make_report()
+        self.assertTrue( 'stage `allocated`' in report )
+        growth_lines = report.split( 'growth since previous stage:' )[1].split( 'top allocation sites:' )[0]
+        self.assertTrue( 'tests.py' in growth_lines.strip().splitlines()[0] )   # the largest growth is the list-comprehension above
+        del held
+
+    ## end class MemoryProfilerTest()
+
+
+class CpuProfilerTest( unittest.TestCase ):
+
+    def test_every_nth_run(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            due = [ CpuProfiler(enabled=True, every_n_runs=3, counter_filepath=f'{temp_dir}/count.txt').is_due() for i in range(6) ]
+            self.assertEqual( [False, False, True, False, False, True], due )
+        finally:
+            shutil.rmtree( temp_dir )
+
+    def test_disabled_never_profiles(self):
+        profiler = CpuProfiler()
+        profiler.start()
+        profiler.stop()
+        self.assertEqual( ( None, None ), ( profiler.profile, profiler.write_stats('/no/such/dir/x.pstats') ) )
+
+    ## end class CpuProfilerTest()
+
+
+class EngineHarnessTest( unittest.TestCase ):
+
+    def test_every_engine_matches_reference(self):
+        corpus = collect_corpus( [TEST_DIRS_PATH], synthetic_record_counts=(200,) )
+        self.assertTrue( any('BUL_ANNEX-sample.xml' in label for ( label, text ) in corpus) )
+        report = compare_engines( corpus, repeat=1 )
+        self.assertEqual( sorted(PARSER_ENGINES), sorted(report) )
+        for ( engine_name, engine_report ) in report.items():
+            self.assertEqual( (engine_name, []), (engine_name, engine_report['mismatches']) )
+
+    def test_bytes_input_matches_text(self):
+        """ Bytes are decoded by the xml-engine, per the BOM or xml-declaration. """
+        text = make_synthetic_text( 100 ).replace( '東京', 'Tokyo' )
+        latin_1_text = text.encode( 'latin-1', 'replace' ).decode( 'latin-1' )
+        for engine_name in sorted( PARSER_ENGINES ):
+            for ( reference_text, file_bytes ) in [
+                    ( text, text.encode('utf-8') ),
+                    ( text, b'\xef\xbb\xbf\n' + text.encode('utf-8') ),
+                    ( text, text.replace('encoding="utf-8"', 'encoding="utf-16"').encode('utf-16') ),
+                    ( latin_1_text, latin_1_text.replace('encoding="utf-8"', 'encoding="iso-8859-1"').encode('latin-1') ) ]:
+                self.assertEqual( [], compare_results(run_engine(REFERENCE_ENGINE, reference_text), run_engine(engine_name, file_bytes)) )
+
+    def test_mismatch_reported_by_field(self):
+        text = make_synthetic_text( 20 )
+        reference_results = run_engine( 'bs4', text )
+        engine_results = run_engine( 'lxml', text )
+        index = [ result[1] != None for result in engine_results ].index( True )
+        engine_results[index][1].patron_note = 'changed'
+        self.assertEqual( [f"item {index}: patron_note: {reference_results[index][1].patron_note!r} != 'changed'"], compare_results(reference_results, engine_results) )
+
+    ## end class EngineHarnessTest()
+
+
+class PreflightTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        self.preflight = Preflight()
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+
+    ## -- tests ---------------------------------
+
+    def test_sample_passes(self):
+        ( report, err ) = self.preflight.check_file( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml' )
+        self.assertEqual( ( True, 12, [], None ), ( report['passed'], report['record_count'], report['problems'], err ) )
+
+    def test_truncated_file_rejected(self):
+        with open( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml', encoding='utf-8' ) as f:
+            text = f.read()
+        filepath = self.write_file( text[0:len(text) // 2] )
+        ( report, err ) = self.preflight.check_file( filepath )
+        self.assertEqual( ( False, False, None ), ( report['passed'], report['well_formed'], err ) )
+        self.assertTrue( report['problems'][0].startswith('not well-formed xml: ') )
+
+    def test_missing_required_elements(self):
+        with open( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml', encoding='utf-8' ) as f:
+            text = f.read()
+        text = text.replace( '<xb:barcode>31236011508853</xb:barcode>', '', 1 )   # record 1
+        text = text.replace( '<xb:libraryCode>HAY</xb:libraryCode>', '', 1 )   # a physical request, whose delivery-stop doesn't decide the location
+        text = text.replace( '<xb:library>Sciences Library</xb:library>', '' )
+        ( report, err ) = self.preflight.check_file( self.write_file(text) )
+        self.assertEqual( ( False, True, 12 ), ( report['passed'], report['well_formed'], report['record_count'] ) )
+        self.assertEqual( 3, len(report['problems']) )
+        self.assertTrue( report['problems'][0].startswith('record 1 (line 4): missing `barcode`') )
+        self.assertTrue( '`libraryCode`' in report['problems'][1] )
+        self.assertTrue( '`pickup/library`' in report['problems'][2] )
+        self.assertTrue( 'REJECTED' in self.preflight.format_report(report) )
+
+    def test_bom_and_blank_line_passes(self):
+        with open( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml', encoding='utf-8' ) as f:
+            text = f.read()
+        filepath = self.write_file( '\ufeff\n' + text.lstrip() )
+        ( report, err ) = self.preflight.check_file( filepath )
+        self.assertEqual( ( True, 12, [], None ), ( report['passed'], report['record_count'], report['problems'], err ) )
+
+    def test_faster_than_full_parse(self):
+        filepath = self.write_file( make_synthetic_text(2000) )
+        start_time = time.perf_counter()
+        ( report, err ) = self.preflight.check_file( filepath )
+        preflight_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        prsr = Parser()
+        ( items, err ) = prsr.make_item_list( prsr.load_file(filepath)[0] )
+        for item in items:
+            prsr.parse_alma_request( item )
+        full_parse_seconds = time.perf_counter() - start_time
+        self.assertEqual( 2000, report['record_count'] )
+        self.assertTrue( preflight_seconds < full_parse_seconds / 4, (preflight_seconds, full_parse_seconds) )
+
+    ## -- helpers -------------------------------
+
+    def write_file( self, text ):
+        filepath = f'{self.temp_dir}/BUL_ANNEX-test.xml'
+        with open( filepath, 'w', encoding='utf-8' ) as f:
+            f.write( text )
+        return filepath
+
+    ## end class PreflightTest()
+
+
+class StatusServerTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.run_status = RunStatus()
+        self.run_status.start_run( '/source/BUL_ANNEX-foo.xml', 'abc123' )
+        self.run_status.set_stage( 'loaded' )
+        self.run_status.set_pending_file_count( 2 )
+        self.run_status.set_spool_depth( 3 )
+
+    ## -- tests ---------------------------------
+
+    def test_tcp(self):
+        server = StatusServer( self.run_status, port=0 )
+        server.start()
+        try:
+            base_url = f'http://127.0.0.1:{server.address[1]}'
+            with urllib.request.urlopen( f'{base_url}/healthz' ) as response:
+                self.assertEqual( {'alive': True}, json.loads(response.read()) )
+            with urllib.request.urlopen( f'{base_url}/status' ) as response:
+                status = json.loads( response.read() )
+            self.assertEqual( ( {'file': '/source/BUL_ANNEX-foo.xml', 'stage': 'loaded'}, 2, 3, 'abc123' ), ( status['in_flight'], status['pending_file_count'], status['spool_depth'], status['mapping_version'] ) )
+            self.run_status.finish_run( '1960-02-02T08-15-00', 'ok', record_count=100, seconds=2.0 )
+            with urllib.request.urlopen( f'{base_url}/status' ) as response:
+                status = json.loads( response.read() )
+            self.assertEqual( ( '1960-02-02T08-15-00', 'ok', None, 50.0 ), ( status['last_run_stamp'], status['last_run_result'], status['in_flight'], status['records_per_second'] ) )
+            with self.assertRaises( urllib.error.HTTPError ):
+                urllib.request.urlopen( f'{base_url}/nope' )
+        finally:
+            server.stop()
+
+    def test_unix_socket(self):
+        socket_path = f'{tempfile.mkdtemp()}/status.sock'
+        server = StatusServer( self.run_status, unix_socket_path=socket_path )
+        server.start()
+        try:
+            client_socket = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+            client_socket.connect( socket_path )
+            client_socket.sendall( b'GET /healthz HTTP/1.0\r\n\r\n' )
+            response = b''
+            while chunk := client_socket.recv( 4096 ):
+                response += chunk
+            client_socket.close()
+            self.assertTrue( response.startswith(b'HTTP/1.0 200') )
+            self.assertEqual( {'alive': True}, json.loads(response.split(b'\r\n\r\n', 1)[1]) )
+        finally:
+            server.stop()
+        self.assertFalse( os.path.exists(socket_path) )
+        shutil.rmtree( os.path.dirname(socket_path) )
+
+    ## end class StatusServerTest()
+
+
+class RollupTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = RollupStore( f'{self.temp_dir}/rollup.sqlite' )
+
+    def tearDown( self ):
+        self.store.close()
+        shutil.rmtree( self.temp_dir )
+
+    ## -- tests ---------------------------------
+
+    def test_add_and_report(self):
+        ( added, err ) = self.store.add_file_counts( '2021-08-02T09-00-00', {make_rollup_key('RO', 'QS', 'PATRON_PHYSICAL'): 3, make_rollup_key('EH', 'QH', 'PHYSICAL_TO_DIGITIZATION'): 1} )
+        self.assertEqual( (True, None), (added, err) )
+        self.store.add_file_counts( '2021-08-02T15-30-00', {make_rollup_key('RO', 'QS', 'PATRON_PHYSICAL'): 2} )
+        self.store.add_file_counts( '2021-09-01T09-00-00', {make_rollup_key('RO', 'QS', ''): 4} )
+        self.assertEqual( (False, None), self.store.add_file_counts('2021-08-02T09-00-00', {make_rollup_key('RO', 'QS', 'PATRON_PHYSICAL'): 3}) )   # already rolled up
+        ( rows, err ) = self.store.report( 'day', start_day='2021-08-01', end_day='2021-08-31' )
+        self.assertEqual( [
+            {'day': '2021-08-02', 'gfa_delivery': 'EH', 'gfa_location': 'QH', 'request_type': 'PHYSICAL_TO_DIGITIZATION', 'collection': 'HAY', 'request_count': 1},
+            {'day': '2021-08-02', 'gfa_delivery': 'RO', 'gfa_location': 'QS', 'request_type': 'PATRON_PHYSICAL', 'collection': 'non-HAY', 'request_count': 5} ], rows )
+        ( rows, err ) = self.store.report( 'month', dimensions=['collection'] )
+        self.assertEqual( [('2021-08', 'HAY', 1), ('2021-08', 'non-HAY', 5), ('2021-09', 'non-HAY', 4)], [tuple(row.values()) for row in rows] )
+        self.assertTrue( rollup.format_report(rows, 'month', ['collection']).splitlines()[-1].endswith('10') )   # the total line
+        self.assertEqual( ([], "AssertionError()"), self.store.report('day', dimensions=['patron_name']) )
+
+    def test_backfill(self):
+        parsed_dir = f'{self.temp_dir}/parsed'
+        os.mkdir( parsed_dir )
+        for ( stamp, lines ) in [ ('2021-08-02T09-00-00', ['"1","b1","RO","QS","n","p","t","d",""', '"2","b2","HA","QH","n","p","t","d",""']), ('2021-08-03T09-00-00', ['"3","b3","SC","QS","n","p","t","d",""']) ]:
+            with open( f'{parsed_dir}/REQ-ALMA-PARSED_{stamp}.dat', 'w' ) as f:
+                f.write( '\n'.join(lines) + '\n' )
+        with open( f'{parsed_dir}/REQ-ALMA-PARSED_2021-08-02T09-00-00.jsonl', 'w' ) as f:   # the first file has a sidecar; the second has nothing
+            f.write( '{"request_type":"PATRON_PHYSICAL"}\n{"request_type":"HOLD"}\n' )
+        ( summary, err ) = rollup.backfill( self.store, parsed_dir )
+        self.assertEqual( ( {'added': 2, 'skipped': 0, 'request_count': 3, 'unknown_request_types': 1}, None ), ( summary, err ) )
+        ( rows, err ) = self.store.report( 'month', dimensions=['request_type'] )
+        self.assertEqual( [('2021-08', 'HOLD', 1), ('2021-08', 'PATRON_PHYSICAL', 1), ('2021-08', 'UNKNOWN', 1)], [tuple(row.values()) for row in rows] )
+        self.assertEqual( 2, rollup.backfill(self.store, parsed_dir)[0]['skipped'] )
+
+    ## end class RollupTest()
+
+
+class HistoryTest( unittest.TestCase ):
+    """ Skipped without pyarrow, the history store's optional dependency. """
+
+    def setUp( self ):
+        if history.pyarrow == None:
+            self.skipTest( 'pyarrow not installed' )
+        self.temp_dir = tempfile.mkdtemp()
+        ( self.parsed_dir, self.history_dir ) = ( f'{self.temp_dir}/parsed', f'{self.temp_dir}/history' )
+        os.mkdir( self.parsed_dir )
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+
+    ## -- tests ---------------------------------
+
+    def test_incremental_compaction(self):
+        self.write_run( '2021-08-02T09-00-00', [('1', 'RO', 'QS'), ('2', 'HA', 'QH')], sidecar_request_types=['PATRON_PHYSICAL', 'PATRON_PHYSICAL'] )
+        self.write_run( '2021-09-01T09-00-00', [('3', 'RO', 'QS')] )
+        self.assertEqual( ( {'runs_added': 2, 'rows_added': 3, 'months_written': ['2021-08', '2021-09']}, None ), history.compact(self.history_dir, self.parsed_dir) )
+        self.write_run( '2021-09-02T09-00-00', [('4', 'SC', 'QS')], sidecar_request_types=['PHYSICAL_TO_DIGITIZATION'] )
+        self.assertEqual( ( {'runs_added': 1, 'rows_added': 1, 'months_written': ['2021-09']}, None ), history.compact(self.history_dir, self.parsed_dir) )   # only the new run's month is rewritten
+        self.assertEqual( 0, history.compact(self.history_dir, self.parsed_dir)[0]['runs_added'] )
+        self.assertEqual( ['month=2021-08', 'month=2021-09'], sorted(os.listdir(self.history_dir)) )
+        table = history.open_history( self.history_dir ).to_table( columns=['item_barcode', 'request_type', 'request_date'], filter=history.pyarrow.dataset.field('month') == '2021-09' )
+        self.assertEqual( [
+            {'item_barcode': 'b3', 'request_type': '', 'request_date': datetime.date(2021, 9, 1)},
+            {'item_barcode': 'b4', 'request_type': 'PHYSICAL_TO_DIGITIZATION', 'request_date': datetime.date(2021, 9, 2)} ], table.to_pylist() )
+        parquet_schema = history.pyarrow.parquet.ParquetFile( f'{self.history_dir}/month=2021-09/requests.parquet' ).metadata.row_group(0)
+        gfa_location_column = [ parquet_schema.column(index) for index in range(parquet_schema.num_columns) if parquet_schema.column(index).path_in_schema == 'gfa_location' ][0]
+        self.assertTrue( any('DICTIONARY' in encoding for encoding in gfa_location_column.encodings) )
+        self.assertEqual( [{'gfa_delivery': 'RO', 'request_count': 2}, {'gfa_delivery': 'HA', 'request_count': 1}, {'gfa_delivery': 'SC', 'request_count': 1}], history.count_by(self.history_dir, ['gfa_delivery']) )
+
+    ## -- helpers -------------------------------
+
+    def write_run( self, datetime_stamp, entries, sidecar_request_types=None ):
+        """ Writes a parsed-data archive of (item_id, gfa_delivery, gfa_location) entries, and optionally its json-lines sidecar. """
+        with open( f'{self.parsed_dir}/REQ-ALMA-PARSED_{datetime_stamp}.dat', 'w' ) as f:
+            f.write( ''.join(f'"{item_id}","b{item_id}","{delivery}","{location}","n","p","title {item_id}","d",""\n' for ( item_id, delivery, location ) in entries) )
+        if sidecar_request_types:
+            with open( f'{self.parsed_dir}/REQ-ALMA-PARSED_{datetime_stamp}.jsonl', 'w' ) as f:
+                f.write( ''.join(json.dumps({'request_type': request_type, 'alma_pickup_library': 'Rockefeller Library'}) + '\n' for request_type in sidecar_request_types) )
+        return
+
+    ## end class HistoryTest()
+
+
+class RetentionTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        self.pruner = Pruner( batch_size=2, now=datetime.datetime(2021, 9, 1, 12, 0, 0) )
+        for day in range( 1, 6 ):   # five runs, 2021-08-01 to 2021-08-05
+            for suffix in ( '.dat', '.jsonl' ):
+                with open( f'{self.temp_dir}/REQ-ALMA-PARSED_2021-08-0{day}T09-00-00{suffix}', 'w' ) as f:
+                    f.write( 'x' * 100 )
+        for name in ( 'REQ-ALMA-QUARANTINE_2021-08-01T09-00-00.xml', 'notes.txt' ):   # never pruned
+            with open( f'{self.temp_dir}/{name}', 'w' ) as f:
+                f.write( 'x' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+
+    ## -- tests ---------------------------------
+
+    def test_parse_file_stamp(self):
+        self.assertEqual( '2021-07-13T13-41-39', parse_file_stamp('REQ-PARSED_2021-07-13T13-41-39_002.cnt') )
+        self.assertEqual( ['', ''], [parse_file_stamp('REQ-ALMA-REJECTED_2021-07-13T13-41-39.xml'), parse_file_stamp('BUL_ANNEX-foo.xml')] )
+
+    def test_plan(self):
+        ( plan, err ) = self.pruner.plan( self.temp_dir, {'max_age_days': 29} )   # cutoff 2021-08-03T12-00-00
+        self.assertEqual( ( 5, ['2021-08-01T09-00-00', '2021-08-02T09-00-00', '2021-08-03T09-00-00'], 6 ), ( plan['run_count'], plan['prune_stamps'], len(plan['prune_paths']) ) )
+        self.assertEqual( ['2021-08-01T09-00-00', '2021-08-02T09-00-00'], self.pruner.plan(self.temp_dir, {'max_count': 3})[0]['prune_stamps'] )
+        ( plan, err ) = self.pruner.plan( self.temp_dir, {'max_total_bytes': 450} )   # two 200-byte runs fit
+        self.assertEqual( ( ['2021-08-01T09-00-00', '2021-08-02T09-00-00', '2021-08-03T09-00-00'], 400 ), ( plan['prune_stamps'], plan['kept_bytes'] ) )
+        ( plan, err ) = self.pruner.plan( self.temp_dir, {'max_count': 3}, keep_stamps={'2021-08-01T09-00-00'} )
+        self.assertEqual( ( ['2021-08-02T09-00-00'], 1 ), ( plan['prune_stamps'], plan['kept_unindexed'] ) )
+        self.assertEqual( ({}, "AssertionError(\"unknown retention rule in ``{'max_days': 1}``\")"), self.pruner.plan(self.temp_dir, {'max_days': 1}) )
+
+    def test_prune_in_bounded_batches(self):
+        ( plan, err ) = self.pruner.plan( self.temp_dir, {'max_count': 2} )
+        self.assertEqual( (4, None), self.pruner.prune(plan, max_batches=2) )   # 2 batches of 2 files
+        ( plan, err ) = self.pruner.plan( self.temp_dir, {'max_count': 2} )   # the next invocation picks up the rest
+        self.assertEqual( (2, None), self.pruner.prune(plan) )
+        self.assertEqual( 6, len(os.listdir(self.temp_dir)) )   # 2 runs' files, the quarantine file & notes.txt
+
+    def test_run_retention__keeps_unrolled_runs(self):
+        original_environ = dict( os.environ )
+        os.environ['ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY'] = self.temp_dir
+        try:
+            store = rollup.RollupStore( f'{self.temp_dir}/rollup.sqlite' )
+            for day in ( 1, 2, 3 ):
+                store.add_file_counts( f'2021-08-0{day}T09-00-00', {} )
+            store.add_file_counts( '2021-08-05T09-00-00', {} )
+            store.close()
+            ( report_lines, err ) = run_retention( {'archived_parsed': {'max_count': 1}}, dry_run=True, rollup_db_path=f'{self.temp_dir}/rollup.sqlite', pruner=self.pruner )
+            self.assertEqual( [ f'{self.temp_dir}: 5 run(s); would prune 3 run(s), 6 file(s), 2021-08-01T09-00-00 to 2021-08-03T09-00-00; kept 1 run(s) not yet in the rollup/history stores' ], report_lines )
+            self.assertEqual( 13, len(os.listdir(self.temp_dir)) )   # dry-run deletes nothing
+            run_retention( {'archived_parsed': {'max_count': 1}}, dry_run=False, rollup_db_path=f'{self.temp_dir}/rollup.sqlite', pruner=self.pruner )
+            self.assertEqual( ['2021-08-04T09-00-00', '2021-08-05T09-00-00'], sorted(set(parse_file_stamp(name) for name in os.listdir(self.temp_dir)) - {''}) )
+            self.assertEqual( ( [], "unknown retention directory, ``source``; expected one of ``['archived_originals', 'archived_parsed', 'gfa_count', 'gfa_data', 'manifests']``" ), run_retention({'source': {'max_count': 1}}) )
+        finally:
+            os.environ.clear()
+            os.environ.update( original_environ )
+
+    ## end class RetentionTest()
+
+
+class SoakTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        self.original_environ = dict( os.environ )
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+        os.environ.clear()
+        os.environ.update( self.original_environ )
+
+    ## -- tests ---------------------------------
+
+    def test_resident(self):
+        harness = SoakHarness( self.temp_dir, mode='resident', rate_per_minute=600, median_records=20, size_sigma=0.5, poll_seconds=0.05, sample_seconds=0.05, max_drops=3 )
+        ( report, err ) = harness.run( duration_seconds=5, drain_timeout_seconds=30 )
+        self.assertEqual( ( None, 3, 3, 0 ), ( err, report['dropped'], report['processed'], report['unmatched'] ) )
+        self.assertTrue( 0 <= report['latency_seconds']['p50'] <= report['latency_seconds']['max'] )
+        self.assertTrue( report['max_backlog'] >= 1 and report['samples'] )
+        self.assertEqual( [], os.listdir(f'{self.temp_dir}/source') )
+        self.assertEqual( self.original_environ, dict(os.environ) )   # env-settings restored
+
+    def test_cron(self):
+        harness = SoakHarness( self.temp_dir, mode='cron', rate_per_minute=600, median_records=20, size_sigma=0.5, cron_interval_seconds=0.05, sample_seconds=0.05, max_drops=2 )
+        ( report, err ) = harness.run( duration_seconds=5, drain_timeout_seconds=30 )
+        self.assertEqual( ( None, 2, 0 ), ( err, report['processed'], report['unmatched'] ) )
+        self.assertIn( 'latency (drop to count-file)', soak.format_report(report) )
+
+    def test_outer_stores_untouched(self):
+        """ Stores configured in the operator's env-settings are moved into the work-directory; the outer ones stay untouched. """
+        outer_dir = f'{self.temp_dir}/outer'
+        for dir_name in ( 'manifests', 'spool', 'profiles' ):
+            os.makedirs( f'{outer_dir}/{dir_name}' )
+        os.environ.update( {
+            'ANX_ALMA__ROLLUP_DB_PATH': f'{outer_dir}/rollup.sqlite', 'ANX_ALMA__PATH_TO_MANIFEST_DIRECTORY': f'{outer_dir}/manifests',
+            'ANX_ALMA__PATH_TO_SPOOL_DIRECTORY': f'{outer_dir}/spool', 'ANX_ALMA__PATH_TO_PROFILE_DIRECTORY': f'{outer_dir}/profiles',
+            'ANX_ALMA__STORAGE_BACKEND': 's3', 'ANX_ALMA__STATUS_SOCKET_PATH': f'{outer_dir}/status.sock' } )
+        work_dir = f'{self.temp_dir}/work'
+        harness = SoakHarness( work_dir, mode='cron', rate_per_minute=600, median_records=20, size_sigma=0.5, cron_interval_seconds=0.05, sample_seconds=0.05, max_drops=2 )
+        ( report, err ) = harness.run( duration_seconds=5, drain_timeout_seconds=30 )
+        self.assertEqual( ( None, 2 ), ( err, report['processed'] ) )
+        self.assertEqual( ['manifests', 'profiles', 'spool'], sorted(os.listdir(outer_dir)) )
+        self.assertEqual( ( [], [], [] ), tuple(os.listdir(f'{outer_dir}/{dir_name}') for dir_name in ('manifests', 'profiles', 'spool')) )
+        self.assertEqual( 2, len(os.listdir(f'{work_dir}/manifests')) )   # the stores still run, inside the work-directory
+        self.assertTrue( os.path.exists(f'{work_dir}/rollup.sqlite') )
+
+    ## end class SoakTest()
+
+
+class SchedulerTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        self.base_settings = { 'ANX_ALMA__DEV_MODE': 'false', 'ANX_ALMA__NEW_FILE_QUIET_SECONDS': '0' }
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+
+    def test_load_profiles__rejects_bad_configs(self):
+        with self.assertRaises( ValueError ):
+            scheduler.load_profiles( {'profiles': []}, self.base_settings )
+        with self.assertRaises( ValueError ):   # two profiles can't share a source-directory
+            scheduler.load_profiles( {'profiles': [self.make_profile_config('a'), dict(self.make_profile_config('b'), settings=self.make_profile_config('a')['settings'])]}, self.base_settings )
+        with self.assertRaises( ValueError ):   # concurrent turns need claim-mode
+            scheduler.load_profiles( {'profiles': [dict(self.make_profile_config('a'), max_concurrent=2, settings=dict(self.make_profile_config('a')['settings'], ANX_ALMA__CLAIM_FILES='false'))]}, self.base_settings )
+        ( profiles, max_workers, poll_seconds ) = scheduler.load_profiles( {'max_workers': 3, 'profiles': [dict(self.make_profile_config('a'), max_concurrent=2)]}, self.base_settings )
+        self.assertEqual( ('true', 'false', 3, 30.0), (profiles[0].settings['ANX_ALMA__CLAIM_FILES'], profiles[0].settings['ANX_ALMA__DEV_MODE'], max_workers, poll_seconds) )
+
+    def test_run__round_robin_drains_every_source(self):
+        """ A backlog in one source gets one turn per rotation; every file is processed, with a stamp of its own. """
+        ( profiles, max_workers, poll_seconds ) = scheduler.load_profiles( {'profiles': [self.make_profile_config('big'), self.make_profile_config('small')]}, self.base_settings )
+        self.drop_samples( 'big', 3 )
+        self.drop_samples( 'small', 1 )
+        schdlr = scheduler.Scheduler( profiles, max_workers=1, poll_seconds=60 )
+        ( summary, err ) = schdlr.run( until_drained=True )
+        self.assertEqual( None, err )
+        self.assertEqual( ['big', 'small', 'big', 'big'], [profile_name for ( profile_name, result ) in schdlr.turn_log if result == 'ok'] )
+        self.assertEqual( ({'ok': 3, 'no file': 1, 'error': 0, 'peak_in_flight': 1}, {'ok': 1, 'no file': 1, 'error': 0, 'peak_in_flight': 1}), (summary['big'], summary['small']) )
+        self.assertEqual( (3, 1), (len(os.listdir(f'{self.temp_dir}/big/gfa_count')), len(os.listdir(f'{self.temp_dir}/small/gfa_count'))) )
+        self.assertIs( profiles[0].idle_controllers[0].mapping_config, profiles[1].idle_controllers[0].mapping_config )   # one warm mapping-config
+
+    def test_run__concurrent_turns_within_caps(self):
+        ( profiles, max_workers, poll_seconds ) = scheduler.load_profiles( {'profiles': [dict(self.make_profile_config('big'), max_concurrent=2), self.make_profile_config('small')]}, self.base_settings )
+        self.drop_samples( 'big', 3 )
+        self.drop_samples( 'small', 2 )
+        ( summary, err ) = scheduler.Scheduler( profiles, max_workers=3, poll_seconds=60 ).run( until_drained=True )
+        self.assertEqual( ((3, 2), None), ((summary['big']['ok'], summary['small']['ok']), err) )
+        self.assertEqual( (True, 1), (summary['big']['peak_in_flight'] <= 2, summary['small']['peak_in_flight']) )
+        self.assertEqual( [], [name for name in os.listdir(f'{self.temp_dir}/big/source') if name != 'processing'] )
+        worker_ids = [ controller.WORKER_ID for profile in profiles for controller in profile.idle_controllers ]
+        self.assertEqual( len(worker_ids), len(set(worker_ids)) )   # concurrent turns never share a claim-directory
+
+    ## -- helpers -------------------------------
+
+    def make_profile_config( self, name ):
+        settings = {}
+        for ( env_key, dir_name ) in [
+                ( 'ANX_ALMA__PATH_TO_SOURCE_DIRECTORY', 'source' ),
+                ( 'ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY', 'archived_originals' ),
+                ( 'ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY', 'archived_parsed' ),
+                ( 'ANX_ALMA__PATH_TO_GFA_COUNT_DIR', 'gfa_count' ),
+                ( 'ANX_ALMA__PATH_TO_GFA_DATA_DIR', 'gfa_data' ) ]:
+            os.makedirs( f'{self.temp_dir}/{name}/{dir_name}', exist_ok=True )
+            settings[env_key] = f'{self.temp_dir}/{name}/{dir_name}'
+        return { 'name': name, 'settings': settings }
+
+    def drop_samples( self, name, file_count ):
+        for file_number in range( file_count ):
+            shutil.copy2( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml', f'{self.temp_dir}/{name}/source/BUL_ANNEX-sample-{file_number}.xml' )
+        return
+
+    ## end class SchedulerTest()
+
+
+class SpoolerTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.temp_dir = tempfile.mkdtemp()
+        os.mkdir( f'{self.temp_dir}/spool' )
+        self.spooler = Spooler( f'{self.temp_dir}/spool', retry_base_seconds=30, retry_max_seconds=100 )
+
+    def tearDown( self ):
+        shutil.rmtree( self.temp_dir )
+
+    ## -- tests ---------------------------------
+
+    def test_retry_with_backoff(self):
+        destination_dir = f'{self.temp_dir}/gfa_data'   # not there yet; like an unmounted share
+        err = self.spooler.spool_delivery( 'REQ-PARSED_1960-02-02T08-15-00', [ ('REQ-PARSED_1960-02-02T08-15-00.dat', 'hello\n', destination_dir) ] )
+        self.assertEqual( None, err )
+        self.assertEqual( 1, self.spooler.depth() )
+        now = 1000.0
+        self.assertEqual( ([], None), self.spooler.deliver_pending(now=now) )
+        self.assertEqual( ([], None), self.spooler.deliver_pending(now=now + 29) )   # not due yet
+        self.assertEqual( ([], None), self.spooler.deliver_pending(now=now + 30) )   # 2nd failure; next wait doubles
+        with open( f'{self.temp_dir}/spool/REQ-PARSED_1960-02-02T08-15-00/state.json' ) as f:
+            state = json.load( f )
+        self.assertEqual( ( 2, now + 30 + 60 ), ( state['attempts'], state['next_attempt_at'] ) )
+        self.assertEqual( 100, self.spooler.backoff_seconds(10) )   # capped
+        os.mkdir( destination_dir )
+        self.assertEqual( (['REQ-PARSED_1960-02-02T08-15-00'], None), self.spooler.deliver_pending(now=now + 90) )
+        self.assertEqual( 0, self.spooler.depth() )
+        with open( f'{destination_dir}/REQ-PARSED_1960-02-02T08-15-00.dat' ) as f:
+            self.assertEqual( 'hello\n', f.read() )
+
+    def test_overlapping_passes(self):
+        """ Passes from several spoolers at once -- like overlapping runs -- deliver each delivery exactly once, without errs. """
+        destination_dir = f'{self.temp_dir}/gfa_data'
+        os.mkdir( destination_dir )
+        delivery_names = [ f'REQ-PARSED_1960-02-02T08-15-{number:02}' for number in range(40) ]
+        for delivery_name in delivery_names:
+            self.spooler.spool_delivery( delivery_name, [ (f'{delivery_name}.dat', 'hello\n' * 1000, destination_dir) ] )
+        results = []
+        def run_pass():
+            results.append( Spooler(f'{self.temp_dir}/spool').deliver_pending() )
+        threads = [ threading.Thread(target=run_pass) for _ in range(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual( [None] * 4, [err for ( delivered_names, err ) in results] )
+        self.assertEqual( delivery_names, sorted(name for ( delivered_names, err ) in results for name in delivered_names) )
+        self.assertEqual( 0, self.spooler.depth() )
+
+    ## end class SpoolerTest()
+
+
+class ControllerTest( unittest.TestCase ):
+
+    def setUp( self ):
+        """ Points the controller's env-settings at a fresh temp-directory tree. """
+        self.temp_dir = tempfile.mkdtemp()
+        self.original_environ = dict( os.environ )
+        self.dirs = {}
+        for ( env_key, dir_name ) in [
+                ( 'ANX_ALMA__PATH_TO_SOURCE_DIRECTORY', 'source' ),
+                ( 'ANX_ALMA__PATH_TO_ARCHIVED_ORIGINALS_DIRECTORY', 'archived_originals' ),
+                ( 'ANX_ALMA__PATH_TO_ARCHIVED_PARSED_DIRECTORY', 'archived_parsed' ),
+                ( 'ANX_ALMA__PATH_TO_GFA_COUNT_DIR', 'gfa_count' ),
+                ( 'ANX_ALMA__PATH_TO_GFA_DATA_DIR', 'gfa_data' ),
+                ( 'ANX_ALMA__PATH_TO_QUARANTINE_DIRECTORY', 'quarantine' ) ]:
+            dir_path = f'{self.temp_dir}/{dir_name}'
+            os.mkdir( dir_path )
+            os.environ[env_key] = dir_path
+            self.dirs[dir_name] = dir_path
+        os.environ['ANX_ALMA__DEV_MODE'] = 'false'
+        os.environ['ANX_ALMA__NEW_FILE_QUIET_SECONDS'] = '0'
+
+    def tearDown( self ):
+        os.environ.clear()
+        os.environ.update( self.original_environ )
+        shutil.rmtree( self.temp_dir )
+
+    ## -- tests ---------------------------------
+
+    def test_process_requests__bad_record_raises(self):
+        self.drop_sample( replacements=[('<xb:library>Sciences Library</xb:library>', '<xb:library>Unknown Pickup Library</xb:library>')] )
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'false'
+        with self.assertRaises( Exception ):
+            Controller().process_requests()
+        self.assertEqual( ['BUL_ANNEX-sample.xml'], os.listdir(self.dirs['source']) )   # original stays for the next run
+        self.assertEqual( [], os.listdir(self.dirs['gfa_data']) )
+
+    def test_process_requests__bad_record_quarantined(self):
+        self.drop_sample( replacements=[('<xb:library>Sciences Library</xb:library>', '<xb:library>Unknown Pickup Library</xb:library>')] )
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'true'
+        Controller().process_requests()
+        self.assertEqual( [], os.listdir(self.dirs['source']) )   # file counts as done
+        ## good records go on to GFA
+        self.assertEqual( 11, len(self.read_gfa_data_lines()) )
+        count_file_names = os.listdir( self.dirs['gfa_count'] )
+        with open( f'{self.dirs["gfa_count"]}/{count_file_names[0]}' ) as f:
+            self.assertEqual( '11\n', f.read() )
+        ## bad record, with reason, goes to quarantine
+        quarantine_file_names = os.listdir( self.dirs['quarantine'] )
+        self.assertEqual( 1, len(quarantine_file_names) )
+        self.assertTrue( quarantine_file_names[0].startswith('REQ-ALMA-QUARANTINE_') )
+        with open( f'{self.dirs["quarantine"]}/{quarantine_file_names[0]}' ) as f:
+            quarantined_text = f.read()
+        self.assertTrue( 'Unknown Pickup Library' in quarantined_text )
+        self.assertEqual( 1, quarantined_text.count('quarantine-reason:') )
+
+    def test_process_requests__claim_mode(self):
+        self.drop_sample()
+        os.environ['ANX_ALMA__CLAIM_FILES'] = 'true'
+        os.environ['ANX_ALMA__WORKER_ID'] = 'worker-a'
+        Controller().process_requests()
+        self.assertEqual( ['processing'], os.listdir(self.dirs['source']) )
+        self.assertEqual( [], os.listdir(f'{self.dirs["source"]}/processing') )
+        self.assertEqual( 12, len(self.read_gfa_data_lines()) )
+
+    def test_process_requests__claim_mode_failure_releases_claim(self):
+        self.drop_sample( replacements=[('<xb:library>Sciences Library</xb:library>', '<xb:library>Unknown Pickup Library</xb:library>')] )
+        os.environ['ANX_ALMA__CLAIM_FILES'] = 'true'
+        with self.assertRaises( Exception ):
+            Controller().process_requests()
+        self.assertEqual( ['BUL_ANNEX-sample.xml', 'processing'], sorted(os.listdir(self.dirs['source'])) )
+        self.assertEqual( [], os.listdir(f'{self.dirs["source"]}/processing') )
+
+    def test_process_requests__split_batches(self):
+        self.drop_sample()
+        os.environ['ANX_ALMA__GFA_MAX_BATCH_SIZE'] = '5'
+        Controller().process_requests()
+        count_file_names = sorted( os.listdir(self.dirs['gfa_count']) )
+        data_file_names = sorted( os.listdir(self.dirs['gfa_data']) )
+        self.assertEqual( ['_001.cnt', '_002.cnt', '_003.cnt'], [name[-8:] for name in count_file_names] )
+        self.assertEqual( [name.replace('.cnt', '.dat') for name in count_file_names], data_file_names )
+        counts = []
+        for count_file_name in count_file_names:
+            with open( f'{self.dirs["gfa_count"]}/{count_file_name}' ) as f:
+                counts.append( f.read() )
+        self.assertEqual( ['5\n', '5\n', '2\n'], counts )
+        self.assertEqual( 12, len(self.read_gfa_data_lines()) )
+        ## the parsed archive stays one file
+        self.assertEqual( 1, len(os.listdir(self.dirs['archived_parsed'])) )
+
+    def test_process_requests__quarantine_mode_streams_batches(self):
+        """ In quarantine-mode each batch goes to GFA as soon as it's prepared, and archived before it goes. """
+        self.drop_sample()
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'true'
+        os.environ['ANX_ALMA__GFA_MAX_BATCH_SIZE'] = '5'
+        controller = Controller()
+        events = []
+        ( original_prepare_batch, original_save_parsed, original_send_gfa_batches ) = ( controller.prepare_batch, controller.save_parsed, controller.send_gfa_batches )
+        controller.prepare_batch = lambda *args: ( events.append('prepare'), original_prepare_batch(*args) )[1]
+        controller.save_parsed = lambda *args: ( events.append('archive'), original_save_parsed(*args) )[1]
+        controller.send_gfa_batches = lambda *args: ( events.append('send'), original_send_gfa_batches(*args) )[1]
+        controller.process_requests()
+        self.assertEqual( ['prepare', 'archive', 'send'] * 3, events )
+        self.assertEqual( ['_001.cnt', '_002.cnt', '_003.cnt'], sorted(name[-8:] for name in os.listdir(self.dirs['gfa_count'])) )
+        parsed_names = os.listdir( self.dirs['archived_parsed'] )
+        with open( f'{self.dirs["archived_parsed"]}/{parsed_names[0]}', encoding='utf-8' ) as f:
+            self.assertEqual( ''.join(self.read_gfa_data_lines()), f.read() )   # the archive ends up holding every batch
+
+    def test_process_requests__streamed_archive_failure_after_send(self):
+        """ Once a streamed batch has gone to GFA, a failed archive-write is logged, not raised; the original is finished, so nothing is re-sent. """
+        self.drop_sample()
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'true'
+        os.environ['ANX_ALMA__GFA_MAX_BATCH_SIZE'] = '5'
+        controller = Controller()
+        controller_arcvr = Archiver()
+        ( original_save_parsed, calls ) = ( controller_arcvr.save_parsed_to_archives, [] )
+        def failing_after_first( text, datetime_stamp, destination_dir_path ):
+            calls.append( text )
+            return original_save_parsed( text, datetime_stamp, destination_dir_path ) if len( calls ) == 1 else ( False, 'OSError(28, "No space left on device")' )
+        controller_arcvr.save_parsed_to_archives = failing_after_first
+        controller.run_process_file( controller_arcvr, make_parser('bs4'), f'{self.dirs["source"]}/BUL_ANNEX-sample.xml' )
+        self.assertEqual( [], os.listdir(self.dirs['source']) )
+        self.assertEqual( 3, len(os.listdir(self.dirs['gfa_count'])) )
+        self.assertEqual( 12, len(list(csv.reader(io.StringIO(''.join(self.read_gfa_data_lines()))))) )
+
+    def test_process_requests__no_split_under_limit(self):
+        self.drop_sample()
+        os.environ['ANX_ALMA__GFA_MAX_BATCH_SIZE'] = '12'
+        Controller().process_requests()
+        count_file_names = os.listdir( self.dirs['gfa_count'] )
+        self.assertEqual( 1, len(count_file_names) )
+        self.assertTrue( re.match(r'^REQ-PARSED_\d{4}-\d\d-\d\dT\d\d-\d\d-\d\d\.cnt$', count_file_names[0]) )
+
+    def test_process_requests__spooled_through_outage(self):
+        self.drop_sample()
+        os.environ['ANX_ALMA__PATH_TO_SPOOL_DIRECTORY'] = f'{self.temp_dir}/spool'
+        os.mkdir( f'{self.temp_dir}/spool' )
+        os.rmdir( self.dirs['gfa_data'] )   # destination outage
+        controller = Controller()
+        controller.spooler.retry_base_seconds = 0   # so the retry is due on the next run
+        controller.process_requests()
+        self.assertEqual( [], os.listdir(self.dirs['source']) )   # parse-work is kept, so no reparse
+        self.assertEqual( 1, Spooler(f'{self.temp_dir}/spool').depth() )
+        self.assertEqual( 1, controller.status.snapshot()['spool_depth'] )
+        os.mkdir( self.dirs['gfa_data'] )   # destination back
+        with self.assertRaises( SystemExit ):
+            controller.process_requests()   # no new file, but the spool is retried
+        self.assertEqual( 0, Spooler(f'{self.temp_dir}/spool').depth() )
+        self.assertEqual( 0, controller.status.snapshot()['spool_depth'] )
+        self.assertEqual( 12, len(self.read_gfa_data_lines()) )
+        self.assertEqual( 1, len(os.listdir(self.dirs['gfa_count'])) )
+
+    def test_process_requests__spool_pass_failure_after_send(self):
+        """ Once the file's deliveries are spooled, a failed delivery-pass is logged, not raised; the original is finished, so nothing is re-sent. """
+        self.drop_sample()
+        os.environ['ANX_ALMA__PATH_TO_SPOOL_DIRECTORY'] = f'{self.temp_dir}/spool'
+        os.mkdir( f'{self.temp_dir}/spool' )
+        controller = Controller()
+        controller.spooler.deliver_pending = lambda now=None: ( [], 'PermissionError(13, "Permission denied")' )
+        controller.run_process_file( Archiver(), make_parser('bs4'), f'{self.dirs["source"]}/BUL_ANNEX-sample.xml' )
+        self.assertEqual( [], os.listdir(self.dirs['source']) )
+        self.assertEqual( ( 1, 1 ), ( Spooler(f'{self.temp_dir}/spool').depth(), controller.status.snapshot()['spool_depth'] ) )
+        with self.assertRaises( Exception ):
+            controller.deliver_spooled()   # a pass on its own still raises
+
+    def test_process_requests__pipeline_mode_matches_sequential(self):
+        self.drop_sample()
+        Controller().process_requests()
+        sequential_lines = self.read_gfa_data_lines()
+        for dir_name in ( 'archived_originals', 'archived_parsed', 'gfa_count', 'gfa_data' ):
+            shutil.rmtree( self.dirs[dir_name] ); os.mkdir( self.dirs[dir_name] )
+        self.drop_sample()
+        os.environ['ANX_ALMA__PIPELINE_MODE'] = 'true'
+        Controller().process_requests()
+        self.assertEqual( [], os.listdir(self.dirs['source']) )
+        self.assertEqual( sequential_lines, self.read_gfa_data_lines() )
+        self.assertEqual( 1, len(os.listdir(self.dirs['archived_originals'])) )
+        parsed_file_names = os.listdir( self.dirs['archived_parsed'] )
+        with open( f'{self.dirs["archived_parsed"]}/{parsed_file_names[0]}', encoding='utf-8' ) as f:
+            self.assertEqual( ''.join(sequential_lines), f.read() )
+
+    def test_process_requests__pipeline_mode_archive_failure(self):
+        self.drop_sample()
+        os.environ['ANX_ALMA__PIPELINE_MODE'] = 'true'
+        os.rmdir( self.dirs['archived_originals'] )
+        with self.assertRaises( Exception ):
+            Controller().process_requests()
+        self.assertEqual( ['BUL_ANNEX-sample.xml'], os.listdir(self.dirs['source']) )   # nothing is written before the original is archived
+        self.assertEqual( [], os.listdir(self.dirs['gfa_data']) )
+        self.assertEqual( [], os.listdir(self.dirs['archived_parsed']) )
+
+    def test_process_requests__jsonl_sidecar(self):
+        self.drop_sample( replacements=[('<xb:library>Sciences Library</xb:library>', '<xb:library>Unknown Pickup Library</xb:library>')] )
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'true'
+        os.environ['ANX_ALMA__WRITE_JSONL_SIDECAR'] = 'true'
+        Controller().process_requests()
+        jsonl_file_names = [ name for name in os.listdir(self.dirs['archived_parsed']) if name.endswith('.jsonl') ]
+        self.assertEqual( 1, len(jsonl_file_names) )
+        with open( f'{self.dirs["archived_parsed"]}/{jsonl_file_names[0]}', encoding='utf-8' ) as f:
+            records = [ json.loads(line) for line in f ]
+        self.assertEqual( 11, len(records) )   # quarantined record left out, like the GFA file
+        gfa_lines = self.read_gfa_data_lines()
+        self.assertEqual( [ line.split('","')[0].lstrip('"') for line in gfa_lines ], [ record['item_id'] for record in records ] )
+        self.assertEqual( {
+            'request_id': '2404662150006966', 'request_type': 'PATRON_PHYSICAL', 'mms_id': '991008052689706966',
+            'item_id': '2332679300006966', 'item_barcode': '31236011508853', 'item_title': 'Education.',
+            'patron_name': 'Last, First', 'patron_barcode': '12345678901234', 'patron_email': 'first_last@brown.edu', 'patron_note': 'test note A',
+            'alma_pickup_library': 'Rockefeller Library', 'alma_library_code': 'ROCK', 'parsed_alma_pickup_library': 'Rockefeller Library',
+            'gfa_delivery': 'RO', 'gfa_location': 'QS', 'gfa_date_str': records[0]['gfa_date_str'] }, records[0] )
+
+    def test_process_requests__memprofile(self):
+        self.drop_sample()
+        Controller( memprofile=True ).process_requests()
+        report_file_names = [ name for name in os.listdir(self.dirs['archived_parsed']) if name.startswith('REQ-ALMA-MEMPROFILE_') ]
+        self.assertEqual( 1, len(report_file_names) )
+        with open( f'{self.dirs["archived_parsed"]}/{report_file_names[0]}', encoding='utf-8' ) as f:
+            report = f.read()
+        self.assertEqual( ['start', 'archived', 'loaded', 'item_list', 'prepared', 'written'], re.findall(r'^stage `(\w+)`', report, re.MULTILINE) )
+        self.assertFalse( tracemalloc.is_tracing() )
+
+    def test_process_requests__cprofile(self):
+        self.drop_sample()
+        os.environ['ANX_ALMA__CPROFILE'] = 'true'
+        Controller().process_requests()
+        stats_file_names = [ name for name in os.listdir(self.dirs['archived_parsed']) if name.endswith('.pstats') ]
+        self.assertEqual( 1, len(stats_file_names) )
+        ## named after the run's datetime-stamp
+        self.assertEqual( os.listdir(self.dirs['gfa_count'])[0].replace('REQ-PARSED_', '').replace('.cnt', ''), stats_file_names[0].replace('REQ-ALMA-CPROFILE_', '').replace('.pstats', '') )
+        summary = summarize_stats( f'{self.dirs["archived_parsed"]}/{stats_file_names[0]}', top_n=50 )
+        self.assertTrue( 'parse_element' in summary )
+
+    def test_process_requests__cprofile_pipeline_mode(self):
+        """ In pipeline-mode the parsing runs on a worker-thread; its hot spots still make the stats. """
+        self.drop_sample()
+        os.environ['ANX_ALMA__CPROFILE'] = 'true'
+        os.environ['ANX_ALMA__PIPELINE_MODE'] = 'true'
+        Controller().process_requests()
+        stats_file_names = [ name for name in os.listdir(self.dirs['archived_parsed']) if name.endswith('.pstats') ]
+        summary = summarize_stats( f'{self.dirs["archived_parsed"]}/{stats_file_names[0]}', top_n=80 )
+        self.assertTrue( 'parse_alma_request' in summary )
+
+    def test_process_requests__lxml_engine_quarantine(self):
+        self.drop_sample( replacements=[('<xb:library>Sciences Library</xb:library>', '<xb:library>Unknown Pickup Library</xb:library>')] )
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'true'
+        os.environ['ANX_ALMA__PARSER_ENGINE'] = 'lxml'
+        Controller().process_requests()
+        self.assertEqual( 11, len(self.read_gfa_data_lines()) )
+        quarantine_file_names = os.listdir( self.dirs['quarantine'] )
+        with open( f'{self.dirs["quarantine"]}/{quarantine_file_names[0]}', encoding='utf-8' ) as f:
+            ( items, err ) = Parser().make_item_list( f.read() )   # still a valid rsExportList
+        self.assertEqual( ( 1, None ), ( len(items), err ) )
+        self.assertEqual( ( 'Unknown Pickup Library', None ), Parser().parse_alma_pickup_library(items[0]) )
+
+    def test_process_requests__preflight_uses_mapping_config(self):
+        """ With a config mapping John Hay's delivery-stop to a location, record 1 needs no `libraryCode`; preflight follows the controller's config. """
+        config_path = f'{self.temp_dir}/mapping_config.json'
+        with open( config_path, 'w' ) as f:
+            json.dump( {'gfa_delivery_to_gfa_location': {'ED': 'QS', 'EH': 'QH', 'RO': 'QS', 'HA': 'QH'}}, f )
+        self.drop_sample( replacements=[('<xb:libraryCode>HAY</xb:libraryCode>', '')] )
+        os.environ['ANX_ALMA__PREFLIGHT'] = 'true'
+        Controller( mapping_config=MappingConfig(config_path) ).process_requests()
+        self.assertEqual( [], os.listdir(self.dirs['source']) )
+        self.assertEqual( 12, len(self.read_gfa_data_lines()) )
+
+    def test_process_requests__preflight_rejects_truncated_file(self):
+        self.drop_sample( replacements=[('</xb:rsExportList>', '')] )
+        os.environ['ANX_ALMA__PREFLIGHT'] = 'true'
+        with self.assertRaises( Exception ):
+            Controller().process_requests()
+        self.assertEqual( ['BUL_ANNEX-sample.xml'], os.listdir(self.dirs['source']) )
+        self.assertEqual( [], os.listdir(self.dirs['archived_originals']) )   # rejected before archiving
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'true'
+        Controller().process_requests()
+        self.assertEqual( [], os.listdir(self.dirs['source']) )
+        self.assertEqual( ['.txt', '.xml'], sorted(os.path.splitext(name)[1] for name in os.listdir(self.dirs['quarantine'])) )
+        self.assertEqual( [], os.listdir(self.dirs['gfa_data']) )
+
+    def test_run_resident__unique_stamps_and_status(self):
+        self.drop_sample()
+        os.rename( f'{self.dirs["source"]}/BUL_ANNEX-sample.xml', f'{self.dirs["source"]}/BUL_ANNEX-first.xml' )
+        self.drop_sample()
+        os.environ['ANX_ALMA__RESIDENT_POLL_SECONDS'] = '0'
+        controller = Controller()
+        controller.run_resident( max_iterations=3 )   # two files, then no file
+        self.assertEqual( [], os.listdir(self.dirs['source']) )
+        self.assertEqual( 2, len(os.listdir(self.dirs['gfa_count'])) )   # two files within a second still get distinct stamps
+        status = controller.status.snapshot()
+        self.assertEqual( ( 'no file', '', 2, None, 0 ), ( status['last_run_result'], status['last_run_stamp'], status['recent_run_count'], status['in_flight'], status['pending_file_count'] ) )   # the third run found nothing
+        self.assertTrue( status['records_per_second'] > 0 )
+        self.assertTrue( status['last_run_finished_at'] > time.time() - 60 )
+
+    def test_process_requests__rollup_matches_backfill(self):
+        self.drop_sample( replacements=[('<xb:library>Sciences Library</xb:library>', '<xb:library>Unknown Pickup Library</xb:library>')] )
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'true'
+        os.environ['ANX_ALMA__ROLLUP_DB_PATH'] = f'{self.temp_dir}/rollup.sqlite'
+        Controller().process_requests()
+        store = RollupStore( f'{self.temp_dir}/rollup.sqlite' )
+        ( rows, err ) = store.report()
+        self.assertEqual( 11, sum(row['request_count'] for row in rows) )   # the quarantined record isn't counted
+        backfilled_store = RollupStore( f'{self.temp_dir}/backfilled.sqlite' )
+        ( summary, err ) = rollup.backfill( backfilled_store, self.dirs['archived_parsed'], self.dirs['archived_originals'] )   # request-types from the archived original
+        self.assertEqual( (1, 0), (summary['added'], summary['unknown_request_types']) )
+        self.assertEqual( rows, backfilled_store.report()[0] )
+        self.assertEqual( 1, rollup.backfill(store, self.dirs['archived_parsed'])[0]['skipped'] )   # already rolled up by the run
+        store.close()
+        backfilled_store.close()
+
+    def test_process_requests__manifests_match_deliveries(self):
+        self.drop_sample()
+        os.environ['ANX_ALMA__GFA_MAX_BATCH_SIZE'] = '5'
+        os.environ['ANX_ALMA__PATH_TO_MANIFEST_DIRECTORY'] = self.dirs['archived_parsed']
+        Controller().process_requests()
+        manifest_names = sorted( name for name in os.listdir(self.dirs['archived_parsed']) if name.endswith('.manifest.json') )
+        self.assertEqual( 3, len(manifest_names) )
+        original_name = os.listdir( self.dirs['archived_originals'] )[0]
+        with open( f'{self.dirs["archived_originals"]}/{original_name}', 'rb' ) as f:
+            original_sha256 = hashlib.sha256( f.read() ).hexdigest()
+        arcvr = Archiver()
+        barcodes = []
+        for manifest_name in manifest_names:
+            with open( f'{self.dirs["archived_parsed"]}/{manifest_name}', encoding='utf-8' ) as f:
+                manifest = json.load( f )
+            with open( f'{self.dirs["gfa_data"]}/{manifest["data_file"]["name"]}', 'rb' ) as f:
+                data = f.read()
+            self.assertEqual( (hashlib.sha256(data).hexdigest(), len(data)), (manifest['data_file']['sha256'], manifest['data_file']['byte_length']) )
+            with open( f'{self.dirs["gfa_count"]}/{manifest["count_file"]["name"]}', encoding='utf-8' ) as f:
+                self.assertEqual( manifest['record_count'], int(f.read()) )
+            self.assertEqual( (original_name, original_sha256), (manifest['source']['archived_original'], manifest['source']['sha256']) )
+            self.assertEqual( [fields[1] for fields in csv.reader(io.StringIO(data.decode('utf-8')))], manifest['item_barcodes'] )
+            self.assertEqual( ([], None), arcvr.verify_gfa_delivery(f'{self.dirs["archived_parsed"]}/{manifest_name}', self.dirs['gfa_data']) )
+            barcodes.extend( manifest['item_barcodes'] )
+        self.assertEqual( 12, len(barcodes) )
+        self.assertEqual( manifest['source']['archive_stamp'], parse_file_stamp(manifest_names[0]) )   # retention keeps a run's manifests with its other files
+        ## a changed delivery is caught
+        with open( f'{self.dirs["gfa_data"]}/{manifest["data_file"]["name"]}', 'ab' ) as f:
+            f.write( b'"extra"\n' )
+        ( problems, err ) = arcvr.verify_gfa_delivery( f'{self.dirs["archived_parsed"]}/{manifest_names[-1]}', self.dirs['gfa_data'] )
+        self.assertEqual( 2, len(problems) )   # sha256 & byte-length
+
+    def test_process_requests__failed_archive_sends_nothing(self):
+        """ A failed parsed-archive write leaves the original for the next run, so GFA mustn't have been sent anything -- in quarantine-mode, with batches, too. """
+        self.drop_sample()
+        os.environ['ANX_ALMA__QUARANTINE_MODE'] = 'true'
+        os.environ['ANX_ALMA__GFA_MAX_BATCH_SIZE'] = '5'
+        for pipeline_mode in ( 'false', 'true' ):
+            os.environ['ANX_ALMA__PIPELINE_MODE'] = pipeline_mode
+            controller = Controller()
+            controller_arcvr = Archiver()
+            controller_arcvr.save_parsed_to_archives = lambda text, datetime_stamp, destination_dir_path: ( False, 'OSError(28, "No space left on device")' )
+            with self.assertRaises( Exception ):
+                controller.run_process_file( controller_arcvr, make_parser('bs4'), f'{self.dirs["source"]}/BUL_ANNEX-sample.xml' )
+            self.assertEqual( ([], []), (os.listdir(self.dirs['gfa_count']), os.listdir(self.dirs['gfa_data'])) )
+            self.assertEqual( ['BUL_ANNEX-sample.xml'], os.listdir(self.dirs['source']) )
+
+    def test_process_requests__s3_storage_backend(self):
+        """ Every directory in one object-store bucket; the original is read through the store, not mapped, and preflight streams it from there too. """
+        try:
+            import boto3, moto
+        except ImportError:
+            self.skipTest( 'boto3 & moto not installed' )
+        os.environ.update( {
+            'ANX_ALMA__STORAGE_BACKEND': 's3', 'ANX_ALMA__S3_BUCKET': 'annex', 'ANX_ALMA__S3_KEY_PREFIX': 'prod/', 'ANX_ALMA__PREFLIGHT': 'true',
+            'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test' } )
+        with moto.mock_aws():
+            controller = Controller()
+            controller.storage.client.create_bucket( Bucket='annex' )
+            with open( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml', 'rb' ) as f:
+                controller.storage.put( f'{self.dirs["source"]}/BUL_ANNEX-sample.xml', f.read() )
+            controller.process_requests()
+            self.assertEqual( [], controller.storage.list(self.dirs['source']) )
+            self.assertEqual( 1, len(controller.storage.list(self.dirs['archived_originals'])) )
+            data_file_name = controller.storage.list( self.dirs['gfa_data'] )[0]
+            with controller.storage.open_stream( f'{self.dirs["gfa_data"]}/{data_file_name}' ) as stream:
+                self.assertEqual( 12, len(list(csv.reader(io.StringIO(stream.read().decode('utf-8'))))) )
+        self.assertEqual( [], os.listdir(self.dirs['gfa_data']) )   # nothing written locally
+        os.environ['ANX_ALMA__CLAIM_FILES'] = 'true'
+        with self.assertRaises( ValueError ):   # claims rename local files
+            Controller()
+
+    def test_process_requests__s3_storage_backend_spooled(self):
+        """ The spool stays on local disk, but its deliveries go to the bucket, like unspooled gfa files. """
+        try:
+            import boto3, moto
+        except ImportError:
+            self.skipTest( 'boto3 & moto not installed' )
+        os.environ.update( {
+            'ANX_ALMA__STORAGE_BACKEND': 's3', 'ANX_ALMA__S3_BUCKET': 'annex', 'ANX_ALMA__PATH_TO_SPOOL_DIRECTORY': f'{self.temp_dir}/spool',
+            'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test' } )
+        os.mkdir( f'{self.temp_dir}/spool' )
+        with moto.mock_aws():
+            controller = Controller()
+            controller.storage.client.create_bucket( Bucket='annex' )
+            with open( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml', 'rb' ) as f:
+                controller.storage.put( f'{self.dirs["source"]}/BUL_ANNEX-sample.xml', f.read() )
+            controller.process_requests()
+            self.assertEqual( ( 1, 1 ), ( len(controller.storage.list(self.dirs['gfa_count'])), len(controller.storage.list(self.dirs['gfa_data'])) ) )
+        self.assertEqual( ( [], [], 0 ), ( os.listdir(self.dirs['gfa_count']), os.listdir(self.dirs['gfa_data']), Spooler(f'{self.temp_dir}/spool').depth() ) )
+
+    ## -- helpers -------------------------------
+
+    def drop_sample( self, replacements=() ):
+        """ Copies the static sample into the source-directory, applying any (old, new) text replacements. """
+        with open( f'{TEST_DIRS_PATH}/static_source/BUL_ANNEX-sample.xml', encoding='utf-8' ) as f:
+            text = f.read()
+        for ( old, new ) in replacements:
+            text = text.replace( old, new )
+        with open( f'{self.dirs["source"]}/BUL_ANNEX-sample.xml', 'w', encoding='utf-8' ) as f:
+            f.write( text )
+        return
+
+    def read_gfa_data_lines( self ):
+        lines = []
+        for data_file_name in sorted( os.listdir(self.dirs['gfa_data']) ):
+            with open( f'{self.dirs["gfa_data"]}/{data_file_name}', encoding='utf-8' ) as f:
+                lines.extend( f.readlines() )
+        return lines
+
+    ## end class ControllerTest()
+
+
 if __name__ == '__main__':
   unittest.main()